@@ -26,5 +26,10 @@ setup(
         "web3~=5.0",
         "pygit2~=1.0",
         "docker~=4.0",
+        "blake3~=1.0",
+        "requests~=2.0",
+        "rlp>=1.0,<3",
+        "eth-utils~=1.0",
+        "eth-keys~=0.3",
     ],
 )
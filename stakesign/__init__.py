@@ -2,7 +2,46 @@ import os
 import sys
 from argparse import ArgumentParser, Action
 import importlib_metadata
-from . import verify, prepare
+from . import verify, prepare, bundle, shard
+from .api import (
+    verify_signature,
+    prepare_payload,
+    prepare_chunk_root,
+    fetch_signature,
+    check_signature,
+    verify_objects,
+    Cache,
+    StakesignError,
+    SignatureNotFound,
+    GatewayError,
+    GatewayUnavailable,
+    InvalidSignature,
+    SignatureExpired,
+    InsufficientStake,
+    VerificationFailed,
+    PrepareFailed,
+    UsageError,
+)
+
+__all__ = [
+    "verify_signature",
+    "prepare_payload",
+    "prepare_chunk_root",
+    "fetch_signature",
+    "check_signature",
+    "verify_objects",
+    "Cache",
+    "StakesignError",
+    "SignatureNotFound",
+    "GatewayError",
+    "GatewayUnavailable",
+    "InvalidSignature",
+    "SignatureExpired",
+    "InsufficientStake",
+    "VerificationFailed",
+    "PrepareFailed",
+    "UsageError",
+]
 
 
 def main():
@@ -14,11 +53,16 @@ def main():
         help="show package version information",
     )
 
+    from . import audit  # pylint: disable=C0415
+
     subparsers = parser.add_subparsers()
     subparsers.required = True
     subparsers.dest = "command"
     verify.cli_subparser(subparsers)
     prepare.cli_subparser(subparsers)
+    shard.cli_subparser(subparsers)
+    bundle.cli_subparser(subparsers)
+    audit.cli_subparser(subparsers)
 
     replace_COLUMNS = os.environ.get("COLUMNS", None)
     os.environ["COLUMNS"] = "120"  # make help descriptions wider
@@ -41,6 +85,12 @@ def main():
         verify.cli(args)
     elif args.command == "prepare":
         prepare.cli(args)
+    elif args.command == "merge":
+        shard.cli(args)
+    elif args.command == "bundle":
+        bundle.cli(args)
+    elif args.command == "audit":
+        audit.cli(args)
     else:
         assert False
 
@@ -0,0 +1,779 @@
+import os
+import time
+import json
+import hashlib
+import functools
+import threading
+from datetime import datetime
+import requests
+import web3
+from web3.datastructures import AttributeDict
+from .eth import (
+    DEFAULT_STAKE_FLOOR_ETH,
+    get_sig,
+    select_gateway,
+    decode_sig_input,
+    check_sig_expire,
+    check_sig_stake,
+)
+from . import manifest, payload, b3sum, iosched, ratelimit, chunked
+
+# Python API: verify & prepare signatures without printing or exiting, for embedding stakesign in
+# other tools. Results are AttributeDicts and failures raise StakesignError subclasses. Callers
+# verifying many signatures should pass the same w3 and Cache to every call, reusing the gateway
+# connection and the (immutable) signature transactions.
+
+MODES = payload.MODES
+CHUNK_SIZE = 1 << 20
+
+
+class StakesignError(Exception):
+    "base of the exceptions raised by the API; result holds any details determined before failing"
+
+    def __init__(self, msg, result=None):
+        super().__init__(msg)
+        self.result = result
+
+
+class SignatureNotFound(StakesignError):
+    "signature transaction not found (or still pending) on the network"
+
+
+class GatewayError(StakesignError):
+    "ETH gateway request failed (JSON-RPC or transport error), so the outcome is unknown"
+
+
+class GatewayUnavailable(GatewayError):
+    "ETH gateway kept throttling or timing out (even with backoff), so the outcome is unknown"
+
+
+class InvalidSignature(StakesignError):
+    "transaction input isn't a valid stakesign payload (or isn't of a supported mode)"
+
+
+class SignatureExpired(StakesignError):
+    "signature's stated expiration date has passed"
+
+
+class InsufficientStake(StakesignError):
+    "signer's ETH balance is below the required stake"
+
+
+class VerificationFailed(StakesignError):
+    "local files/commits/images don't match the signature (or aren't what it applies to)"
+
+
+class PrepareFailed(StakesignError):
+    "failed to prepare signature payload for the given objects"
+
+
+class UsageError(StakesignError, ValueError):
+    "invalid arguments or combination of options"
+
+
+# errors from ETH gateway queries, besides TransactionNotFound (web3 raises ValueError for JSON-RPC
+# errors)
+GATEWAY_ERRORS = (ratelimit.ErrorMessage, ValueError, requests.exceptions.RequestException)
+
+
+def gateway_error(err):
+    "GatewayError for one of GATEWAY_ERRORS"
+    if isinstance(err, ratelimit.ErrorMessage):
+        return GatewayUnavailable(err.args[0])
+    return GatewayError(f"ETH gateway request failed: {err}")
+
+
+class Cache:
+    """
+    signature transactions (immutable once mined) & signer balances (reused for balance_ttl
+    seconds) to share across API calls; safe to use from multiple threads
+    """
+
+    def __init__(self, balance_ttl=60.0):
+        self.balance_ttl = balance_ttl
+        self._sigs = {}
+        self._balances = {}
+        self._lock = threading.Lock()
+
+    def sig(self, w3, txid):
+        key = txid.lower()
+        with self._lock:
+            sig = self._sigs.get(key)
+        if sig is None:
+            sig = get_sig(w3, txid)
+            with self._lock:
+                self._sigs[key] = sig
+        return sig
+
+    def balance(self, w3, address):
+        with self._lock:
+            cached = self._balances.get(address)
+        if cached and time.monotonic() - cached[1] < self.balance_ttl:
+            return cached[0]
+        wei = w3.eth.getBalance(address)
+        with self._lock:
+            self._balances[address] = (wei, time.monotonic())
+        return wei
+
+
+def default_w3():
+    """
+    web3 for the ETH gateway `stakesign` would use (as eth.select_gateway: environment
+    WEB3_PROVIDER_URI, or else a local node's IPC socket, or else the default public gateway)
+    """
+    from web3.providers.auto import load_provider_from_uri  # pylint: disable=C0415
+
+    uri, _, w3, _ = select_gateway()
+    try:
+        return w3 or ratelimit.install(web3.Web3(load_provider_from_uri(uri)))
+    except ratelimit.SettingError as err:
+        raise UsageError(err.args[0]) from None
+
+
+def fetch_signature(txid, w3=None, cache=None, jobs=8):
+    """
+    query signature transaction; return AttributeDict of sig (as eth.get_sig), header, body, and
+    parts (for a chunked signature, the part sigs, fetched up to jobs at a time & reassembled into
+    header & body for mode-specific verification)
+    """
+    if not (isinstance(txid, str) and txid.startswith("0x")):
+        raise InvalidSignature("Transaction ID should start with 0x")
+    w3 = w3 or default_w3()
+    try:
+        sig = cache.sig(w3, txid) if cache else get_sig(w3, txid)
+    except web3.exceptions.TransactionNotFound as err:
+        raise SignatureNotFound(
+            "Transaction not found on Ethereum network; check transaction ID, or try later or through another gateway: "
+            + str(err)
+        ) from None
+    except GATEWAY_ERRORS as err:
+        raise gateway_error(err) from None
+    try:
+        header, body = decode_sig_input(w3, sig)
+    except ValueError as err:
+        raise InvalidSignature(str(err)) from None
+    parts = []
+    if header["stakesign"] == "chunked":
+        try:
+            header, body, parts = chunked.assemble(
+                sig,
+                header,
+                (lambda part: cache.sig(w3, part)) if cache else (lambda part: get_sig(w3, part)),
+                jobs=jobs,
+            )
+        except web3.exceptions.TransactionNotFound as err:
+            raise SignatureNotFound(f"Signature part transaction not found: {err}") from None
+        except chunked.ErrorMessage as err:
+            raise InvalidSignature(err.args[0]) from None
+        except GATEWAY_ERRORS as err:
+            raise gateway_error(err) from None
+    return AttributeDict({"sig": sig, "header": header, "body": body, "parts": parts})
+
+
+def check_signature(
+    w3,
+    sig,
+    header,
+    stake_floor_eth=DEFAULT_STAKE_FLOOR_ETH,
+    ignore_ad=False,
+    expired_ok=False,
+    utcnow=None,
+    cache=None,
+    signer_wei=None,
+):  # pylint: disable=R0913
+    """
+    check signature expiration & signer's stake; return AttributeDict of expire & stake info (as
+    eth.check_sig_expire & check_sig_stake, the latter including any warnings)
+    """
+    utcnow = utcnow or datetime.utcnow().replace(tzinfo=None)
+    try:
+        exinfo = check_sig_expire(header, utcnow)
+    except ValueError as err:
+        raise InvalidSignature(str(err)) from None
+    result = AttributeDict({"expire": exinfo, "stake": None})
+    if exinfo.expire_utc is not None and not (expired_ok or exinfo.unexpired):
+        raise SignatureExpired("Signature's stated expiration date has passed", result)
+    if signer_wei is None:
+        try:
+            signer_wei = cache.balance(w3, sig.signer) if cache else w3.eth.getBalance(sig.signer)
+        except GATEWAY_ERRORS as err:
+            raise gateway_error(err) from None
+    try:
+        vs = check_sig_stake(
+            w3,
+            sig,
+            header,
+            w3.toWei(stake_floor_eth, "ether"),
+            ignore_ad=ignore_ad,
+            signer_wei=signer_wei,
+        )
+    except ValueError as err:
+        raise InvalidSignature(str(err)) from None
+    result = AttributeDict({"expire": exinfo, "stake": vs})
+    if not vs.enough:
+        raise InsufficientStake(
+            "Signer's address holds insufficient ETH balance, possibly indicating revocation or compromise!",
+            result,
+        )
+    return result
+
+
+def verify_objects(
+    header,
+    body,
+    expect=None,
+    cwd=None,
+    ignore_missing=False,
+    git_revision=None,
+    recursive=False,
+    docker_handle=None,
+    docker_archive=None,
+    verify_layers=False,
+    archive=None,
+    install=None,
+    urls=None,
+    jobs=4,
+    sha256sum_exe=None,
+    no_strict=False,
+    report=None,
+    quiet=True,
+    io_jobs=None,
+    mount_jobs=iosched.DEFAULT_MOUNT_JOBS,
+    tree=None,
+):  # pylint: disable=R0912,R0913,R0914
+    """
+    verify local files, git revision, or docker images against the (already trusted) signature.
+    expect is files, git, or docker to require the signature be of that kind. For files, reads
+    them from cwd by default; or from archive (tar/zip filename), from urls (dict of signed path to
+    http[s] URL), or copying them into install (directory). Unless sha256sum_exe is given to run,
+    reports each file's status to report(filename, status) and prints nothing if quiet. io_jobs
+    hashes local files in-process with that many concurrent readers (at most mount_jobs per network
+    filesystem; see iosched). tree (directory) verifies the files in it strictly, also failing on
+    (and reporting status UNEXPECTED for) any files it contains that aren't signed.
+    Returns AttributeDict of mode, verified (messages), warnings, files [(filename, status)], and io
+    (per-mount throughput, with io_jobs).
+    """
+    mode, kind = check_verify_options(
+        header,
+        expect=expect,
+        cwd=cwd,
+        recursive=recursive,
+        docker_archive=docker_archive,
+        verify_layers=verify_layers,
+        archive=archive,
+        install=install,
+        urls=urls,
+        io_jobs=io_jobs,
+        tree=tree,
+    )
+
+    result = {"mode": mode, "verified": [], "warnings": [], "files": [], "io": []}
+    if kind == "files":
+        _verify_files(
+            header,
+            body,
+            result,
+            cwd=cwd,
+            ignore_missing=ignore_missing,
+            archive=archive,
+            install=install,
+            urls=urls,
+            jobs=jobs,
+            sha256sum_exe=sha256sum_exe,
+            no_strict=no_strict,
+            report=report,
+            quiet=quiet,
+            io_jobs=io_jobs,
+            mount_jobs=mount_jobs,
+            tree=tree,
+        )
+    elif kind == "git":
+        _verify_git(body, result, cwd, git_revision, recursive, ignore_missing, jobs)
+    else:
+        _verify_docker(
+            body, result, docker_handle, docker_archive, verify_layers, ignore_missing, jobs
+        )
+    return AttributeDict(result)
+
+
+def check_verify_options(
+    header,
+    expect=None,
+    cwd=None,
+    recursive=False,
+    docker_archive=None,
+    verify_layers=False,
+    archive=None,
+    install=None,
+    urls=None,
+    io_jobs=None,
+    tree=None,
+    **_,
+):  # pylint: disable=R0913
+    """
+    check the signature's mode is supported & compatible with the verify_objects options (other
+    kwargs ignored), before verifying anything; returns mode and kind (files, git, or docker)
+    """
+    mode = header["stakesign"]
+    if mode not in MODES:
+        raise InvalidSignature(
+            "Signing mode not one of {sha256sum, b3sum, git, docker}; a newer version of this utility might support the necessary mode."
+        )
+    kind = "files" if mode in ("sha256sum", "b3sum") else mode
+    if expect and expect != kind:
+        raise VerificationFailed(f"Signature applies to {kind}, not {expect}")
+    if (install or archive or urls) and kind != "files":
+        raise UsageError(f"install, archive, and urls apply to files, not {mode}")
+    if archive and (install or urls):
+        raise UsageError("archive can't be combined with install or urls")
+    if (docker_archive or verify_layers) and kind != "docker":
+        raise UsageError(f"docker_archive and verify_layers apply to docker, not {mode}")
+    if verify_layers and not docker_archive:
+        raise UsageError("verify_layers requires docker_archive")
+    if recursive and kind != "git":
+        raise UsageError(f"recursive applies to git, not {mode}")
+    if io_jobs and (kind != "files" or install or archive or urls):
+        raise UsageError("io_jobs applies to local files (not archive, install, or urls)")
+    if tree and (kind != "files" or any((install, archive, urls, cwd))):
+        raise UsageError("tree applies to local files (not archive, install, urls, or cwd)")
+    return mode, kind
+
+
+def _verify_files(
+    header,
+    body,
+    result,
+    cwd=None,
+    ignore_missing=False,
+    archive=None,
+    install=None,
+    urls=None,
+    jobs=4,
+    sha256sum_exe=None,
+    no_strict=False,
+    report=None,
+    quiet=True,
+    io_jobs=None,
+    mount_jobs=iosched.DEFAULT_MOUNT_JOBS,
+    tree=None,
+):  # pylint: disable=R0912,R0913,R0914
+    mode = header["stakesign"]
+    from . import install as install_, archive as archive_, remote  # pylint: disable=C0415
+    from . import tree as tree_  # pylint: disable=C0415
+
+    def collect(filename, status):
+        result["files"].append((filename, status))
+        if report:
+            report(filename, status)
+
+    options = {"ignore_missing": ignore_missing, "report": collect, "quiet": quiet}
+    new_hasher = hashlib.sha256
+    try:
+        if mode == "b3sum":
+            b3sum.blake3_version()
+            new_hasher = b3sum.new_hasher
+        if urls:
+            ok = remote.verify(body, urls, new_hasher, mode, jobs=jobs, dest=install, **options)
+        elif archive:
+            ok = archive_.verify(body, archive, new_hasher, mode, **options)
+        elif install:
+            ok = install_.install(body, install, new_hasher, mode, cwd=cwd, **options)
+        elif tree:
+            sched = iosched.Scheduler(io_jobs or 1, mount_jobs)
+            try:
+                ok = tree_.check(
+                    body,
+                    tree,
+                    lambda path: sched.hash_file(path, new_hasher),
+                    mode,
+                    jobs=sched.jobs,
+                    **options,
+                )
+            finally:
+                if io_jobs:
+                    result["io"] = sched.throughput()
+        elif io_jobs:
+            sched = iosched.Scheduler(io_jobs, mount_jobs)
+            try:
+                ok = iosched.check(body, sched, new_hasher, mode, cwd=cwd, **options)
+            finally:
+                result["io"] = sched.throughput()
+        elif mode == "b3sum":
+            ok = b3sum.verify(body, cwd=cwd, **options)
+        elif sha256sum_exe:
+            ok = manifest.verify_sha256sum(
+                header,
+                body,
+                sha256sum_exe,
+                ignore_missing=ignore_missing,
+                no_strict=no_strict,
+                cwd=cwd,
+            )
+        else:
+            ok = manifest.check(
+                body,
+                lambda filename, digest: hash_file(os.path.join(cwd or ".", filename), new_hasher)
+                == digest,
+                mode,
+                **options,
+            )
+    except (
+        manifest.ErrorMessage,
+        b3sum.ErrorMessage,
+        install_.ErrorMessage,
+        archive_.ErrorMessage,
+        remote.ErrorMessage,
+        tree_.ErrorMessage,
+    ) as err:
+        raise VerificationFailed(err.args[0], AttributeDict(result)) from None
+    except OSError as err:
+        raise VerificationFailed(f"{err.filename}: {err.strerror}", AttributeDict(result)) from None
+    if not ok:
+        raise VerificationFailed(f"{mode} verification failed!", AttributeDict(result))
+    result["verified"].extend(
+        f"Verified: {filename}" for filename, status in result["files"] if status == "OK"
+    )
+
+
+def _verify_git(
+    body, result, cwd, git_revision, recursive, ignore_missing, jobs
+):  # pylint: disable=R0913,R0914
+    from . import git  # pylint: disable=C0415
+
+    try:
+        repo_dir, repo = git.repository(cwd)
+    except Exception:  # pylint: disable=W0703
+        raise VerificationFailed(
+            "Signature pertains to git commit, but current working directory isn't a git repository"
+        ) from None
+    revision = git_revision or "HEAD"
+    result["repo_dir"] = repo_dir
+    result["revision"] = revision
+    try:
+        msg, warnings = git.verify(repo, revision, body, ignore_missing=ignore_missing)
+        result["verified"].append(msg)
+        if recursive:
+            sub_msgs, sub_warnings = git.verify_submodules(
+                repo_dir, repo, revision, body, ignore_missing, jobs
+            )
+            result["verified"].extend(sub_msgs)
+            warnings.update(sub_warnings)
+    except git.ErrorMessage as err:
+        raise VerificationFailed(err.args[0], AttributeDict(result)) from None
+    result["warnings"].extend(sorted(warnings))
+
+
+def _verify_docker(
+    body, result, docker_handle, docker_archive, verify_layers, ignore_missing, jobs
+):  # pylint: disable=R0913
+    from . import docker, oci  # pylint: disable=C0415
+
+    try:
+        local = None
+        if docker_archive:
+            local = oci.archive_images(docker_archive, verify_layers, jobs)
+        verified, warnings = docker.verify(
+            docker.DEFAULT_HOST, body, docker_handle, ignore_missing, local=local
+        )
+    except (docker.ErrorMessage, oci.ErrorMessage) as err:
+        raise VerificationFailed(err.args[0], AttributeDict(result)) from None
+    except OSError as err:
+        raise VerificationFailed(
+            f"{docker_archive}: {err.strerror}", AttributeDict(result)
+        ) from None
+    result["verified"].extend(verified)
+    result["warnings"].extend(sorted(warnings))
+
+
+def verify_signature(
+    txid,
+    w3=None,
+    cache=None,
+    stake_floor_eth=DEFAULT_STAKE_FLOOR_ETH,
+    ignore_ad=False,
+    expired_ok=False,
+    bundle=None,
+    utcnow=None,
+    **kwargs,
+):  # pylint: disable=R0913,R0914
+    """
+    Verify signature transaction & the local objects it signs, as `stakesign verify` does but
+    without printing. Optional w3 (web3.Web3 instance) & cache (Cache) should be reused across many
+    calls; or verify offline using bundle (filename from `stakesign bundle`). Other kwargs as for
+    verify_objects. Returns AttributeDict of sig, header, expire, stake, and verify_objects results;
+    raises StakesignError subclasses.
+    """
+    proof = None
+    if bundle:
+        from . import bundle as bundle_  # pylint: disable=C0415
+
+        w3 = web3.Web3  # for unit conversions only; no network access
+        try:
+            sig, proof = bundle_.load(bundle)
+        except bundle_.ErrorMessage as err:
+            raise InvalidSignature(err.args[0]) from None
+        if sig.id.lower() != txid.lower():
+            raise InvalidSignature("Bundle pertains to a different transaction")
+        try:
+            header, body = decode_sig_input(w3, sig)
+        except ValueError as err:
+            raise InvalidSignature(str(err)) from None
+        if header["stakesign"] == "chunked":
+            raise InvalidSignature("Bundles don't cover the parts of chunked signatures")
+    else:
+        w3 = w3 or default_w3()
+        sig, header, body = (
+            fetch_signature(txid, w3=w3, cache=cache)[key] for key in ("sig", "header", "body")
+        )
+    checked = check_signature(
+        w3,
+        sig,
+        header,
+        stake_floor_eth=stake_floor_eth,
+        ignore_ad=ignore_ad,
+        expired_ok=expired_ok,
+        utcnow=utcnow,
+        cache=cache,
+        signer_wei=(proof.signer_wei if proof else None),
+    )
+    result = verify_objects(header, body, **kwargs)
+    return AttributeDict(
+        dict(
+            result,
+            sig=sig,
+            header=header,
+            expire=checked.expire,
+            stake=checked.stake,
+            proof=proof,
+        )
+    )
+
+
+def payload_header(mode, stake_ad=None, expire=None):
+    "signature header line (str), given mode, advisory stake (ETH), and expiration (UTC datetime)"
+    assert mode in MODES
+    header = {"stakesign": mode}
+    if isinstance(expire, datetime):
+        header["expire"] = f"{expire.replace(tzinfo=None)}Z"
+    if stake_ad is not None:
+        header["stakeAd"] = {"ETH": float(stake_ad)}
+    return json.dumps(header, separators=(",", ":")) + "\n"
+
+
+def prepare_payload(
+    mode,
+    identifiers,
+    stake_ad=None,
+    expire=None,
+    cwd=None,
+    recursive=False,
+    sha256sum_exe=None,
+    io_jobs=None,
+    mount_jobs=iosched.DEFAULT_MOUNT_JOBS,
+    chunk_size=None,
+    base=None,
+    progress=None,
+):  # pylint: disable=R0912,R0913,R0914,R0915
+    """
+    Prepare signature payload for files (mode sha256sum or b3sum), git revisions, or docker images
+    (by tag/digest/ID), without printing. expire is a UTC datetime; for git, recursive also signs
+    submodule commits; for sha256sum, hashes in-process unless sha256sum_exe is given to run. For
+    files, io_jobs hashes with that many concurrent readers (at most mount_jobs per network
+    filesystem; see iosched); base (previous body, epoch seconds) reuses its digests of files
+    unmodified since that time; and progress(line) is called with each manifest line as it's
+    hashed. chunk_size splits the body into parts of at most that many bytes, for a chunked
+    signature (see prepare_chunk_root).
+    Returns AttributeDict of header (dict), body, payload (bytes), hex (transaction input data),
+    warnings, source (git repository directory or dockerd host), io (per-mount throughput, with
+    io_jobs), changes (vs. base: added, changed & removed filenames, and counts of files reused &
+    rehashed), and parts (transaction input data of each part, with chunk_size); raises
+    PrepareFailed.
+    """
+    if mode not in MODES:
+        raise UsageError("mode should be one of " + ", ".join(MODES))
+    if base and mode not in ("sha256sum", "b3sum"):
+        raise UsageError("base applies only to files")
+    header = payload_header(mode, stake_ad=stake_ad, expire=expire)
+    warnings = []
+    source = None
+    throughput = []
+    changes = None
+    identifiers = list(identifiers)
+    try:
+        if mode == "git":
+            from . import git  # pylint: disable=C0415
+
+            try:
+                repo_dir, repo = git.repository(cwd)
+                source = repo_dir
+                if recursive:
+                    if len(identifiers) != 1:
+                        raise UsageError("recursive applies to one git revision")
+                    body, warnings = git.prepare_recursive(repo_dir, repo, identifiers[0])
+                else:
+                    body, warnings = git.prepare(repo, identifiers)
+            except git.ErrorMessage as err:
+                raise PrepareFailed(err.args[0]) from None
+        elif mode == "docker":
+            from . import docker  # pylint: disable=C0415
+
+            source = docker.DEFAULT_HOST
+            try:
+                body, warnings = docker.prepare(docker.DEFAULT_HOST, identifiers)
+            except docker.ErrorMessage as err:
+                raise PrepareFailed(err.args[0]) from None
+        else:
+            if mode == "b3sum":
+                b3sum.blake3_version()
+            sched = iosched.Scheduler(io_jobs, mount_jobs) if io_jobs else None
+            hash_files = _file_hasher(mode, cwd, sha256sum_exe, sched, progress)
+            if base:
+                body, changes = _prepare_incremental(identifiers, hash_files, *base, cwd=cwd)
+            else:
+                body = hash_files(identifiers) if identifiers else b""
+            if sched:
+                throughput = sched.throughput()
+    except (manifest.ErrorMessage, b3sum.ErrorMessage, iosched.ErrorMessage) as err:
+        raise PrepareFailed(err.args[0]) from None
+    except OSError as err:
+        raise PrepareFailed(f"{err.filename}: {err.strerror}") from None
+    parts = []
+    if chunk_size:
+        try:
+            parts = [
+                web3.Web3.toHex(chunked.part_header(mode).encode() + part)
+                for part in chunked.split(body, chunk_size)
+            ]
+        except chunked.ErrorMessage as err:
+            raise PrepareFailed(err.args[0]) from None
+    data = header.encode() + body
+    return AttributeDict(
+        {
+            "header": json.loads(header),
+            "body": body,
+            "payload": data,
+            "hex": web3.Web3.toHex(data),
+            "warnings": list(warnings),
+            "source": source,
+            "io": throughput,
+            "changes": changes,
+            "parts": parts,
+        }
+    )
+
+
+def _file_hasher(mode, cwd, sha256sum_exe, sched, progress):
+    "function hashing a list of files into a manifest body, per prepare_payload's options"
+    if sched:
+        return functools.partial(
+            iosched.prepare,
+            sched=sched,
+            new_hasher=(b3sum.new_hasher if mode == "b3sum" else hashlib.sha256),
+            cwd=cwd,
+            tee=progress,
+        )
+    if mode == "b3sum":
+        return functools.partial(b3sum.prepare, cwd=cwd, tee=progress)
+    if sha256sum_exe:
+
+        def run_sha256sum(files):
+            try:
+                return manifest.prepare_sha256sum(files, sha256sum_exe, cwd=cwd, tee=progress)
+            except:
+                raise PrepareFailed("`sha256sum` utility failed") from None
+
+        return run_sha256sum
+
+    def hash_in_process(files):
+        lines = []
+        for filename in files:
+            digest = hash_file(os.path.join(cwd or ".", filename), hashlib.sha256)
+            lines.append(manifest.format_line(digest, filename))
+            if progress:
+                progress(lines[-1])
+        return b"".join(lines)
+
+    return hash_in_process
+
+
+def _prepare_incremental(files, hash_files, base_body, base_time, cwd=None):
+    """
+    hash files using hash_files (from _file_hasher), but reuse the digests from base_body of files
+    whose mtime & ctime precede base_time (epoch seconds); returns body and AttributeDict of
+    changes since base
+    """
+    base = {filename: (digest, line) for filename, digest, line in manifest.parse(base_body)}
+    reused = {}
+    for filename in files:
+        if filename in base:
+            try:
+                st = os.stat(os.path.join(cwd or ".", filename))
+            except OSError:
+                continue  # hash_files will report it
+            if max(st.st_mtime, st.st_ctime) < base_time:
+                reused[filename] = base[filename][1]
+
+    rehash = [filename for filename in files if filename not in reused]
+    fresh = iter(hash_files(rehash).splitlines(keepends=True) if rehash else [])
+    lines = []
+    changes = {"added": [], "changed": [], "removed": []}
+    for filename in files:
+        if filename in reused:
+            lines.append(reused[filename])
+        else:
+            line = next(fresh)
+            lines.append(line)
+            if filename not in base:
+                changes["added"].append(filename)
+            elif manifest.parse(line)[0][1] != base[filename][0]:
+                changes["changed"].append(filename)
+    files = set(files)
+    changes["removed"] = [filename for filename in base if filename not in files]
+    changes["reused"] = len(reused)
+    changes["rehashed"] = len(rehash)
+    return b"".join(lines), AttributeDict(changes)
+
+
+def prepare_chunk_root(part_txids, stake_ad=None, expire=None, w3=None, cache=None, jobs=8):
+    """
+    Prepare the root transaction payload of a chunked signature, once its parts (from
+    prepare_payload with chunk_size) have been mined: fetches them (from the same signer) & digests
+    their bodies. Returns AttributeDict of header (dict), payload (bytes), hex (transaction input
+    data), mode, and signer (who must also sign the root); raises PrepareFailed or GatewayError.
+    """
+    w3 = w3 or default_w3()
+    base_header = json.loads(payload_header(MODES[0], stake_ad=stake_ad, expire=expire))
+    try:
+        header, mode, signer = chunked.prepare_root(
+            list(part_txids),
+            (lambda part: cache.sig(w3, part)) if cache else (lambda part: get_sig(w3, part)),
+            base_header,
+            jobs=jobs,
+        )
+    except web3.exceptions.TransactionNotFound as err:
+        raise PrepareFailed(f"Signature part transaction not found: {err}") from None
+    except chunked.ErrorMessage as err:
+        raise PrepareFailed(err.args[0]) from None
+    except GATEWAY_ERRORS as err:
+        raise gateway_error(err) from None
+    return AttributeDict(
+        {
+            "header": json.loads(header),
+            "payload": header.encode(),
+            "hex": web3.Web3.toHex(header.encode()),
+            "mode": mode,
+            "signer": signer,
+        }
+    )
+
+
+def hash_file(filename, new_hasher):
+    "hex digest of file"
+    hasher = new_hasher()
+    with open(filename, "rb") as infile:
+        while True:
+            chunk = infile.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
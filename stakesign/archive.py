@@ -0,0 +1,109 @@
+import lzma
+import zlib
+import posixpath
+import tarfile
+import zipfile
+from . import manifest
+
+# verify --archive FILE: check the members of a tar (optionally gz/bz2/xz/zst-compressed) or zip
+# archive against a file signature, hashing each member in one sequential read of the archive
+# without extracting anything to disk.
+
+CHUNK_SIZE = 1 << 20
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# raised reading corrupt or truncated archives (by the tarfile/zipfile members' decompressors too)
+READ_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error, lzma.LZMAError, OSError)
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def normalize(name):
+    name = posixpath.normpath(name)
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/")
+
+
+def verify(body, archive, new_hasher, tool, ignore_missing=False, **kwargs):
+    """
+    check the signed files against members of the archive (matched by path); report as
+    `sha256sum --check` would & return success (kwargs report & quiet as for manifest.check)
+    """
+    signed = {normalize(filename) for filename, _, _ in manifest.parse(body)}
+    digests = {}
+    mismatched = set()
+
+    try:
+        for name, stream in members(archive):
+            name = normalize(name)
+            if name not in signed:
+                continue
+            hasher = new_hasher()
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+            if name in digests and digests[name] != hasher.hexdigest():
+                mismatched.add(name)  # duplicate members with different content
+            digests[name] = hasher.hexdigest()
+    except READ_ERRORS as err:
+        error_if(True, f"Failed reading archive {archive}: {getattr(err, 'strerror', None) or err}")
+
+    def check_member(filename, digest):
+        filename = normalize(filename)
+        if filename not in digests:
+            raise FileNotFoundError(filename)
+        return digests[filename] == digest and filename not in mismatched
+
+    return manifest.check(body, check_member, tool, ignore_missing=ignore_missing, **kwargs)
+
+
+def members(archive):
+    """
+    generate (name, readable stream) for each regular file in the archive, in archive order; raises
+    READ_ERRORS if it's corrupt (including from reading the streams)
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as stream:
+                        yield info.filename, stream
+        return
+
+    with open(archive, "rb") as raw:
+        if raw.read(4) == ZSTD_MAGIC:
+            raw.seek(0)
+            raw = zstd_reader(raw)
+        else:
+            raw.seek(0)
+        with tarfile.open(fileobj=raw, mode="r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member)
+
+
+def zstd_reader(raw):
+    try:
+        from compression import zstd  # pylint: disable=C0415,E0401
+
+        return zstd.ZstdFile(raw)
+    except ImportError:
+        pass
+    try:
+        import zstandard  # pylint: disable=C0415
+
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    except ImportError:
+        error_if(
+            True, "Reading .zst archives requires Python module zstandard (pip3 install zstandard)"
+        )
+    return None
@@ -0,0 +1,258 @@
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from web3.datastructures import AttributeDict
+from .console import EX_TEMPFAIL, print_tsv, bail, yellow, color, ANSI
+from .eth import DEFAULT_STAKE_FLOOR_ETH, gateway
+from . import api
+
+# stakesign audit: check every local docker image against many signatures at once. The signature
+# transactions are fetched concurrently and the local images listed once, then joined in memory,
+# instead of running `stakesign verify --docker` per (signature, image) pair.
+
+
+def fetch_sigs(w3, txids, jobs=4):
+    """
+    fetch signature transactions concurrently (assembling chunked ones); return {txid: error
+    message, or AttributeDict of sig, header & body as api.fetch_signature}
+    """
+
+    def fetch(txid):
+        try:
+            return api.fetch_signature(txid, w3=w3, jobs=jobs)
+        except api.SignatureNotFound:
+            return "transaction not found"
+        except api.StakesignError as err:
+            return err.args[0]
+        except Exception as err:  # pylint: disable=W0703
+            return f"query failed: {err}"
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        return dict(zip(txids, pool.map(fetch, txids)))
+
+
+def fetch_balances(w3, signers, jobs=4):
+    "query current balances of the (distinct) signer addresses concurrently"
+    signers = sorted(set(signers))
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        return dict(zip(signers, pool.map(w3.eth.getBalance, signers)))
+
+
+def trusted_sigs(
+    w3, sigs, balances, stake_floor_eth, utcnow, ignore_ad=False, expired_ok=False
+):  # pylint: disable=R0913,R0914
+    """
+    check each fetched docker signature's expiration & stake (as api.check_signature); return
+    {txid: [payload.DockerEntry]} for the trusted ones and {txid: reason} for the others
+    """
+    from . import docker  # pylint: disable=C0415
+
+    trusted = {}
+    untrusted = {}
+    for txid, fetched in sigs.items():
+        if isinstance(fetched, str):
+            untrusted[txid] = fetched
+            continue
+        sig, header, body = fetched.sig, fetched.header, fetched.body
+        try:
+            if header["stakesign"] != "docker":
+                untrusted[txid] = f"signs {header['stakesign']}, not docker"
+                continue
+            api.check_signature(
+                w3,
+                sig,
+                header,
+                stake_floor_eth=stake_floor_eth,
+                ignore_ad=ignore_ad,
+                expired_ok=expired_ok,
+                utcnow=utcnow,
+                signer_wei=balances[sig.signer],
+            )
+            trusted[txid] = list(docker.parse_sigbody(body))
+        except api.SignatureExpired as err:
+            untrusted[txid] = f"expired {err.result.expire.expire_utc}Z"
+        except api.InsufficientStake as err:
+            vs = err.result.stake
+            untrusted[txid] = (
+                f"signer's balance {w3.fromWei(vs.signer_wei, 'ether')}"
+                f" < {w3.fromWei(vs.required_wei, 'ether')} ETH from {vs.required_wei_source}"
+            )
+        except (api.StakesignError, docker.ErrorMessage) as err:
+            untrusted[txid] = err.args[0]
+    return trusted, untrusted
+
+
+def join(trusted, local_images_attrs):
+    """
+    join trusted signatures with local images; return AttributeDict for each local image with its
+    status (signed, unsigned, or conflict), signing txids, and conflicting tags
+    """
+    signed_ids = {}
+    signed_handles = {}
+    for txid, sig_elts in trusted.items():
+        for image_id, signed_tags in sig_elts:
+            signed_ids.setdefault(image_id, set()).add(txid)
+            for handle in signed_tags:
+                signed_handles.setdefault(handle, set()).add(image_id)
+
+    ans = []
+    for image_id, attrs in sorted(local_images_attrs.items()):
+        handles = (attrs.get("RepoTags") or []) + (attrs.get("RepoDigests") or [])
+        # as in verify, a mismatched :latest tag is expected as images are updated, so not a conflict
+        conflicts = sorted(
+            handle
+            for handle in handles
+            if signed_handles.get(handle, {image_id}) != {image_id}
+            and not handle.endswith(":latest")
+        )
+        txids = sorted(signed_ids.get(image_id, []))
+        ans.append(
+            AttributeDict(
+                {
+                    "image_id": image_id,
+                    "handles": handles,
+                    "status": "conflict" if conflicts else ("signed" if txids else "unsigned"),
+                    "txids": txids,
+                    "conflicts": conflicts,
+                }
+            )
+        )
+    return ans
+
+
+def read_txids(args):
+    txids = list(args.signatures)
+    if args.signatures_file:
+        with open(args.signatures_file, encoding="utf-8") as infile:
+            for line in infile:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    txids.append(line)
+    for txid in txids:
+        if not txid.startswith("0x"):
+            bail("Transaction ID should start with 0x: " + txid)
+    return list(dict.fromkeys(txids))
+
+
+def cli_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "audit",
+        help="check all local docker images against many signatures",
+        description="Report which local docker images are covered by any of the given signatures (each of which must meet the stake & expiration requirements), which are unsigned, and which have local tags conflicting with a signature.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("signatures", nargs="*", help="signature Transaction ID(s) (0x...)")
+    parser.add_argument(
+        "--signatures-file",
+        metavar="FILE",
+        help="file listing signature Transaction IDs, one per line",
+    )
+    parser.add_argument(
+        "--stake",
+        metavar="0.1",
+        dest="stake_floor_eth",
+        type=float,
+        default=DEFAULT_STAKE_FLOOR_ETH,
+        help="minimum acceptable current ETH balance for signer addresses",
+    )
+    parser.add_argument(
+        "--ignore-ad",
+        action="store_true",
+        help="use --stake value even if less than a signature's stakeAd",
+    )
+    parser.add_argument(
+        "--expired-ok",
+        action="store_true",
+        help="accept signatures even if their stated expiration date has passed",
+    )
+    parser.add_argument(
+        "--docker-archive",
+        metavar="PATH",
+        help="audit images in a `docker save` tarball or OCI image layout instead of dockerd's",
+    )
+    parser.add_argument(
+        "--fail-unsigned",
+        action="store_true",
+        help="exit with error status if any local image is unsigned (as well as for tag conflicts)",
+    )
+    parser.add_argument(
+        "--jobs", "-j", metavar="N", type=int, default=8, help="concurrent ETH gateway queries"
+    )
+    return parser
+
+
+def cli(args):  # pylint: disable=R0914
+    from . import docker, oci  # pylint: disable=C0415
+
+    txids = read_txids(args)
+    if not txids:
+        bail("No signature Transaction IDs given")
+
+    try:
+        if args.docker_archive:
+            print_tsv("Reading images from:", args.docker_archive)
+            _, images_attrs = oci.archive_images(args.docker_archive, jobs=args.jobs)
+        else:
+            print_tsv("   Trusting dockerd:", docker.DEFAULT_HOST)
+            _, images_attrs = docker.local_images(docker.DEFAULT_HOST)
+    except (docker.ErrorMessage, oci.ErrorMessage) as err:
+        bail(err.args[0])
+    except OSError as err:
+        bail(f"{args.docker_archive}: {err.strerror}")
+
+    w3 = gateway()
+    sigs = fetch_sigs(w3, txids, args.jobs)
+    try:
+        balances = fetch_balances(
+            w3,
+            [fetched.sig.signer for fetched in sigs.values() if not isinstance(fetched, str)],
+            args.jobs,
+        )
+    except api.GATEWAY_ERRORS as err:
+        err = api.gateway_error(err)
+        bail(err.args[0], EX_TEMPFAIL if isinstance(err, api.GatewayUnavailable) else 1)
+    utcnow = datetime.utcnow().replace(tzinfo=None)
+    trusted, untrusted = trusted_sigs(
+        w3,
+        sigs,
+        balances,
+        args.stake_floor_eth,
+        utcnow,
+        ignore_ad=args.ignore_ad,
+        expired_ok=args.expired_ok,
+    )
+
+    print()
+    for txid in txids:
+        if txid in trusted:
+            sig = sigs[txid].sig
+            print_tsv(color("🗹", ANSI.BHGRN), txid, sig.signer, f"{sig.timestamp}Z")
+        else:
+            print_tsv(color("✗", ANSI.BHRED), txid, yellow(untrusted[txid]))
+    print()
+
+    results = join(trusted, images_attrs)
+    status_color = {"signed": ANSI.BHGRN, "unsigned": ANSI.BHYEL, "conflict": ANSI.BHRED}
+    for res in results:
+        print_tsv(
+            color(res.status, status_color[res.status]),
+            res.image_id,
+            " ".join(res.handles) or "-",
+            " ".join(res.txids or res.conflicts) or "-",
+        )
+    counts = {status: sum(res.status == status for res in results) for status in status_color}
+    print()
+    print_tsv(
+        "Trusted signatures:",
+        f"{len(trusted)}/{len(txids)}",
+        "Images signed:",
+        counts["signed"],
+        "unsigned:",
+        counts["unsigned"],
+        "conflict:",
+        counts["conflict"],
+    )
+    if counts["conflict"]:
+        bail("Local image tag(s) refer to different image IDs than signed")
+    if args.fail_unsigned and counts["unsigned"]:
+        bail("Unsigned local image(s)")
@@ -0,0 +1,68 @@
+import os
+from . import manifest
+
+# BLAKE3 signing mode: the body has the same line format as sha256sum (and the b3sum utility,
+# whose `b3sum --check` can verify it manually), but BLAKE3's tree structure lets us hash chunks
+# of each (memory-mapped) file on all cores, instead of single-threaded SHA-256.
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def blake3_version():
+    try:
+        import blake3  # pylint: disable=C0415
+    except ImportError:
+        error_if(True, "Python blake3 module unavailable; try: pip3 install blake3")
+    return blake3.__version__
+
+
+def new_hasher():
+    "BLAKE3 hasher that hashes large updates in parallel"
+    import blake3  # pylint: disable=C0415
+
+    return blake3.blake3(max_threads=blake3.blake3.AUTO)  # pylint: disable=E1102,I1101
+
+
+def hash_file(filename):
+    "BLAKE3 hex digest of the file, hashing chunks in parallel"
+    hasher = new_hasher()
+    hasher.update_mmap(filename)
+    return hasher.hexdigest()
+
+
+def prepare(files, cwd=None, tee=None):
+    """
+    hash files; prepare input body for signing transaction as bytes (calling tee, if given, with
+    each line as it's hashed)
+    """
+    lines = []
+    for filename in files:
+        try:
+            digest = hash_file(os.path.join(cwd or ".", filename))
+        except OSError as err:
+            error_if(True, f"{filename}: {err.strerror or err}")
+        lines.append(manifest.format_line(digest, filename))
+        if tee:
+            tee(lines[-1])
+    return b"".join(lines)
+
+
+def verify(body, ignore_missing=False, cwd=None, **kwargs):
+    """
+    check files against signature body, reporting as `b3sum --check` would; return success
+    (kwargs report & quiet as for manifest.check)
+    """
+    return manifest.check(
+        body,
+        lambda filename, digest: hash_file(os.path.join(cwd or ".", filename)) == digest,
+        "b3sum",
+        ignore_missing=ignore_missing,
+        **kwargs,
+    )
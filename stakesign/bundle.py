@@ -0,0 +1,416 @@
+import json
+import argparse
+from datetime import datetime, timedelta
+import rlp
+from eth_utils import keccak, to_checksum_address
+from eth_keys import keys
+from eth_keys.exceptions import BadSignature, ValidationError
+from web3.datastructures import AttributeDict
+from .console import EX_TEMPFAIL, print_tsv, bail, yellow
+from .eth import gateway
+from . import ratelimit
+
+BUNDLE_VERSION = 1
+# {"stakesignBundle": 1, "transaction": {}, "receipt": {}, "block": {}, "stakeBlock": {},
+#  "accountProof": {}}, each as returned by the gateway's JSON-RPC (hex strings)
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def export(w3, txid):
+    """
+    Collect the signature transaction with its full block, and a Merkle-Patricia proof of the
+    signer's balance as of the latest block, for offline verification
+    """
+    tx = rpc(w3, "eth_getTransactionByHash", [txid])
+    error_if(not tx, "Transaction not found on Ethereum network; check transaction ID")
+    error_if(not tx.get("blockNumber"), "Transaction pending (no block number yet)")
+    receipt = rpc(w3, "eth_getTransactionReceipt", [txid])
+    block = rpc(w3, "eth_getBlockByHash", [tx["blockHash"], True])
+    stake_block = rpc(w3, "eth_getBlockByNumber", ["latest", False])
+    error_if(not (receipt and block and stake_block), "ETH gateway returned incomplete data")
+    del stake_block["transactions"]  # not needed to check the header
+    proof = rpc(w3, "eth_getProof", [tx["from"], [], stake_block["number"]])
+    return {
+        "stakesignBundle": BUNDLE_VERSION,
+        "transaction": tx,
+        "receipt": receipt,
+        "block": block,
+        "stakeBlock": stake_block,
+        "accountProof": proof,
+    }
+
+
+def rpc(w3, method, params):
+    # raw JSON-RPC, so that the results stay JSON-serializable (but still rate-limited)
+    resp = ratelimit.middleware(w3.provider.make_request, w3)(method, params)
+    error_if("error" in resp, f"ETH gateway {method} failed: {resp.get('error')}")
+    return resp.get("result")
+
+
+def load(filename):
+    try:
+        with open(filename, encoding="utf-8") as infile:
+            bundle = json.load(infile)
+    except OSError as err:
+        error_if(True, f"Can't read bundle file {filename}: {err.strerror}")
+    except ValueError:
+        error_if(True, "Bundle file isn't valid JSON")
+    error_if(not isinstance(bundle, dict), "Bundle file isn't valid JSON")
+    return verify(bundle)
+
+
+def verify(bundle):  # pylint: disable=R0914
+    """
+    Check the bundle's proofs locally; return signature details (as eth.get_sig would) and the
+    signer's balance as proven against the bundle's stake block header.
+
+    The bundle can't prove its block headers are canonical; the verifier trusts the exporter on
+    that point, and should weigh the stake block's height & age accordingly.
+    """
+    error_if(
+        bundle.get("stakesignBundle") != BUNDLE_VERSION,
+        "Unrecognized bundle version; a newer version of this utility might support it",
+    )
+    try:
+        tx = bundle["transaction"]
+        receipt = bundle["receipt"]
+        block = bundle["block"]
+        stake_block = bundle["stakeBlock"]
+        proof = bundle["accountProof"]
+
+        # transaction is self-consistent and signed by the claimed sender
+        raw_tx = encode_transaction(tx)
+        error_if(_bytes(tx["hash"]) != keccak(raw_tx), "Transaction data doesn't match its ID")
+        signer = recover_sender(tx)
+        error_if(signer != to_checksum_address(tx["from"]), "Transaction signer mismatch")
+        error_if(
+            _bytes(receipt["transactionHash"]) != _bytes(tx["hash"])
+            or to_checksum_address(receipt["from"]) != signer,
+            "Transaction receipt doesn't match transaction",
+        )
+
+        # transaction is included in its block
+        error_if(
+            header_hash(block) != _bytes(block["hash"])
+            or _bytes(tx["blockHash"]) != _bytes(block["hash"])
+            or _bytes(receipt["blockHash"]) != _bytes(block["hash"]),
+            "Transaction block header doesn't match its hash",
+        )
+        block_txs = [encode_transaction(block_tx) for block_tx in block["transactions"]]
+        error_if(
+            trie_root(block_txs) != _bytes(block["transactionsRoot"]),
+            "Block transactions don't match header transactionsRoot",
+        )
+        error_if(
+            block_txs[_int(tx["transactionIndex"])] != raw_tx,
+            "Transaction not found at its index in block",
+        )
+
+        # signer's balance is proven in the stake block's state
+        error_if(
+            header_hash(stake_block) != _bytes(stake_block["hash"]),
+            "Stake block header doesn't match its hash",
+        )
+        error_if(
+            _int(stake_block["number"]) < _int(block["number"]),
+            "Stake block precedes the transaction block",
+        )
+        error_if(
+            to_checksum_address(proof["address"]) != signer,
+            "Account proof doesn't pertain to signer's address",
+        )
+        account = proof_value(
+            _bytes(stake_block["stateRoot"]),
+            keccak(_bytes(proof["address"])),
+            [_bytes(node) for node in proof["accountProof"]],
+        )
+        signer_wei = rlp.decode(account)[1] if account else b""
+        signer_wei = int.from_bytes(signer_wei, "big")
+    except (
+        KeyError,
+        TypeError,
+        ValueError,
+        IndexError,
+        rlp.DecodingError,
+        BadSignature,
+        ValidationError,
+    ):
+        error_if(True, "Bundle is malformed")
+
+    return (
+        AttributeDict(
+            {
+                "id": tx["hash"],
+                "timestamp": datetime.utcfromtimestamp(_int(block["timestamp"])),
+                "block": _int(block["number"]),
+                "signer": signer,
+                "input": tx["input"],
+            }
+        ),
+        AttributeDict(
+            {
+                "signer_wei": signer_wei,
+                "block": _int(stake_block["number"]),
+                "block_hash": stake_block["hash"],
+                "timestamp": datetime.utcfromtimestamp(_int(stake_block["timestamp"])),
+            }
+        ),
+    )
+
+
+def _int(hexstr):
+    return int(hexstr, 16) if hexstr and hexstr != "0x" else 0
+
+
+def _bytes(hexstr):
+    return bytes.fromhex(hexstr[2:]) if hexstr else b""
+
+
+def _access_list(access_list):
+    return [
+        [_bytes(elt["address"]), [_bytes(key) for key in elt["storageKeys"]]] for elt in access_list
+    ]
+
+
+def _authorization_list(auth_list):
+    return [
+        [
+            _int(auth["chainId"]),
+            _bytes(auth["address"]),
+            _int(auth["nonce"]),
+            _int(auth["yParity"]),
+            _int(auth["r"]),
+            _int(auth["s"]),
+        ]
+        for auth in auth_list
+    ]
+
+
+def transaction_fields(tx):
+    "transaction type & its unsigned RLP fields, from JSON-RPC transaction object"
+    tx_type = _int(tx.get("type"))
+    value = [_int(tx["gas"]), _bytes(tx.get("to")), _int(tx["value"]), _bytes(tx["input"])]
+    if tx_type == 0:
+        return tx_type, [_int(tx["nonce"]), _int(tx["gasPrice"])] + value
+    head = [_int(tx["chainId"]), _int(tx["nonce"])]
+    if tx_type == 1:
+        return tx_type, head + [_int(tx["gasPrice"])] + value + [_access_list(tx["accessList"])]
+    fees = [_int(tx["maxPriorityFeePerGas"]), _int(tx["maxFeePerGas"])]
+    fields = head + fees + value + [_access_list(tx["accessList"])]
+    if tx_type == 2:
+        return tx_type, fields
+    if tx_type == 3:
+        return tx_type, fields + [
+            _int(tx["maxFeePerBlobGas"]),
+            [_bytes(vh) for vh in tx["blobVersionedHashes"]],
+        ]
+    if tx_type == 4:
+        return tx_type, fields + [_authorization_list(tx["authorizationList"])]
+    raise ErrorMessage("Unsupported transaction type in bundle")
+
+
+def encode_transaction(tx):
+    "canonical signed transaction encoding (whose keccak is the transaction ID)"
+    tx_type, fields = transaction_fields(tx)
+    if tx_type == 0:
+        return rlp.encode(fields + [_int(tx["v"]), _int(tx["r"]), _int(tx["s"])])
+    y_parity = _int(tx["yParity"]) if "yParity" in tx else _int(tx["v"])
+    return bytes([tx_type]) + rlp.encode(fields + [y_parity, _int(tx["r"]), _int(tx["s"])])
+
+
+def recover_sender(tx):
+    "recover the address that signed the transaction"
+    tx_type, fields = transaction_fields(tx)
+    if tx_type == 0:
+        v = _int(tx["v"])
+        if v >= 35:  # EIP-155
+            y_parity = (v - 35) % 2
+            msg = rlp.encode(fields + [(v - 35) // 2, 0, 0])
+        else:
+            y_parity = v - 27
+            msg = rlp.encode(fields)
+    else:
+        y_parity = _int(tx["yParity"]) if "yParity" in tx else _int(tx["v"])
+        msg = bytes([tx_type]) + rlp.encode(fields)
+    sig = keys.Signature(vrs=(y_parity, _int(tx["r"]), _int(tx["s"])))
+    return sig.recover_public_key_from_msg_hash(keccak(msg)).to_checksum_address()
+
+
+HEADER_FIELDS = (
+    ("parentHash", _bytes),
+    ("sha3Uncles", _bytes),
+    ("miner", _bytes),
+    ("stateRoot", _bytes),
+    ("transactionsRoot", _bytes),
+    ("receiptsRoot", _bytes),
+    ("logsBloom", _bytes),
+    ("difficulty", _int),
+    ("number", _int),
+    ("gasLimit", _int),
+    ("gasUsed", _int),
+    ("timestamp", _int),
+    ("extraData", _bytes),
+    ("mixHash", _bytes),
+    ("nonce", _bytes),
+)
+# fields appended by successive forks (London, Shanghai, Cancun, Prague)
+HEADER_FORK_FIELDS = (
+    ("baseFeePerGas", _int),
+    ("withdrawalsRoot", _bytes),
+    ("blobGasUsed", _int),
+    ("excessBlobGas", _int),
+    ("parentBeaconBlockRoot", _bytes),
+    ("requestsHash", _bytes),
+)
+
+
+def header_hash(block):
+    fields = [conv(block[key]) for key, conv in HEADER_FIELDS]
+    for key, conv in HEADER_FORK_FIELDS:
+        if key not in block:
+            break
+        fields.append(conv(block[key]))
+    return keccak(rlp.encode(fields))
+
+
+def trie_root(values):
+    "Merkle-Patricia trie root of the list of values, keyed by RLP-encoded index"
+    items = sorted((_nibbles(rlp.encode(i)), value) for i, value in enumerate(values))
+    if not items:
+        return keccak(rlp.encode(b""))
+    return keccak(rlp.encode(_trie_node(items, 0)))
+
+
+def _trie_node(items, depth):
+    if len(items) == 1:
+        return [_hex_prefix(items[0][0][depth:], True), items[0][1]]
+    common = depth
+    while all(len(key) > common and key[common] == items[0][0][common] for key, _ in items):
+        common += 1
+    if common > depth:  # extension
+        return [_hex_prefix(items[0][0][depth:common], False), _trie_ref(_trie_node(items, common))]
+    branch = [b""] * 17
+    for nibble in range(16):
+        sub = [(key, value) for key, value in items if len(key) > depth and key[depth] == nibble]
+        if sub:
+            branch[nibble] = _trie_ref(_trie_node(sub, depth + 1))
+    for key, value in items:
+        if len(key) == depth:
+            branch[16] = value
+    return branch
+
+
+def _trie_ref(node):
+    enc = rlp.encode(node)
+    return node if len(enc) < 32 else keccak(enc)
+
+
+def _nibbles(key):
+    ans = []
+    for byte in key:
+        ans.extend((byte >> 4, byte & 15))
+    return ans
+
+
+def _hex_prefix(nibbles, leaf):
+    flag = 2 if leaf else 0
+    if len(nibbles) % 2:
+        nibbles = [flag + 1] + nibbles
+    else:
+        nibbles = [flag, 0] + nibbles
+    return bytes(16 * nibbles[i] + nibbles[i + 1] for i in range(0, len(nibbles), 2))
+
+
+def proof_value(root, key, proof):
+    "Walk Merkle-Patricia proof nodes from root hash; return value at key (None if proven absent)"
+    key = _nibbles(key)
+    expected = root
+    pos = 0
+    for enc in proof:
+        error_if(
+            not isinstance(expected, bytes) or keccak(enc) != expected,
+            "Account proof doesn't match stake block stateRoot",
+        )
+        node = rlp.decode(enc)
+        if len(node) == 17:
+            if pos == len(key):
+                return node[16] or None
+            expected = node[key[pos]]
+            pos += 1
+            if not expected:
+                return None
+        elif len(node) == 2:
+            path = _nibbles(node[0])
+            leaf = path[0] >= 2
+            path = path[1:] if path[0] % 2 else path[2:]
+            if leaf:
+                return node[1] if key[pos:] == path else None
+            if key[pos : pos + len(path)] != path:
+                return None
+            pos += len(path)
+            expected = node[1]
+        else:
+            error_if(True, "Account proof is malformed")
+    error_if(True, "Account proof is incomplete")
+    return None
+
+
+def cli_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "bundle",
+        help="export signature & stake proofs for offline verification",
+        description="Query the ETH gateway for the signature transaction, its block, and a proof of the signer's current balance; save these for `stakesign verify --bundle` on a machine without network access.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("signature", help="signature Transaction ID (0x...)")
+    parser.add_argument(
+        "--output",
+        "-o",
+        metavar="FILE",
+        help="bundle filename (default: SIGNATURE.stakesign.json)",
+    )
+    return parser
+
+
+def cli(args):
+    if not args.signature.startswith("0x"):
+        bail("Transaction ID should start with 0x")
+    w3 = gateway()
+    try:
+        bundle = export(w3, args.signature)
+        sig, stake = verify(bundle)  # double-check before saving
+    except ErrorMessage as err:
+        bail(err.args[0])
+    except ratelimit.ErrorMessage as err:
+        bail(err.args[0], EX_TEMPFAIL)
+
+    print_tsv("         Transaction:", sig.id)
+    print_tsv("    Signer's address:", sig.signer)
+    print_tsv(" Signature timestamp:", f"{sig.timestamp}Z", f"(block {sig.block})")
+    print_stake_block(stake, datetime.utcnow())
+    print_tsv("    Signer's balance:", f"{w3.fromWei(stake.signer_wei, 'ether')}", "ETH")
+
+    filename = args.output or (args.signature + ".stakesign.json")
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(bundle, outfile, separators=(",", ":"))
+    print()
+    print_tsv("Wrote bundle:", filename)
+
+
+def print_stake_block(stake, utcnow):
+    "display the bundle's stake block, highlighting its age"
+    age = utcnow - stake.timestamp
+    print_tsv(
+        "  Bundle stake block:",
+        f"{stake.block} {stake.block_hash}",
+        f"{stake.timestamp}Z",
+        yellow(f"({age} ago)", age > timedelta(days=1)),
+    )
@@ -0,0 +1,176 @@
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import payload
+
+# Chunked signatures, for bodies too large for one transaction: the body is split at line
+# boundaries into parts, each broadcast in its own transaction with payload
+#   {"stakesign":"part","mode":"sha256sum"}
+#   ...lines...
+# and then a root transaction, from the same signer, lists the parts in order, with the SHA-256
+# digest of their concatenated bodies:
+#   {"stakesign":"chunked","mode":"sha256sum","parts":["0x...","0x..."],"sha256":"...","stakeAd":...}
+# The root transaction is the signature: its header carries any stakeAd & expiration, and its
+# timestamp must follow all the parts'.
+
+MAX_PARTS = 4096
+MAX_BYTES = 1 << 26  # assembled body size limit, as it's held in memory
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def split(body, chunk_size):
+    "split body into parts of at most chunk_size bytes each, at line boundaries"
+    error_if(chunk_size <= 0, "chunk size must be positive")
+    error_if(len(body) > MAX_BYTES, f"signature body exceeds the {MAX_BYTES}-byte chunked limit")
+    parts = []
+    start = 0
+    while start < len(body):
+        end = start + chunk_size
+        if end < len(body):
+            end = body.rfind(b"\n", start, end) + 1
+            error_if(
+                end <= start, f"a signature body line exceeds the {chunk_size}-byte chunk size"
+            )
+        parts.append(body[start:end])
+        start = end
+    error_if(len(parts) > MAX_PARTS, f"more than {MAX_PARTS} parts; increase the chunk size")
+    return parts
+
+
+def part_header(mode):
+    assert mode in payload.MODES
+    return json.dumps({"stakesign": "part", "mode": mode}, separators=(",", ":")) + "\n"
+
+
+def root_header(mode, part_txids, digest, base_header):
+    """
+    header line (str) of the root transaction, given part transaction IDs, their concatenated
+    bodies' SHA-256 hex digest, and base_header (dict from api.payload_header, with any stakeAd &
+    expire)
+    """
+    header = {"stakesign": "chunked", "mode": mode, "parts": list(part_txids), "sha256": digest}
+    header.update((key, val) for key, val in base_header.items() if key != "stakesign")
+    return json.dumps(header, separators=(",", ":")) + "\n"
+
+
+def check_root(header):
+    "validate root header; return mode & part transaction IDs"
+    mode = header.get("mode")
+    parts = header.get("parts")
+    error_if(
+        not (
+            mode in payload.MODES
+            and isinstance(parts, list)
+            and 0 < len(parts) <= MAX_PARTS
+            and all(isinstance(txid, str) and txid.startswith("0x") for txid in parts)
+            and len(set(txid.lower() for txid in parts)) == len(parts)
+            and isinstance(header.get("sha256"), str)
+        ),
+        "Invalid chunked signature header",
+    )
+    return mode, parts
+
+
+def fetch_parts(part_txids, get_sig, jobs=8):
+    """
+    generate (txid, sig, mode, body) for each part transaction, in order, fetching them with
+    get_sig(txid) concurrently, a bounded number ahead
+    """
+
+    def decode_part(txid, future):
+        part_sig = future.result()
+        try:
+            header, body = payload.decode(part_sig.input)
+        except payload.ErrorMessage as err:
+            error_if(True, f"Signature part {txid}: {err.args[0]}")
+        error_if(
+            header.get("stakesign") != "part" or header.get("mode") not in payload.MODES,
+            f"Transaction {txid} isn't a stakesign signature part",
+        )
+        return txid, part_sig, header["mode"], body
+
+    jobs = max(jobs, 1)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for txid in part_txids:
+            pending.append((txid, pool.submit(get_sig, txid)))
+            if len(pending) >= 2 * jobs:
+                yield decode_part(*pending.popleft())
+        while pending:
+            yield decode_part(*pending.popleft())
+
+
+def prepare_root(part_txids, get_sig, base_header, jobs=8):
+    """
+    root transaction header line (str) for the given part transaction IDs, which must be parts of
+    the same mode from the same signer; returns it with the mode & signer
+    """
+    error_if(not 0 < len(part_txids) <= MAX_PARTS, f"chunked signature needs 1-{MAX_PARTS} parts")
+    error_if(
+        len(set(txid.lower() for txid in part_txids)) != len(part_txids),
+        "duplicate part transaction",
+    )
+    hasher = hashlib.sha256()
+    mode = signer = None
+    size = 0
+    for txid, part_sig, part_mode, part_body in fetch_parts(part_txids, get_sig, jobs):
+        mode = mode or part_mode
+        signer = signer or part_sig.signer
+        error_if(part_mode != mode, f"Signature part {txid} isn't of mode {mode}, as the first")
+        error_if(part_sig.signer != signer, f"Signature part {txid} is from a different signer")
+        size += len(part_body)
+        error_if(size > MAX_BYTES, f"Signature parts exceed the {MAX_BYTES}-byte chunked limit")
+        hasher.update(part_body)
+    return root_header(mode, part_txids, hasher.hexdigest(), base_header), mode, signer
+
+
+def assemble(root_sig, header, get_sig, jobs=8, max_bytes=MAX_BYTES):
+    """
+    Fetch the parts of the chunked signature with root transaction root_sig & header, using
+    get_sig(txid) concurrently; check each is a part of the same mode, from the same signer, and
+    mined no later than the root; and reassemble the body (up to max_bytes), checking its digest.
+    Returns the header for mode-specific verification (the root header, with stakesign set to
+    the mode), the body, and the part sigs.
+    """
+    mode, part_txids = check_root(header)
+    hasher = hashlib.sha256()
+    body = bytearray()
+    part_sigs = []
+    for txid, part_sig, part_mode, part_body in fetch_parts(part_txids, get_sig, jobs):
+        # each part is checked & hashed in order as soon as it (and its predecessors) arrive
+        error_if(part_mode != mode, f"Signature part {txid} isn't of mode {mode}")
+        error_if(
+            part_sig.signer != root_sig.signer,
+            f"Signature part {txid} is from a different signer than the root transaction",
+        )
+        error_if(
+            part_sig.block > root_sig.block,
+            f"Signature part {txid} was mined after the root transaction",
+        )
+        error_if(
+            len(body) + len(part_body) > max_bytes,
+            f"Chunked signature exceeds {max_bytes} bytes; refusing to assemble",
+        )
+        hasher.update(part_body)
+        body += part_body
+        part_sigs.append(part_sig)
+    error_if(
+        hasher.hexdigest() != header["sha256"],
+        "Signature parts' digest doesn't match the root transaction",
+    )
+    mode_header = {"stakesign": mode}
+    mode_header.update(
+        (key, val)
+        for key, val in header.items()
+        if key not in ("stakesign", "mode", "parts", "sha256")
+    )
+    return mode_header, memoryview(body), part_sigs
@@ -0,0 +1,49 @@
+import os
+import sys
+import web3
+
+# Terminal output helpers shared by the subcommands
+
+
+# exit status when the ETH gateway is unavailable (sysexits.h EX_TEMPFAIL), so callers can retry
+EX_TEMPFAIL = 75
+
+
+def print_tsv(*args, **kwargs):
+    print("\t".join(str(arg) for arg in args), **kwargs)
+
+
+def bail(msg, status=1):
+    msg = "[ERROR] " + msg
+    if sys.stderr.isatty() and "NO_COLOR" not in os.environ:
+        print(ANSI.BHRED + msg + ANSI.RESET, file=sys.stderr)
+    else:
+        print(msg, file=sys.stderr)
+    sys.exit(status)
+
+
+def color(msg, col):
+    if sys.stdout.isatty() and "NO_COLOR" not in os.environ:
+        return col + msg + ANSI.RESET
+    return msg
+
+
+def yellow(msg, only_if=True):
+    return color(msg, ANSI.BHYEL) if only_if else msg
+
+
+def print_transaction_input(header, body):
+    print("\n-- Transaction input data for signing (one long line):\n")
+
+    print(color(web3.Web3.toHex(header.encode() + body), ANSI.BOLD))
+    print()
+
+
+class ANSI:
+    # https://gist.github.com/RabaDabaDoba/145049536f815903c79944599c6f952a
+    # https://espterm.github.io/docs/VT100%20escape%20codes.html
+    RESET = "\x1b[0m"
+    BHRED = "\x1b[1;91m"
+    BHYEL = "\x1b[1;93m"
+    BHGRN = "\x1b[1;92m"
+    BOLD = "\x1b[1m"
@@ -1,5 +1,6 @@
 import json
 import docker
+from . import payload
 
 DEFAULT_HOST = "unix://var/run/docker.sock"
 # {"Id": "", "aka": {"RepoTags": [], "RepoDigests": []}}
@@ -14,9 +15,8 @@ def error_if(cond, msg):
         raise ErrorMessage(msg) from None
 
 
-def prepare(docker_host, images):
-    client = docker.DockerClient(docker_host, version="auto")
-    images_idx = images_handle_index(client)
+def prepare(docker_host, images, local=None):
+    images_idx, images_attrs = local or local_images(docker_host)
 
     results = []
     warnings = []
@@ -28,7 +28,7 @@ def prepare(docker_host, images):
         error_if(not hits, "No such image: " + handle)
         error_if(len(hits) > 1, "Ambiguous image: " + handle)
         image_id = next(iter(hits))
-        image_attrs = client.images.get(image_id).attrs
+        image_attrs = images_attrs[image_id]
         res = {"imageId": image_id}
         if image_attrs.get("RepoTags"):
             res["akaRepoTags"] = image_attrs["RepoTags"]
@@ -42,44 +42,35 @@ def prepare(docker_host, images):
 
 
 def verify(
-    docker_host, sigbody, handle_to_verify=None, ignore_missing=False
+    docker_host, sigbody, handle_to_verify=None, ignore_missing=False, local=None
 ):  # pylint: disable=R0912,R0914,R0915
-    client = docker.DockerClient(docker_host, version="auto")
-    local_images_index = images_handle_index(client)
+    """
+    Verify local images covered by the signature body; local is the (index, attrs) of images to
+    check, by default those of dockerd at docker_host
+    """
+    local_images_index, local_images_attrs = local or local_images(docker_host)
     image_to_verify = None
     if handle_to_verify:
         image_to_verify = local_images_index.get(handle_to_verify)
         error_if(not image_to_verify, "No such local image: " + handle_to_verify)
-        image_to_verify = client.images.get(next(iter(image_to_verify)))
+        image_to_verify = next(iter(image_to_verify))
 
     verified = []
     warnings = set()
-    lines = [line for line in sigbody.split(b"\n") if line]
-    for line in lines:
-        try:
-            sig_elt = json.loads(line.decode())
-            assert isinstance(sig_elt.get("imageId"), str)
-        except:
-            error_if(True, "Invalid signature syntax")
-
+    sig_elts = parse_sigbody(sigbody)
+    count = 0
+    for image_id, signed_tags in sig_elts:
+        count += 1
         # First, check that if the signature includes tags, those tags don't point to a different
         # local image (exception: warning for :latest)
-        signed_tags = []
-        if "akaRepoTags" in sig_elt:
-            assert isinstance(sig_elt["akaRepoTags"], list)
-            signed_tags.extend(sig_elt["akaRepoTags"])
-        if "akaRepoDigests" in sig_elt:
-            assert isinstance(sig_elt["akaRepoDigests"], list)
-            signed_tags.extend(sig_elt["akaRepoDigests"])
         for signed_handle in signed_tags:
-            assert isinstance(signed_handle, str)
             error_if(
                 len(local_images_index.get(signed_handle, set())) > 1,
                 f"The local image tag '{signed_handle}' is ambiguous",
             )
             if (
                 signed_handle in local_images_index
-                and next(iter(local_images_index[signed_handle])) != sig_elt["imageId"]
+                and next(iter(local_images_index[signed_handle])) != image_id
             ):
                 if signed_handle.endswith(":latest"):
                     warnings.add(
@@ -92,32 +83,35 @@ def verify(
                     )
 
         if image_to_verify:
-            if image_to_verify.id != sig_elt["imageId"]:
+            if image_to_verify != image_id:
                 continue
             local_image = image_to_verify
         else:
-            local_image = local_images_index.get(sig_elt["imageId"])
-            error_if(
-                not (ignore_missing or local_image),
-                "Signed image missing locally"
-                + (
-                    "; try --ignore-missing if OK for some but not all to be missing"
-                    if len(lines) > 1
-                    else ""
-                ),
-            )
+            local_image = local_images_index.get(image_id)
+            if not (ignore_missing or local_image):
+                # (peeking at the next element, to word the error, is fine since we're bailing out)
+                error_if(
+                    True,
+                    "Signed image missing locally"
+                    + (
+                        "; try --ignore-missing if OK for some but not all to be missing"
+                        if count > 1 or next(sig_elts, None) is not None
+                        else ""
+                    ),
+                )
             if local_image:
                 assert len(local_image) == 1
-                local_image = client.images.get(next(iter(local_image)))
+                local_image = next(iter(local_image))
             else:
                 warnings.add("The transaction signs one or more images that are missing locally")
                 continue
 
+        local_attrs = local_images_attrs[local_image]
         local_tags = []
-        if local_image.attrs.get("RepoTags"):
-            local_tags.extend(local_image.attrs["RepoTags"])
-        if local_image.attrs.get("RepoDigests"):
-            local_tags.extend(local_image.attrs["RepoDigests"])
+        if local_attrs.get("RepoTags"):
+            local_tags.extend(local_attrs["RepoTags"])
+        if local_attrs.get("RepoDigests"):
+            local_tags.extend(local_attrs["RepoDigests"])
         common_tags = set(local_tags).intersection(set(signed_tags))
 
         aka_msg = ""
@@ -125,25 +119,41 @@ def verify(
             aka_msg = ", aka: " + " ".join(sorted(common_tags))
         elif signed_tags and local_tags:
             warnings.add(
-                f"Image ID = {local_image.id} was signed, but under different tag(s) than it's known by locally; double-check it's the intended image if selecting by tag."
+                f"Image ID = {local_image} was signed, but under different tag(s) than it's known by locally; double-check it's the intended image if selecting by tag."
             )
-        verified.append("Verified image ID = " + local_image.id + aka_msg)
+        verified.append("Verified image ID = " + local_image + aka_msg)
 
     error_if(not verified, "No image verified")
     return verified, warnings
 
 
-def images_handle_index(client):
+def parse_sigbody(sigbody):
+    "generate payload.DockerEntry (image ID, signed tags & repo digests) for each signature element"
+    try:
+        yield from payload.docker_entries(sigbody)
+    except payload.ErrorMessage as err:
+        error_if(True, err.args[0])
+
+
+def local_images(docker_host):
+    "list dockerd's images; return handle index & attrs by image ID"
+    client = docker.DockerClient(docker_host, version="auto")
+    images_attrs = {}
+    for image in client.images.list():
+        assert image.id == image.attrs["Id"]
+        images_attrs[image.id] = image.attrs
+    return images_handle_index(images_attrs), images_attrs
+
+
+def images_handle_index(images_attrs):
     # omnibus index of docker image IDs by ID, short ID, RepoTags, RepoDigests
     ans = {}
-    for image in client.images.list():
-        attrs = image.attrs
-        assert image.id == attrs["Id"]
-        ans.setdefault(image.id, set()).add(image.id)
-        ans.setdefault(image.id[:12], set()).add(image.id)
-        ans.setdefault(image.short_id, set()).add(image.id)
-        for tag in attrs.get("RepoTags", []):
-            ans.setdefault(tag, set()).add(image.id)
-        for dig in attrs.get("RepoDigests", []):
-            ans.setdefault(dig, set()).add(image.id)
+    for image_id, attrs in images_attrs.items():
+        ans.setdefault(image_id, set()).add(image_id)
+        ans.setdefault(image_id[:12], set()).add(image_id)
+        ans.setdefault(image_id[:17], set()).add(image_id)  # docker-py short_id
+        for tag in attrs.get("RepoTags") or []:
+            ans.setdefault(tag, set()).add(image_id)
+        for dig in attrs.get("RepoDigests") or []:
+            ans.setdefault(dig, set()).add(image_id)
     return ans
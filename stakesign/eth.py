@@ -0,0 +1,187 @@
+import os
+import math
+import time
+from datetime import datetime
+import dateutil
+import dateutil.tz
+import dateutil.parser
+import web3
+from web3.datastructures import AttributeDict
+from .console import EX_TEMPFAIL, print_tsv, bail, yellow
+from . import payload, ratelimit
+
+# Ethereum gateway connection & signature transaction helpers, shared by the subcommands and the
+# Python API
+
+
+DEFAULT_STAKE_FLOOR_ETH = 0.1
+DEFAULT_GATEWAY = "https://cloudflare-eth.com"
+# where local Ethereum nodes put their IPC sockets by default, checked in order
+LOCAL_IPC_PATHS = (
+    "~/.ethereum/geth.ipc",
+    "~/Library/Ethereum/geth.ipc",
+    "/tmp/reth.ipc",
+    "~/.local/share/erigon/erigon.ipc",
+)
+
+
+def get_sig(w3, txid):
+    "Query blockchain for signature transaction details"
+    tx = w3.eth.getTransaction(txid)
+    txr = w3.eth.getTransactionReceipt(txid)
+    block_num = tx.blockNumber
+    if not block_num:
+        raise web3.exceptions.TransactionNotFound("transaction pending (no block number yet)")
+    blk = w3.eth.getBlock(block_num)
+
+    signer = txr["from"]
+    assert tx["from"] == signer
+
+    return AttributeDict(
+        {
+            "id": txid,
+            "timestamp": datetime.utcfromtimestamp(blk.timestamp),
+            "block": tx.blockNumber,
+            "signer": signer,
+            "input": tx.input,
+        }
+    )
+
+
+def decode_sig_input(w3, sig):  # pylint: disable=W0613
+    "Decode signature input data to header dict & body memoryview (see payload.decode)"
+    try:
+        return payload.decode(sig.input)
+    except payload.ErrorMessage as err:
+        raise ValueError(err.args[0]) from None
+
+
+def check_sig_expire(header, utcnow):
+    assert isinstance(utcnow, datetime)
+    expire = None
+    if "expire" in header:
+        try:
+            assert isinstance(header["expire"], str)
+            expire = (
+                dateutil.parser.isoparse(header["expire"])
+                .astimezone(dateutil.tz.tzutc())
+                .replace(tzinfo=None)
+            )
+        except:
+            raise ValueError(
+                "Transaction header.expire has invalid value (expected ISO 8601)"
+            ) from None
+    return AttributeDict(
+        {
+            "unexpired": expire and expire > utcnow,
+            "expire_utc": expire,
+            "now_utc": utcnow,
+        }
+    )
+
+
+def check_sig_stake(w3, sig, header, stake_floor_wei, ignore_ad=False, signer_wei=None):
+    """
+    Check whether the signing address has sufficient current ETH balance (queried unless
+    signer_wei is given, e.g. as proven by an offline bundle). The result's warnings list any
+    stakeAd irregularities, for the caller to report.
+    """
+    assert isinstance(header, dict)
+    assert isinstance(stake_floor_wei, int)
+
+    if signer_wei is None:
+        signer_wei = w3.eth.getBalance(sig.signer)
+    assert isinstance(signer_wei, int)
+
+    required_wei = stake_floor_wei
+    required_wei_source = "--stake"
+    warnings = []
+    if not ignore_ad and "stakeAd" in header:
+        stake_ad = header["stakeAd"]
+        if not isinstance(stake_ad, dict):
+            raise ValueError("Transaction header.stakeAd has invalid value")
+        if "ETH" in stake_ad:
+            stake_ad = stake_ad["ETH"]
+            if not (isinstance(stake_ad, float) and math.isfinite(stake_ad)):
+                raise ValueError("Transaction header.stakeAd has invalid ETH value")
+            stake_ad = w3.toWei(stake_ad, "ether")
+            if stake_ad > required_wei:
+                required_wei = stake_ad
+                required_wei_source = "stakeAd"
+        else:
+            warnings.append("Transaction header.stakeAd doesn't specify ETH value")
+
+    return AttributeDict(
+        {
+            "enough": signer_wei >= required_wei,
+            "signer_wei": signer_wei,
+            "required_wei": required_wei,
+            "required_wei_source": required_wei_source,
+            "warnings": warnings,
+        }
+    )
+
+
+def gateway():
+    """
+    connect to ETH gateway set by environment WEB3_PROVIDER_URI; or else a local node's IPC socket,
+    if found; or else the default HTTPS gateway
+    """
+    uri, provider_msg, w3, rtt = select_gateway(
+        lambda ipc_path: print(yellow(f"[WARN] Local node IPC socket {ipc_path} isn't responding"))
+    )
+    if not w3:
+        try:
+            w3, rtt = connect(uri)
+        except Exception as err:  # pylint: disable=W0703
+            bail(f"ETH gateway {uri} unreachable: {err}")
+
+    transport = {"file": "IPC", "ws": "WebSocket", "wss": "WebSocket"}.get(
+        uri.split(":", 1)[0], uri.split(":", 1)[0].upper()
+    )
+    print_tsv("Trusting ETH gateway:", uri, f"({transport}, {rtt * 1000:.1f}ms RTT)", provider_msg)
+    return w3
+
+
+def select_gateway(on_unresponsive=None):
+    """
+    choose ETH gateway: environment WEB3_PROVIDER_URI; or else a local node's IPC socket, if found
+    responding (calling on_unresponsive(path) for any that isn't); or else the default HTTPS
+    gateway. Returns URI, provenance note, and the web3 & round-trip time if already connected (to
+    the IPC socket, probing it), else Nones
+    """
+    uri = os.environ.get("WEB3_PROVIDER_URI")
+    if uri:
+        return uri, "(from environment WEB3_PROVIDER_URI)", None, None
+    for ipc_path in LOCAL_IPC_PATHS:
+        ipc_path = os.path.expanduser(ipc_path)
+        if os.path.exists(ipc_path):
+            uri = "file://" + ipc_path
+            try:
+                w3, rtt = connect(uri)
+                return uri, "(local node; to override, set environment WEB3_PROVIDER_URI)", w3, rtt
+            except Exception:
+                if on_unresponsive:
+                    on_unresponsive(ipc_path)
+    return DEFAULT_GATEWAY, "(to override, set environment WEB3_PROVIDER_URI)", None, None
+
+
+def connect(uri):
+    "connect to ETH gateway URI (http[s]://, ws[s]://, or file:// IPC socket); measure round-trip time"
+    from web3.providers.auto import load_provider_from_uri  # pylint: disable=C0415
+
+    try:
+        w3 = ratelimit.install(web3.Web3(load_provider_from_uri(uri)))
+        t0 = time.monotonic()
+        w3.eth.blockNumber  # pylint: disable=W0104
+        return w3, time.monotonic() - t0
+    except ratelimit.SettingError as err:
+        bail(err.args[0])
+    except Exception as err:
+        if uri.startswith("file://"):
+            raise
+        bail(
+            f"ETH gateway {uri} unreachable: {err}",
+            EX_TEMPFAIL if isinstance(err, ratelimit.ErrorMessage) else 1,
+        )
+    return None, None
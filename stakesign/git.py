@@ -1,6 +1,12 @@
+import os
+import tempfile
 import json
 from pathlib import Path
-from pygit2 import Repository, Commit, Reference, Tag  # pylint: disable=E0611
+from concurrent.futures import ThreadPoolExecutor
+from pygit2 import Repository, Commit, Reference, Tag, Config, GitError  # pylint: disable=E0611
+from . import payload
+
+GITLINK_FILEMODE = 0o160000
 
 
 class ErrorMessage(Exception):
@@ -34,20 +40,20 @@ def prepare(repo, revisions):
         assert not ref or isinstance(ref, Reference)
         result = {}
         if isinstance(obj, Commit):
-            result["commit"] = obj.hex
-            all_sha256 = all_sha256 and len(obj.hex) == 64
+            result["commit"] = str(obj.id)
+            all_sha256 = all_sha256 and len(str(obj.id)) == 64
             if ref and ref.name.startswith("refs/tags/"):  # lightweight tag
                 result["tag"] = ref.name[10:]
         elif isinstance(obj, Tag):  # annotated tag
-            result["commit"] = obj.target.hex
+            result["commit"] = str(obj.target)
             result["tag"] = obj.name
-            result["tagObject"] = obj.hex
-            all_sha256 = all_sha256 and len(obj.target.hex) == 64 and len(obj.hex) == 64
+            result["tagObject"] = str(obj.id)
+            all_sha256 = all_sha256 and len(str(obj.target)) == 64 and len(str(obj.id)) == 64
         else:
             assert False
         results.append(result)
 
-    head_commit = repo.revparse_ext("HEAD")[0].hex
+    head_commit = str(repo.revparse_ext("HEAD")[0].id)
     if head_commit not in (res["commit"] for res in results):
         warnings.append(
             f"The revisions to sign don't include the current working tree HEAD = {head_commit}"
@@ -76,15 +82,15 @@ def verify(repo, revision, sigbody, ignore_missing=False):  # pylint: disable=R0
     except KeyError:
         error_if(True, f"Failed to `git rev-parse {revision}`")
     if isinstance(obj_to_verify, Commit):
-        commit_to_verify = obj_to_verify.hex
+        commit_to_verify = str(obj_to_verify.id)
     elif isinstance(obj_to_verify, Tag):
-        commit_to_verify = obj_to_verify.target.hex
+        commit_to_verify = str(obj_to_verify.target)
     else:
         assert False
 
     # check status of current checkout
     warnings = set()
-    head_commit = repo.revparse_ext("HEAD")[0].hex
+    head_commit = str(repo.revparse_ext("HEAD")[0].id)
     if head_commit != commit_to_verify:
         warnings.add(
             f"Verified revision{revision} = {commit_to_verify} is not the working tree HEAD = {head_commit}"
@@ -100,32 +106,30 @@ def verify(repo, revision, sigbody, ignore_missing=False):  # pylint: disable=R0
     # Look for signature of commit_to_verify
     # Warning about warning messages: sigbody comes off the blockchain, so we shouldn't include
     # anything from it in warning messages without validation (in case it is malicious)
-    lines = [line for line in sigbody.split(b"\n") if line]
-    for line in lines:  # pylint: disable=R1702
-        try:
-            sig_elt = json.loads(line.decode())
-            assert isinstance(sig_elt.get("commit"), str)
-        except:
-            error_if(True, "Invalid signature syntax")
-        if not repo.get(sig_elt["commit"]):
-            error_if(
-                not ignore_missing,
-                (
-                    "Signed commit missing from local repository"
-                    if len(lines) <= 1
-                    else "Signed commit(s) missing from local repository; try --ignore-missing if OK for some but not all to be present"
-                ),
-            )
+    # (submodule elements pertain to other repositories; see verify_submodules)
+    sig_elts = (sig_elt for sig_elt in parse_sigbody(sigbody) if sig_elt.submodule is None)
+    count = 0
+    for sig_elt in sig_elts:  # pylint: disable=R1702
+        count += 1
+        if not repo.get(sig_elt.commit):
+            if not ignore_missing:
+                # (peeking at the next element, to word the error, is fine since we're bailing out)
+                error_if(
+                    True,
+                    (
+                        "Signed commit missing from local repository"
+                        if count == 1 and next(sig_elts, None) is None
+                        else "Signed commit(s) missing from local repository; try --ignore-missing if OK for some but not all to be present"
+                    ),
+                )
             warnings.add("One or more signed commit(s) missing from local repository")
         # If the signature includes tags, make sure they don't refer to commits other than the
         # signed ones. There are several cases to deal with here as the signed & local tags could
         # each be either lightweight or annotated.
         local_tag = None
-        if "tag" in sig_elt:
-            assert isinstance(sig_elt["tag"], str)
-            assert "tagObject" not in sig_elt or isinstance(sig_elt["tagObject"], str)
+        if sig_elt.tag is not None:
             try:
-                local_tag = repo.revparse_ext(sig_elt["tag"])
+                local_tag = repo.revparse_ext(sig_elt.tag)
             except KeyError:
                 error_if(
                     not ignore_missing,
@@ -140,32 +144,32 @@ def verify(repo, revision, sigbody, ignore_missing=False):  # pylint: disable=R0
                     "The signed tag refers locally to something else: " + local_tag[1].name,
                 )
                 error_if(
-                    local_tag[0].hex != sig_elt["commit"],
+                    str(local_tag[0].id) != sig_elt.commit,
                     f"The local tag '{local_tag[1].shorthand}' refers to a different commit than the signed tag",
                 )
-                if "tagObject" in sig_elt:
+                if sig_elt.tag_object is not None:
                     warnings.add(
                         f"The local tag '{local_tag[1].shorthand}' is lightweight, while the signed tag was annotated"
                     )
             elif isinstance(local_tag[0], Tag):  # local annotated tag
-                if "tagObject" in sig_elt:
+                if sig_elt.tag_object is not None:
                     error_if(
-                        sig_elt["tagObject"] != local_tag[0].hex,
-                        f"The local tag '{local_tag[0].name}' = {local_tag[0].hex} differs from the signed tag in annotations (although they share the same name and commit reference)",
+                        sig_elt.tag_object != str(local_tag[0].id),
+                        f"The local tag '{local_tag[0].name}' = {local_tag[0].id} differs from the signed tag in annotations (although they share the same name and commit reference)",
                     )
                 else:
                     error_if(
-                        local_tag[0].target.hex != sig_elt["commit"],
-                        f"The local annotated tag '{local_tag[0].name}' = {local_tag[0].hex} refers to a different commit than the signed tag",
+                        str(local_tag[0].target) != sig_elt.commit,
+                        f"The local annotated tag '{local_tag[0].name}' = {local_tag[0].id} refers to a different commit than the signed tag",
                     )
                     warnings.add(
                         f"The local tag '{local_tag[1].shorthand}' is annotated, while the signed tag was lightweight"
                     )
-                all_sha256 = all_sha256 and len(local_tag[0].hex) == 64
+                all_sha256 = all_sha256 and len(str(local_tag[0].id)) == 64
             elif local_tag[0] is not None:
                 assert False
         # At last...check whether sig_elt signs the desired commit
-        if sig_elt["commit"] == commit_to_verify:
+        if sig_elt.commit == commit_to_verify:
             if local_tag and local_tag[1]:
                 verified = f"Verified: local revision {revision} = signed tag {local_tag[1].shorthand} (commit {commit_to_verify})"
             elif verified is None:
@@ -179,6 +183,168 @@ def verify(repo, revision, sigbody, ignore_missing=False):  # pylint: disable=R0
     return verified, warnings
 
 
+def parse_sigbody(sigbody):
+    "generate payload.GitEntry for each element of signature body, parsing lazily"
+    try:
+        yield from payload.git_entries(sigbody)
+    except payload.ErrorMessage as err:
+        error_if(True, err.args[0])
+
+
+def valid_submodule_path(path):
+    return isinstance(path, str) and payload.valid_submodule_path(path)
+
+
+def gitmodules_paths(commit):
+    "submodule paths listed in the .gitmodules of the commit"
+    try:
+        blob = commit.tree[".gitmodules"]
+    except KeyError:
+        return []
+    # parse it as git does (quoting, comments, continuations) with libgit2's config reader, which
+    # only reads files
+    with tempfile.NamedTemporaryFile(prefix="stakesign-gitmodules-") as tmp:
+        tmp.write(blob.data)
+        tmp.flush()
+        try:
+            return [
+                entry.value
+                for entry in Config(tmp.name)
+                if entry.name.startswith("submodule.") and entry.name.endswith(".path")
+            ]
+        except GitError:
+            error_if(True, f"Invalid .gitmodules in commit {commit.id}")
+    return []
+
+
+def gitlink(commit, path):
+    "the submodule commit pinned at path in the commit's tree, or None"
+    try:
+        entry = commit.tree[path]
+    except KeyError:
+        return None
+    return str(entry.id) if entry.filemode == GITLINK_FILEMODE else None
+
+
+def submodule_repository(path):
+    """
+    the submodule's repository checked out at path, or None if it isn't (without searching the
+    parent directories, which would find the superproject's)
+    """
+    if not os.path.exists(os.path.join(path, ".git")):
+        return None
+    try:
+        return Repository(path)
+    except GitError:
+        return None
+
+
+def submodules(repo_dir, commit, prefix=""):
+    """
+    list (path, commit) of the submodules pinned by the commit, recursing into nested submodules
+    of those checked out locally; with warnings about any not checked out at their pinned commits
+    """
+    ans = []
+    warnings = []
+    for path in gitmodules_paths(commit):
+        sub_commit = gitlink(commit, path)
+        if not sub_commit:
+            continue
+        error_if(not valid_submodule_path(path), "Unsupported submodule path: " + prefix + path)
+        ans.append((prefix + path, sub_commit))
+        sub_repo = submodule_repository(os.path.join(repo_dir, path))
+        if sub_repo is None:
+            warnings.append(f"Submodule {prefix + path} isn't checked out; can't include its own")
+            continue
+        if str(sub_repo.revparse_ext("HEAD")[0].id) != sub_commit:
+            warnings.append(
+                f"Submodule {prefix + path} HEAD differs from its pinned commit {sub_commit}, which will be signed"
+            )
+        sub_obj = sub_repo.get(sub_commit)
+        if not isinstance(sub_obj, Commit):
+            warnings.append(f"Submodule {prefix + path} lacks its pinned commit {sub_commit}")
+            continue
+        nested, nested_warnings = submodules(
+            os.path.join(repo_dir, path), sub_obj, prefix + path + "/"
+        )
+        ans.extend(nested)
+        warnings.extend(nested_warnings)
+    return ans, warnings
+
+
+def prepare_recursive(repo_dir, repo, revision):
+    "prepare signature of revision and (recursively) the submodule commits it pins"
+    body, warnings = prepare(repo, [revision])
+    commit = repo.revparse_ext(revision)[0].peel(Commit)
+    subs, sub_warnings = submodules(repo_dir, commit)
+    warnings.extend(sub_warnings)
+    body += b"".join(
+        json.dumps({"submodule": path, "commit": sub_commit}, separators=(",", ":")).encode()
+        + b"\n"
+        for path, sub_commit in subs
+    )
+    return body, warnings
+
+
+def verify_submodules(
+    repo_dir, repo, revision, sigbody, ignore_missing=False, jobs=8
+):  # pylint: disable=R0913,R0914
+    """
+    Verify the checked-out submodules against the signed submodule commits (concurrently), after
+    checking those are consistently pinned by the verified superproject revision & by each other.
+    """
+    sig_elts = {
+        sig_elt.submodule: sig_elt.commit
+        for sig_elt in parse_sigbody(sigbody)
+        if sig_elt.submodule is not None
+    }
+    error_if(not sig_elts, "Signature doesn't cover any submodules")
+
+    def check(path):
+        "return the submodule's local commit if it's the signed one, and any problem found"
+        sub_repo = submodule_repository(os.path.join(repo_dir, path))
+        if sub_repo is None:
+            return None, f"Signed submodule {path} isn't checked out"
+        head_commit = str(sub_repo.revparse_ext("HEAD")[0].id)
+        if head_commit != sig_elts[path]:
+            return None, f"Submodule {path} HEAD = {head_commit} isn't the signed commit"
+        if dirty(sub_repo):
+            return (
+                sub_repo.get(head_commit),
+                f"Submodule {path} working tree is dirty; signature applies to clean commit HEAD",
+            )
+        return sub_repo.get(head_commit), None
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        results = dict(zip(sig_elts, pool.map(check, sig_elts)))
+
+    # each signed submodule commit must be the one pinned by the signed commit of the innermost
+    # enclosing (sub)module; recheck that chain down from the verified superproject revision
+    commits = {"": repo.revparse_ext(revision)[0].peel(Commit)}
+    verified = []
+    warnings = set()
+    for path in sorted(sig_elts, key=lambda p: p.count("/")):
+        parent = max(
+            (other for other in commits if path.startswith(other + "/")), key=len, default=""
+        )
+        if commits[parent] is not None:
+            error_if(
+                gitlink(commits[parent], path[len(parent) :].lstrip("/")) != sig_elts[path],
+                f"Signed commit of submodule {path} isn't the one pinned by its superproject",
+            )
+        commits[path], problem = results[path]
+        if problem:
+            error_if(
+                not (ignore_missing or commits[path]),
+                problem + "; try --ignore-missing if OK for some submodules to be unverified",
+            )
+            warnings.add(problem)
+        if commits[path]:
+            verified.append(f"Verified: submodule {path} = signed commit {sig_elts[path]}")
+    error_if(not verified, "No submodule verified")
+    return verified, warnings
+
+
 def dirty(repo):
     for v in repo.status().values():
         if v & (1 << 14):  # GIT_STATUS_IGNORED
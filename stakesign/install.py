@@ -0,0 +1,87 @@
+import os
+import stat
+import tempfile
+from . import manifest
+
+# verify --install DEST: copy signed files into DEST while hashing them, so that each byte is read
+# once, and renaming each into place only once its digest matches the signature.
+
+CHUNK_SIZE = 1 << 20
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def install(body, dest, new_hasher, tool, ignore_missing=False, cwd=None, **kwargs):
+    """
+    copy each file listed in the signature body from cwd into dest, hashing it in flight with
+    new_hasher(); report per file as `sha256sum --check` would, and return overall success
+    (kwargs report & quiet as for manifest.check)
+    """
+    targets = {filename: target_path(dest, filename) for filename, _, _ in manifest.parse(body)}
+    os.makedirs(dest, exist_ok=True)
+
+    def install_file(filename, digest):
+        with open(os.path.join(cwd or ".", filename), "rb") as infile:
+            mode = stat.S_IMODE(os.fstat(infile.fileno()).st_mode)
+            return install_stream(infile, targets[filename], new_hasher(), digest, mode=mode)
+
+    return manifest.check(body, install_file, tool, ignore_missing=ignore_missing, **kwargs)
+
+
+def make_dirs(body, dest):
+    "create dest and the directories to hold the files signed in body (e.g. to watch them first)"
+    os.makedirs(dest, exist_ok=True)
+    for filename, _, _ in manifest.entries(body):
+        os.makedirs(os.path.dirname(target_path(dest, filename)), exist_ok=True)
+
+
+def target_path(dest, filename):
+    "path at which to install filename under dest (refusing any outside it)"
+    error_if(
+        os.path.isabs(filename) or ".." in filename.split(os.sep),
+        "Signed filename would install outside DEST: " + manifest.printable(filename),
+    )
+    return os.path.join(dest, filename)
+
+
+def install_stream(infile, target, hasher, digest, mode=None):
+    """
+    write infile to a temporary file beside target while hashing it; atomically rename to target
+    (with permissions mode, default per umask) if the digest matches, otherwise remove it. Returns
+    whether the digest matched.
+    """
+    if mode is None:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    target_dir = os.path.dirname(target) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=target_dir, prefix=".stakesign-", suffix=".tmp", delete=False
+    ) as outfile:
+        try:
+            while True:
+                chunk = infile.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                outfile.write(chunk)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+            ok = hasher.hexdigest() == digest
+            if ok:
+                os.chmod(outfile.name, mode)
+                os.replace(outfile.name, target)
+        except BaseException:
+            os.unlink(outfile.name)
+            raise
+    if not ok:
+        os.unlink(outfile.name)
+    return ok
@@ -0,0 +1,230 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from .console import print_tsv
+from . import manifest
+
+# I/O scheduling for hashing many files, esp. on network filesystems (NFS, Lustre, ...) where one
+# sequential reader of small blocks is latency-bound, but unbounded parallelism overloads the
+# servers. Files are hashed concurrently, with a separate cap on concurrent readers per mount
+# (stricter for network mounts); each is read in large aligned chunks with sequential/readahead
+# hints, dropping the pages behind the reader so a big dataset doesn't thrash the page cache.
+
+READ_SIZE = 8 << 20  # multiple of page size and typical NFS rsize/Lustre stripe size
+NETWORK_FSTYPES = {
+    "nfs",
+    "nfs4",
+    "lustre",
+    "cifs",
+    "smb3",
+    "gpfs",
+    "beegfs",
+    "ceph",
+    "glusterfs",
+    "9p",
+    "fuse.sshfs",
+    "fuse.glusterfs",
+    "fuse.gcsfuse",
+    "fuse.s3fs",
+}
+DEFAULT_MOUNT_JOBS = 4  # per network mount
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def mounts():
+    "list of (mount point, fstype) from /proc/self/mountinfo, empty if unavailable (non-Linux)"
+    ans = []
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8", errors="surrogateescape") as infile:
+            for line in infile:
+                fields, sep, rest = line.partition(" - ")
+                fields = fields.split()
+                if sep and len(fields) >= 5 and rest.split():
+                    ans.append((unescape_mountinfo(fields[4]), rest.split()[0]))
+    except OSError:
+        pass
+    return ans
+
+
+def unescape_mountinfo(path):
+    "undo mountinfo's octal escapes (\\040 for space etc.)"
+    if "\\" not in path:
+        return path
+    return os.fsdecode(os.fsencode(path).decode("unicode_escape").encode("latin-1"))
+
+
+class Scheduler:
+    """
+    Hashes files with up to jobs concurrent readers, at most mount_jobs of them on any one network
+    mount; accumulates per-mount statistics in .stats
+    """
+
+    def __init__(self, jobs=4, mount_jobs=DEFAULT_MOUNT_JOBS):
+        self.jobs = max(jobs, 1)
+        self.mount_jobs = max(mount_jobs, 1)
+        # longest mount point first, so the first prefix match is the innermost mount
+        self.mounts = sorted(mounts(), key=lambda mnt: len(mnt[0]), reverse=True)
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.stats = {}  # mount point -> {fstype, files, bytes, start, end}
+        self.local = threading.local()
+
+    def mount_of(self, path):
+        "(mount point, fstype) of path"
+        path = os.path.realpath(path)
+        for mount_point, fstype in self.mounts:
+            if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+                return mount_point, fstype
+        return "/", "unknown"
+
+    def semaphore(self, mount_point, fstype):
+        with self.lock:
+            if mount_point not in self.semaphores:
+                cap = self.mount_jobs if fstype in NETWORK_FSTYPES else self.jobs
+                self.semaphores[mount_point] = threading.BoundedSemaphore(cap)
+                self.stats[mount_point] = {
+                    "fstype": fstype,
+                    "files": 0,
+                    "bytes": 0,
+                    "start": None,
+                    "end": None,
+                }
+            return self.semaphores[mount_point]
+
+    def hash_file(self, filename, new_hasher):
+        "hex digest of file, read subject to its mount's concurrency cap"
+        mount_point, fstype = self.mount_of(filename)
+        with self.semaphore(mount_point, fstype):
+            t0 = time.monotonic()
+            digest, size = read_file(filename, new_hasher(), self.buffer())
+            t1 = time.monotonic()
+        with self.lock:
+            st = self.stats[mount_point]
+            st["files"] += 1
+            st["bytes"] += size
+            st["start"] = t0 if st["start"] is None else min(st["start"], t0)
+            st["end"] = t1 if st["end"] is None else max(st["end"], t1)
+        return digest
+
+    def buffer(self):
+        "per-thread read buffer, reused across files"
+        if not hasattr(self.local, "buf"):
+            self.local.buf = bytearray(READ_SIZE)
+        return self.local.buf
+
+    def digests(self, filenames, new_hasher):
+        """
+        generate (filename, hex digest or OSError) for each of filenames, in order, hashing
+        concurrently with bounded lookahead
+        """
+
+        def task(filename):
+            try:
+                return filename, self.hash_file(filename, new_hasher)
+            except OSError as err:
+                return filename, err
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = deque()
+            for filename in filenames:
+                pending.append(pool.submit(task, filename))
+                if len(pending) >= 4 * self.jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def throughput(self):
+        "list of (mount point, fstype, files, bytes, seconds) for the mounts read"
+        return [
+            (
+                mount_point,
+                st["fstype"],
+                st["files"],
+                st["bytes"],
+                (st["end"] - st["start"]) if st["files"] else 0.0,
+            )
+            for mount_point, st in sorted(self.stats.items())
+        ]
+
+
+def read_file(filename, hasher, buf):
+    "hash file with large reads into buf, advising the kernel of sequential access; return digest & size"
+    fadvise = hasattr(os, "posix_fadvise")  # unavailable on macOS
+    view = memoryview(buf)
+    size = 0
+    fd = os.open(filename, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        if fadvise:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with os.fdopen(fd, "rb", buffering=0, closefd=False) as infile:
+            while True:
+                if fadvise:  # start reading ahead the following chunk while we hash this one
+                    os.posix_fadvise(fd, size + len(buf), len(buf), os.POSIX_FADV_WILLNEED)
+                n = infile.readinto(view)
+                if not n:
+                    break
+                hasher.update(view[:n])
+                if fadvise:  # done with these pages
+                    os.posix_fadvise(fd, size, n, os.POSIX_FADV_DONTNEED)
+                size += n
+    finally:
+        os.close(fd)
+    return hasher.hexdigest(), size
+
+
+def prepare(files, sched, new_hasher, cwd=None, tee=None):
+    """
+    hash files with the scheduler; prepare input body for signing transaction as bytes (calling
+    tee, if given, with each line as it's hashed)
+    """
+    lines = []
+    paths = (os.path.join(cwd or ".", filename) for filename in files)
+    for filename, (_, digest) in zip(files, sched.digests(paths, new_hasher)):
+        error_if(isinstance(digest, OSError), f"{filename}: {getattr(digest, 'strerror', '')}")
+        lines.append(manifest.format_line(digest, filename))
+        if tee:
+            tee(lines[-1])
+    return b"".join(lines)
+
+
+def check(body, sched, new_hasher, tool, cwd=None, **kwargs):
+    """
+    check files against signature body with the scheduler, reporting as manifest.check (kwargs
+    ignore_missing, report & quiet as for it); return success
+    """
+    # a second lazy pass over body yields the paths to read ahead of manifest.check's own pass
+    digests = sched.digests(
+        (os.path.join(cwd or ".", filename) for filename, _, _ in manifest.entries(body)),
+        new_hasher,
+    )
+
+    def check_file(_, digest):  # called by manifest.check for each entry, in order
+        _, local_digest = next(digests)
+        if isinstance(local_digest, OSError):
+            raise local_digest
+        return local_digest == digest
+
+    return manifest.check(body, check_file, tool, **kwargs)
+
+
+def print_throughput(throughput, width=21):
+    "print per-mount throughput (from Scheduler.throughput), labels right-aligned to width"
+    for mount_point, fstype, files, size, seconds in throughput:
+        print_tsv(
+            "Read from mount:".rjust(width),
+            mount_point,
+            fstype,
+            f"{files} files",
+            f"{size / 1048576:.1f} MiB",
+            f"{size / 1048576 / seconds:.1f} MiB/s" if seconds > 0 else "-",
+        )
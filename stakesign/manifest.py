@@ -0,0 +1,120 @@
+import os
+import sys
+import subprocess
+import tempfile
+from . import payload
+
+# Reading & writing signature bodies in the sha256sum line format:
+#   DIGEST  FILENAME
+# where a leading backslash means FILENAME has its backslashes & newlines escaped (as GNU
+# coreutils does), and "DIGEST *FILENAME" marks binary mode (equivalent on POSIX).
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def parse(body):
+    "parse body into list of (filename, hex digest, line bytes including newline)"
+    return list(entries(body))
+
+
+def entries(body):
+    "generate payload.FileEntry (filename, hex digest, line) for each line of body, parsing lazily"
+    try:
+        yield from payload.file_entries(body)
+    except payload.ErrorMessage as err:
+        error_if(True, err.args[0])
+
+
+def format_line(digest, filename):
+    "format manifest line as sha256sum would (including newline)"
+    filename = os.fsencode(filename)
+    if any(ch in filename for ch in (b"\\", b"\n", b"\r")):
+        filename = filename.replace(b"\\", b"\\\\").replace(b"\n", b"\\n").replace(b"\r", b"\\r")
+        return b"\\" + digest.encode() + b"  " + filename + b"\n"
+    return digest.encode() + b"  " + filename + b"\n"
+
+
+def printable(filename):
+    "filename with any unprintable characters masked, for display (esp. names off the blockchain)"
+    return "".join(ch if ch.isprintable() else "?" for ch in filename)
+
+
+def check(body, check_file, tool, ignore_missing=False, report=None, quiet=False):
+    """
+    check each file listed in body using check_file(filename, digest) -> bool, which raises
+    OSError if the file can't be read; report as `sha256sum --check` would (unless quiet) & return
+    success. Also calls report(filename, status) with status OK, FAILED, or MISSING, if given.
+    """
+    verified = failed = missing = 0
+    for filename, digest, _ in entries(body):
+        try:
+            ok = check_file(filename, digest)
+        except OSError:
+            if report:
+                report(filename, "MISSING")
+            if not (ignore_missing or quiet):
+                print(printable(filename) + ": FAILED open or read")
+            missing += 1
+            continue
+        if report:
+            report(filename, "OK" if ok else "FAILED")
+        if not quiet:
+            print(printable(filename) + (": OK" if ok else ": FAILED"))
+            sys.stdout.flush()
+        if ok:
+            verified += 1
+        else:
+            failed += 1
+    if not quiet:
+        if failed:
+            print(f"{tool}: WARNING: {failed} computed checksum(s) did NOT match", file=sys.stderr)
+        if missing and not ignore_missing:
+            print(f"{tool}: WARNING: {missing} listed file(s) could not be read", file=sys.stderr)
+        if ignore_missing and not verified and not failed:
+            print(f"{tool}: no file was verified", file=sys.stderr)
+    return not failed and (ignore_missing or not missing) and verified > 0
+
+
+def prepare_sha256sum(files, sha256sum_exe, cwd=None, tee=None):
+    "run sha256sum on files; prepare input body for signing transaction as bytes"
+    # tee sha256sum stdout in realtime (to the tee callback, if given), to provide feedback whilst
+    # processing multiple large files
+    sha256sum_stdout = []
+    with subprocess.Popen([sha256sum_exe] + files, stdout=subprocess.PIPE, cwd=cwd) as proc:
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                break
+            sha256sum_stdout.append(line)  # includes newline
+            if tee:
+                tee(line)
+    error_if(proc.returncode != 0, "`sha256sum` utility failed")
+
+    return b"".join(sha256sum_stdout)
+
+
+def verify_sha256sum(header, body, exe, ignore_missing=False, no_strict=False, cwd=None):
+    "run given sha256sum executable to verify signature body"
+    assert header["stakesign"] == "sha256sum"
+    assert isinstance(body, (bytes, memoryview))
+
+    cmd = [exe, "--check"]
+    if not no_strict:
+        cmd.append("--strict")
+    if ignore_missing:
+        cmd.append("--ignore-missing")
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(body)
+        tmp.flush()
+        cmd.append(tmp.name)
+        res = subprocess.run(cmd, check=False, cwd=cwd)
+
+    return res.returncode == 0
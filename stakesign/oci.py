@@ -0,0 +1,323 @@
+import os
+import json
+import zlib
+import hashlib
+import tarfile
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from .docker import images_handle_index
+
+# Docker image engine reading `docker save` tarballs and OCI image layouts (directory or tar)
+# directly, without dockerd. The image ID is the SHA-256 digest of the image config blob, which
+# identifies the image content through the config's rootfs.diff_ids (layer digests).
+# --verify-layers checks each layer against those diff_ids, the digests of the uncompressed layer
+# tarballs: so, in an OCI layout, it decompresses the (gzip) layer blobs, as the layout's index &
+# manifests aren't themselves signed.
+
+CHUNK_SIZE = 1 << 20
+# archive members up to this size are kept in memory while streaming (metadata & config blobs)
+SMALL_MEMBER = 4 << 20
+OCI_INDEX_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+)
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def archive_images(path, verify_layers=False, jobs=4):
+    """
+    read images from a `docker save` tarball or OCI image layout (directory or tar); return handle
+    index & attrs by image ID, as docker.local_images does for dockerd. Optionally rehash the layer
+    blobs to check them against the (signed) config's diff_ids, and any manifest digests.
+    """
+    if os.path.isdir(path):
+        blobs = DirectoryBlobs(path, jobs)
+    else:
+        blobs = TarBlobs(path, verify_layers)
+    images_attrs = {}
+    error_if(
+        not blobs.has("manifest.json") and not blobs.has("index.json"),
+        "Not a `docker save` tarball or OCI image layout: " + path,
+    )
+    try:
+        if blobs.has("manifest.json"):
+            layer_checks = docker_save_images(blobs, images_attrs)
+        else:
+            layer_checks = oci_layout_images(blobs, images_attrs)
+    except (KeyError, TypeError, ValueError):
+        error_if(True, "Invalid image metadata in " + path)
+
+    if verify_layers:
+        check_layers(blobs, layer_checks)
+    return images_handle_index(images_attrs), images_attrs
+
+
+def check_layers(blobs, layer_checks):
+    """
+    check layer blobs per layer_checks [(blob name, blob sha256 hex or None, diff_id sha256 hex,
+    compression None/gzip/zstd)]
+    """
+    for name, _, _, compression in layer_checks:
+        error_if(
+            compression not in (None, "gzip"),
+            f"--verify-layers can't decompress {compression} image layer: {name}",
+        )
+    digests = blobs.digests(name for name, _, _, _ in layer_checks)
+    diff_digests = blobs.diff_digests(
+        name for name, _, _, compression in layer_checks if compression
+    )
+    for name, digest, diff_id, compression in layer_checks:
+        error_if(
+            digest is not None and digests.get(name) != digest,
+            "Image layer doesn't match its digest: " + name,
+        )
+        error_if(
+            (diff_digests if compression else digests).get(name) != diff_id,
+            "Image layer doesn't match the image config's diff_ids: " + name,
+        )
+
+
+def layer_compression(media_type):
+    "compression of layer blob, per its media type"
+    if media_type.endswith("gzip"):
+        return "gzip"
+    if media_type.endswith("zstd"):
+        return "zstd"
+    return None
+
+
+def docker_save_images(blobs, images_attrs):
+    """
+    add images listed in docker save manifest.json; return layer checks (see check_layers) for
+    the uncompressed layer blobs
+    """
+    layer_checks = []
+    for elt in blobs.json("manifest.json"):
+        config = blobs.read(elt["Config"])
+        image_id = "sha256:" + hashlib.sha256(config).hexdigest()
+        add_image(images_attrs, image_id, elt.get("RepoTags") or [])
+        diff_ids = json.loads(config)["rootfs"]["diff_ids"]
+        error_if(len(diff_ids) != len(elt["Layers"]), "Image layers inconsistent with config")
+        layer_checks.extend(
+            (layer, None, split_digest(diff_id), None)
+            for layer, diff_id in zip(elt["Layers"], diff_ids)
+        )
+    return layer_checks
+
+
+def oci_layout_images(blobs, images_attrs):
+    """
+    add images listed in OCI layout index.json; return layer checks (see check_layers) for the
+    layer blobs, both against the manifest digests & the config diff_ids
+    """
+    layer_checks = []
+    for desc in oci_manifests(blobs, blobs.json("index.json")):
+        manifest_blob = blobs.read(blob_name(desc["digest"]))
+        error_if(
+            hashlib.sha256(manifest_blob).hexdigest() != split_digest(desc["digest"]),
+            "Image manifest doesn't match its digest",
+        )
+        image_manifest = json.loads(manifest_blob)
+        config_digest = image_manifest["config"]["digest"]
+        config = blobs.read(blob_name(config_digest))
+        error_if(
+            "sha256:" + hashlib.sha256(config).hexdigest() != config_digest,
+            "Image config doesn't match its digest",
+        )
+        annotations = desc.get("annotations") or {}
+        name = annotations.get("io.containerd.image.name") or annotations.get(
+            "org.opencontainers.image.ref.name"
+        )
+        add_image(images_attrs, config_digest, [name] if name else [])
+        diff_ids = json.loads(config)["rootfs"]["diff_ids"]
+        error_if(
+            len(diff_ids) != len(image_manifest["layers"]), "Image layers inconsistent with config"
+        )
+        layer_checks.extend(
+            (
+                blob_name(layer["digest"]),
+                split_digest(layer["digest"]),
+                split_digest(diff_id),
+                layer_compression(layer.get("mediaType", "")),
+            )
+            for layer, diff_id in zip(image_manifest["layers"], diff_ids)
+        )
+    return layer_checks
+
+
+def add_image(images_attrs, image_id, tags):
+    attrs = images_attrs.setdefault(image_id, {"Id": image_id, "RepoTags": [], "RepoDigests": []})
+    attrs["RepoTags"].extend(tag for tag in tags if tag not in attrs["RepoTags"])
+
+
+def oci_manifests(blobs, index):
+    "image manifest descriptors from OCI index, descending into nested (multi-platform) indexes"
+    for desc in index.get("manifests", []):
+        if desc.get("mediaType") in OCI_INDEX_TYPES:
+            nested = blobs.json(blob_name(desc["digest"]))
+            for nested_desc in oci_manifests(blobs, nested):
+                nested_desc = dict(nested_desc)
+                nested_desc.setdefault("annotations", desc.get("annotations"))
+                yield nested_desc
+        else:
+            yield desc
+
+
+def split_digest(digest):
+    algo, _, hexdigest = digest.partition(":")
+    error_if(algo != "sha256" or not hexdigest, "Unsupported image digest: " + digest)
+    return hexdigest
+
+
+def blob_name(digest):
+    return "blobs/sha256/" + split_digest(digest)
+
+
+class DirectoryBlobs:
+    "blobs in OCI layout directory"
+
+    def __init__(self, path, jobs):
+        self.path = path
+        self.jobs = jobs
+
+    def has(self, name):
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), "rb") as infile:
+            return infile.read()
+
+    def json(self, name):
+        return json.loads(self.read(name))
+
+    def digests(self, names):
+        "sha256 hex digests of the named blobs, hashed in parallel"
+        names = sorted(set(names))
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as pool:
+            return dict(zip(names, pool.map(self.hash_file, names)))
+
+    def diff_digests(self, names):
+        "sha256 hex digests of the named (gzip) blobs' decompressed contents, in parallel"
+        names = sorted(set(names))
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as pool:
+            return dict(zip(names, pool.map(self.hash_file, names, [GunzipHasher] * len(names))))
+
+    def hash_file(self, name, new_hasher=hashlib.sha256):
+        hasher = new_hasher()
+        try:
+            with open(os.path.join(self.path, name), "rb") as infile:
+                while True:
+                    chunk = infile.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+        except OSError:
+            return None
+        return hasher.hexdigest()
+
+
+class GunzipHasher:
+    "sha256 of gzip-decompressed data (None if it isn't valid gzip)"
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        self.valid = True
+
+    def update(self, data):
+        try:
+            while data and self.valid:
+                if self.decompressor.eof:  # next member of multi-member gzip
+                    self.decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+                self.hasher.update(self.decompressor.decompress(data))
+                data = self.decompressor.unused_data
+        except zlib.error:
+            self.valid = False
+
+    def hexdigest(self):
+        if not (self.valid and self.decompressor.eof):  # invalid or truncated
+            return None
+        return self.hasher.hexdigest()
+
+
+class TarBlobs:
+    """
+    blobs in `docker save` or OCI layout tarball, read in one sequential pass: small members are
+    kept in memory, and (if hash_all) every member is hashed in flight -- also decompressing those
+    that are gzipped, for their diff_ids
+    """
+
+    def __init__(self, path, hash_all):
+        self.small = {}
+        self.hashes = {}
+        self.diff_hashes = {}
+        links = {}
+        try:
+            with tarfile.open(path, mode="r|*") as tar:
+                for member in tar:
+                    name = posixpath.normpath(member.name)
+                    if member.issym() or member.islnk():
+                        links[name] = posixpath.normpath(
+                            posixpath.join(posixpath.dirname(name), member.linkname)
+                            if member.issym()
+                            else member.linkname
+                        )
+                    elif member.isfile() and (hash_all or member.size <= SMALL_MEMBER):
+                        self.read_member(name, member, tar.extractfile(member))
+        except tarfile.TarError as err:
+            error_if(True, f"Failed reading image archive {path}: {err}")
+        for name, target in links.items():  # e.g. docker save dedupes layers by symlink
+            if target in self.hashes:
+                self.hashes[name] = self.hashes[target]
+            if target in self.diff_hashes:
+                self.diff_hashes[name] = self.diff_hashes[target]
+            if target in self.small:
+                self.small[name] = self.small[target]
+
+    def read_member(self, name, member, stream):
+        hasher = hashlib.sha256()
+        diff_hasher = None
+        keep = member.size <= SMALL_MEMBER
+        chunks = []
+        first = True
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if first and chunk[:2] == b"\x1f\x8b":  # gzip magic
+                diff_hasher = GunzipHasher()
+            first = False
+            if diff_hasher:
+                diff_hasher.update(chunk)
+            if keep:
+                chunks.append(chunk)
+        self.hashes[name] = hasher.hexdigest()
+        if diff_hasher:
+            self.diff_hashes[name] = diff_hasher.hexdigest()
+        if keep:
+            self.small[name] = b"".join(chunks)
+
+    def has(self, name):
+        return name in self.small
+
+    def read(self, name):
+        error_if(name not in self.small, "Image archive is missing " + name)
+        return self.small[name]
+
+    def json(self, name):
+        return json.loads(self.read(name))
+
+    def digests(self, names):
+        return {name: self.hashes.get(name) for name in names}
+
+    def diff_digests(self, names):
+        return {name: self.diff_hashes.get(name) for name in names}
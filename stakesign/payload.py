@@ -0,0 +1,155 @@
+import os
+import json
+import re
+import binascii
+from collections import namedtuple
+
+# Decoding signature payloads (transaction input data): the hex is decoded once into one buffer,
+# whose body lines are then iterated lazily as memoryview slices & parsed on demand into typed
+# entries, so that signatures covering many thousands of files, commits, or images needn't be
+# split into lists of copies upfront. Every mode's parser goes through here.
+
+# Ethereum's block gas limit keeps real transaction inputs well below this; anything larger is
+# refused before decoding.
+MAX_BYTES = 1 << 22
+MODES = ("sha256sum", "b3sum", "git", "docker")
+
+# sha256sum/b3sum manifest line (line includes the newline)
+FileEntry = namedtuple("FileEntry", ("filename", "digest", "line"))
+# git commit, optionally with tag & tag object, or submodule path for --recursive signatures
+GitEntry = namedtuple("GitEntry", ("commit", "tag", "tag_object", "submodule"))
+# docker image ID with the repo tags & digests it was signed under
+DockerEntry = namedtuple("DockerEntry", ("image_id", "signed_tags"))
+LINE_RE = re.compile(rb"[^\n]+")
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def decode(input_hex, max_bytes=MAX_BYTES):
+    """
+    decode transaction input hex string to (header dict, body memoryview), checking its size
+    before decoding
+    """
+    error_if(
+        not (isinstance(input_hex, str) and input_hex.startswith("0x")),
+        "Transaction input isn't consistent with stakesign format; check transaction ID",
+    )
+    error_if(
+        (len(input_hex) - 2) // 2 > max_bytes,
+        f"Transaction input exceeds {max_bytes} bytes; refusing to decode",
+    )
+    try:
+        buf = binascii.unhexlify(input_hex[2:])
+    except binascii.Error:
+        error_if(True, "Transaction input isn't valid hex")
+    pos = buf.find(b"\n")
+    pos = pos if pos >= 0 else len(buf)
+    try:
+        header = json.loads(buf[:pos])
+        assert isinstance(header, dict)
+        assert "stakesign" in header and isinstance(header["stakesign"], str)
+    except:
+        error_if(
+            True, "Transaction input isn't consistent with stakesign format; check transaction ID"
+        )
+    return header, memoryview(buf)[pos + 1 :]
+
+
+def lines(body):
+    "generate the nonempty lines of body (bytes or memoryview) as memoryviews, without newlines"
+    view = memoryview(body)
+    for match in LINE_RE.finditer(view):  # re scans the buffer in place
+        yield view[match.start() : match.end()]
+
+
+def file_entries(body):
+    "generate FileEntry for each line of a sha256sum/b3sum body"
+    for view in lines(body):
+        line = bytes(view)
+        escaped = line.startswith(b"\\")
+        digest, sep, filename = (line[1:] if escaped else line).partition(b" ")
+        error_if(
+            not (sep and digest and filename[:1] in (b" ", b"*") and len(filename) > 1),
+            "Invalid signature syntax",
+        )
+        try:
+            digest = digest.decode()
+            int(digest, 16)
+        except ValueError:
+            error_if(True, "Invalid signature syntax")
+        filename = filename[1:]
+        if escaped:
+            filename = unescape(filename)
+        yield FileEntry(os.fsdecode(filename), digest.lower(), line + b"\n")
+
+
+def unescape(filename):
+    ans = bytearray()
+    pos = 0
+    while pos < len(filename):
+        ch = filename[pos : pos + 1]
+        if ch == b"\\":
+            nxt = filename[pos + 1 : pos + 2]
+            error_if(nxt not in (b"\\", b"n", b"r"), "Invalid filename escape in signature body")
+            ch = {b"\\": b"\\", b"n": b"\n", b"r": b"\r"}[nxt]
+            pos += 1
+        ans += ch
+        pos += 1
+    return bytes(ans)
+
+
+def json_entries(body):
+    "generate the dict decoded from each JSON line of a git/docker body"
+    for view in lines(body):
+        try:
+            elt = json.loads(bytes(view).decode())
+            assert isinstance(elt, dict)
+        except:
+            error_if(True, "Invalid signature syntax")
+        yield elt
+
+
+def git_entries(body):
+    "generate GitEntry for each line of a git body"
+    for elt in json_entries(body):
+        entry = GitEntry(
+            elt.get("commit"), elt.get("tag"), elt.get("tagObject"), elt.get("submodule")
+        )
+        error_if(
+            not (
+                isinstance(entry.commit, str)
+                and all(val is None or isinstance(val, str) for val in entry[1:])
+                and (entry.submodule is None or valid_submodule_path(entry.submodule))
+            ),
+            "Invalid signature syntax",
+        )
+        yield entry
+
+
+def valid_submodule_path(path):
+    return bool(
+        re.fullmatch(r"[\w.@+-]+(/[\w.@+-]+)*", path, re.ASCII) and ".." not in path.split("/")
+    )
+
+
+def docker_entries(body):
+    "generate DockerEntry for each line of a docker body"
+    for elt in json_entries(body):
+        tags, digests = elt.get("akaRepoTags", []), elt.get("akaRepoDigests", [])
+        error_if(
+            not (
+                isinstance(elt.get("imageId"), str)
+                and isinstance(tags, list)
+                and isinstance(digests, list)
+                and all(isinstance(tag, str) for tag in tags + digests)
+            ),
+            "Invalid signature syntax",
+        )
+        yield DockerEntry(elt["imageId"], tags + digests)
@@ -2,35 +2,57 @@ import sys
 import json
 import argparse
 import platform
-import subprocess
 import shutil
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import dateutil
 import dateutil.parser
 import dateutil.tz
-import web3
-from .verify import print_tsv, bail, yellow, color, ANSI
-
-
-def prepare_sha256sum(files, sha256sum_exe, cwd=None, tee=False):
-    "run sha256sum on files; prepare input body for signing transaction as bytes"
-    # tee sha256sum stdout in realtime, to provide feedback whilst processing multiple large files
-    proc = subprocess.Popen([sha256sum_exe] + files, stdout=subprocess.PIPE, cwd=cwd)
-    sha256sum_stdout = []
-    while True:
-        line = proc.stdout.readline()
-        if not line:
-            break
-        sha256sum_stdout.append(line)  # includes newline
-        if tee:
-            sys.stdout.buffer.write(line)
-            sys.stdout.buffer.flush()
-    proc.wait()
-    sys.stdout.flush()
-    if proc.returncode != 0:
-        raise Exception("sha256sum failed")
-
-    return b"".join(sha256sum_stdout)
+from .console import EX_TEMPFAIL, print_tsv, bail, yellow, color, ANSI, print_transaction_input
+from .eth import gateway
+from . import manifest, shard, b3sum, api, iosched
+
+
+def load_base(base, base_time=None):
+    """
+    load previous signature body, from transaction ID or local file (manifest or payload preview);
+    returns body, signing mode, and reference time (epoch seconds) after which files are presumed
+    modified: the transaction's timestamp, or for a file, the given base_time (the file's own mtime
+    isn't evidence of when it was prepared, since copying or downloading it moves that forward)
+    """
+    if base.startswith("0x"):
+        try:
+            fetched = api.fetch_signature(base, w3=gateway())
+        except api.SignatureNotFound:
+            bail("--base transaction not found on Ethereum network")
+        except api.GatewayUnavailable as err:
+            bail(err.args[0], EX_TEMPFAIL)
+        except api.StakesignError as err:
+            bail(err.args[0])
+        sig, header, body = fetched.sig, fetched.header, fetched.body
+        print(
+            yellow(
+                "[WARN] Reusing digests for files last modified before the --base transaction's timestamp; if files changed after preparing it, use its saved manifest instead."
+            )
+        )
+        return body, header["stakesign"], sig.timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+    if base_time is None:
+        bail("--base FILE requires --base-time, when the manifest was prepared")
+    try:
+        with open(base, "rb") as infile:
+            body = infile.read()
+    except OSError as err:
+        bail(f"--base {base}: {err.strerror}")
+    mode = "sha256sum"
+    first, _, rest = body.partition(b"\n")
+    try:
+        header = json.loads(first)
+        if isinstance(header, dict) and isinstance(header.get("stakesign"), str):
+            mode = header["stakesign"]
+            body = rest
+    except ValueError:
+        pass
+    return body, mode, base_time
 
 
 def cli_subparser(subparsers):
@@ -45,11 +67,21 @@ def cli_subparser(subparsers):
         action="store_true",
         help="identifiers are git commits or tags in the current repository",
     )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="with --git: also sign the commits of all submodules pinned by the revision (recursively)",
+    )
     parser.add_argument(
         "--docker",
         action="store_true",
         help="identifiers pertain to docker images from the local dockerd",
     )
+    parser.add_argument(
+        "--b3sum",
+        action="store_true",
+        help="sign files' BLAKE3 digests (hashed in parallel) instead of SHA-256",
+    )
     parser.add_argument(
         "--stake",
         metavar="0.1",
@@ -68,17 +100,95 @@ def cli_subparser(subparsers):
         type=int,
         help="declare signature expires N days from now",
     )
+    parser.add_argument(
+        "--sort",
+        action="store_true",
+        help="sort & deduplicate files by name (canonical order, as produced by merge)",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="hash only the files in shard I of N (implies --sort); write partial manifest to --output for `stakesign merge`",
+    )
+    parser.add_argument(
+        "--output", "-o", metavar="PART", help="with --shard, partial manifest filename"
+    )
+    parser.add_argument(
+        "--base",
+        metavar="0xTXID|FILE",
+        help="previous signature (transaction ID or saved manifest) whose digests to reuse for files unmodified since",
+    )
+    parser.add_argument(
+        "--base-time",
+        metavar="DATETIME",
+        help="with --base FILE, the ISO 8601 date & time the manifest was prepared (files modified since are rehashed)",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="with --base, list files added, changed & removed since the base signature",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        metavar="BYTES",
+        type=int,
+        help="split the signature into part transactions of at most BYTES each, for manifests too large for one transaction (then see --chunk-root)",
+    )
+    parser.add_argument(
+        "--chunk-root",
+        action="store_true",
+        help="identifiers are the mined part transactions (in order) of a chunked signature: prepare its root transaction, to be signed from the same address",
+    )
+    parser.add_argument(
+        "--io-jobs",
+        metavar="N",
+        type=int,
+        help="hash up to N files concurrently in-process (instead of running sha256sum), with large sequential reads; suits network filesystems",
+    )
+    parser.add_argument(
+        "--mount-jobs",
+        metavar="N",
+        type=int,
+        default=iosched.DEFAULT_MOUNT_JOBS,
+        help="with --io-jobs, at most N concurrent readers on any one network filesystem mount (NFS, Lustre, ...)",
+    )
     parser.add_argument(
         "--chdir", "-C", metavar="DIR", type=str, help="change working directory to DIR"
     )
     return parser
 
 
-def cli(args):  # pylint: disable=R0912,R0915
+def cli(args):  # pylint: disable=R0912,R0914,R0915
     if args.expire and args.expire_days:
         bail("set at most one of --expire-days and --expire")
-    if args.docker and args.git:
-        bail("set at most one of --git and --docker")
+    if sum(bool(flag) for flag in (args.git, args.docker, args.b3sum)) > 1:
+        bail("set at most one of --git, --docker, and --b3sum")
+    if args.base and (args.docker or args.git):
+        bail("--base applies only to files")
+    if args.chunk_root and any(
+        (args.git, args.docker, args.b3sum, args.base, args.sort, args.shard, args.chunk_size)
+    ):
+        bail("--chunk-root takes just the part transaction IDs (with any --stake & --expire)")
+    if args.chunk_size and args.shard:
+        bail("--chunk-size applies to the whole manifest, not --shard")
+    if args.diff and not args.base:
+        bail("--diff requires --base")
+    if args.base_time and not (args.base and not args.base.startswith("0x")):
+        bail("--base-time applies to --base FILE")
+    if (args.sort or args.shard) and (args.docker or args.git):
+        bail("--sort and --shard apply only to files")
+    if args.recursive and not (args.git and len(args.FILE) == 1):
+        bail("--recursive applies to --git with one revision")
+    if args.io_jobs and (args.docker or args.git):
+        bail("--io-jobs applies only to files")
+    if bool(args.shard) != bool(args.output):
+        bail("--shard and --output go together")
+    shard_spec = None
+    if args.shard:
+        try:
+            shard_spec = shard.parse_shard(args.shard)
+        except shard.ErrorMessage as err:
+            bail(err.args[0])
     if args.stake_ad is None:
         print(
             yellow(
@@ -93,63 +203,176 @@ def cli(args):  # pylint: disable=R0912,R0915
         expire_utc = datetime.utcnow() + timedelta(days=args.expire_days)
     if expire_utc is not None:
         expire_utc = expire_utc.replace(tzinfo=None)
+    if args.chunk_root:
+        prepare_chunk_root(args.FILE, args.stake_ad, expire_utc)
+        return
 
-    header = {"stakesign": "sha256sum"}
+    mode = "sha256sum"
     if args.git:
-        header["stakesign"] = "git"
+        mode = "git"
     if args.docker:
-        header["stakesign"] = "docker"
-    if isinstance(expire_utc, datetime):
-        header["expire"] = f"{expire_utc}Z"
-    if isinstance(args.stake_ad, float):
-        header["stakeAd"] = {"ETH": args.stake_ad}
-    header = json.dumps(header, separators=(",", ":")) + "\n"
-
-    if args.git:
-        from .git import repository, prepare, ErrorMessage  # pylint: disable=C0415
-
-        repo_dir, repo = repository(args.chdir)
-        print_tsv("Trusting git repo:", repo_dir)
+        mode = "docker"
+    if args.b3sum:
+        mode = "b3sum"
+    header = api.payload_header(mode, stake_ad=args.stake_ad, expire=expire_utc)
+    files = args.FILE
+    sha256sum_exe = None
+    file_set = None
+    base = None
+    progress = None
+    if mode in ("sha256sum", "b3sum"):
+        if args.b3sum:
+            try:
+                print_tsv("   Trusting blake3:", "v" + b3sum.blake3_version())
+            except b3sum.ErrorMessage as err:
+                bail(err.args[0])
+        if args.io_jobs:
+            print_tsv(
+                "Hashing in-process:",
+                f"up to {args.io_jobs} files at a time",
+                f"(≤ {args.mount_jobs} per network mount)",
+            )
+        elif not args.b3sum:
+            sha256sum_exe = shutil.which("sha256sum")
+            if not sha256sum_exe:
+                msg = "`sha256sum` utility unavailable; ensure coreutils is installed and PATH is configured"
+                if platform.system() == "Darwin":
+                    msg += "\nOn macOS try: brew install coreutils"
+                bail(msg)
+            print_tsv("Trusting local exe:", sha256sum_exe)
+        if args.sort or shard_spec:
+            files = shard.canonical(files)
+        if shard_spec:
+            file_set = shard.file_set_digest(files)
+            files = [filename for filename in files if shard.member(filename, *shard_spec)]
+            print_tsv("             Shard:", args.shard, f"({len(files)} files)")
+        if args.base:
+            base_time = None
+            if args.base_time:
+                try:
+                    base_time = (
+                        dateutil.parser.isoparse(args.base_time)
+                        .astimezone(dateutil.tz.tzutc())
+                        .timestamp()
+                    )
+                except ValueError:
+                    bail("--base-time should be an ISO 8601 date & time")
+            base_body, base_mode, base_time = load_base(args.base, base_time)
+            if base_mode != mode:
+                bail(f"--base signature doesn't pertain to {mode} files")
+            print_tsv(
+                "    Base signature:",
+                args.base,
+                f"(reusing digests of files unmodified since {datetime.utcfromtimestamp(base_time)}Z)",
+            )
+            base = (base_body, base_time)
+        else:
+            print()
+            sys.stdout.write(header)  # for payload preview, followed by each line as it's hashed
+            sys.stdout.flush()
+            progress = tee_stdout
 
-        try:
-            body, warnings = prepare(repo, args.FILE)
-        except ErrorMessage as err:
-            bail(err.args[0])
-        for warnmsg in warnings:
-            print(yellow("[WARN] " + warnmsg))
-        sys.stdout.flush()
-        sys.stdout.buffer.write(header.encode())  # for payload preview
-        sys.stdout.buffer.write(body)
-    elif args.docker:
-        from .docker import DEFAULT_HOST, prepare, ErrorMessage  # pylint: disable=C0415
+    try:
+        prepared = api.prepare_payload(
+            mode,
+            files,
+            stake_ad=args.stake_ad,
+            expire=expire_utc,
+            cwd=args.chdir,
+            recursive=args.recursive,
+            sha256sum_exe=sha256sum_exe,
+            io_jobs=args.io_jobs,
+            mount_jobs=args.mount_jobs,
+            chunk_size=args.chunk_size,
+            base=base,
+            progress=progress,
+        )
+    except api.StakesignError as err:
+        bail(err.args[0])
+    body = prepared.body
 
-        print_tsv("Trusting dockerd:", DEFAULT_HOST)
-        try:
-            body, warnings = prepare(DEFAULT_HOST, args.FILE)
-        except ErrorMessage as err:
-            bail(err.args[0])
-        for warnmsg in warnings:
+    if args.git or args.docker:
+        print_tsv("Trusting git repo:" if args.git else "Trusting dockerd:", prepared.source)
+        for warnmsg in prepared.warnings:
             print(yellow("[WARN] " + warnmsg))
+    elif base:
+        changes = prepared.changes
+        if shard_spec:  # files removed from other shards aren't this one's concern
+            changes.removed[:] = [
+                filename for filename in changes.removed if shard.member(filename, *shard_spec)
+            ]
+        print_tsv(
+            "  Changes vs. base:",
+            f"{len(changes.added)} added",
+            f"{len(changes.changed)} changed",
+            f"{len(changes.removed)} removed",
+            f"({changes.rehashed} rehashed, {changes.reused} reused)",
+        )
+        if args.diff:
+            for flag, filenames in (
+                ("A", changes.added),
+                ("M", changes.changed),
+                ("D", changes.removed),
+            ):
+                for filename in filenames:
+                    print_tsv(flag, manifest.printable(filename))
+        print()
+    if not progress:
         sys.stdout.flush()
         sys.stdout.buffer.write(header.encode())  # for payload preview
         sys.stdout.buffer.write(body)
-    else:  # default sha256sum mode
-        sha256sum_exe = shutil.which("sha256sum")
-        if not sha256sum_exe:
-            msg = "`sha256sum` utility unavailable; ensure coreutils is installed and PATH is configured"
-            if platform.system() == "Darwin":
-                msg += "\nOn macOS try: brew install coreutils"
-            bail(msg)
-        print_tsv("Trusting local exe:", sha256sum_exe)
+    if args.io_jobs:
+        print()
+        iosched.print_throughput(prepared.io, width=19)
+    if shard_spec:
+        shard.write_part(args.output, prepared.header, *shard_spec, file_set, body)
         print()
+        print_tsv("Wrote partial manifest:", args.output, "(for `stakesign merge`)")
+        return
+
+    if args.chunk_size:
+        print_chunked_input(prepared.parts)
+    else:
+        print_transaction_input(header, body)
 
-        sys.stdout.write(header)  # for payload preview
-        try:
-            body = prepare_sha256sum(args.FILE, sha256sum_exe, cwd=args.chdir, tee=True)
-        except:
-            bail("`sha256sum` utility failed")
 
-    print("\n-- Transaction input data for signing (one long line):\n")
+def tee_stdout(line):
+    "echo manifest line to stdout as it's hashed"
+    sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
 
-    print(color(web3.Web3.toHex(header.encode() + body), ANSI.BOLD))
+
+def print_chunked_input(parts):
+    if not parts:
+        bail("nothing to sign")
+    for i, part in enumerate(parts):
+        print(
+            f"\n-- Part {i + 1}/{len(parts)} transaction input data for signing (one long line):\n"
+        )
+        print(color(part, ANSI.BOLD))
+    print()
+    print(
+        f"Send all {len(parts)} part transactions from the signing address; once they're mined, prepare the root transaction (with any --stake & --expire) to complete the signature:"
+    )
+    print("  stakesign prepare --chunk-root 0xPART1TXID 0xPART2TXID ...")
+    print()
+
+
+def prepare_chunk_root(part_txids, stake_ad, expire_utc):
+    for txid in part_txids:
+        if not txid.startswith("0x"):
+            bail("Transaction ID should start with 0x: " + txid)
+    try:
+        prepared = api.prepare_chunk_root(
+            part_txids, stake_ad=stake_ad, expire=expire_utc, w3=gateway()
+        )
+    except api.GatewayUnavailable as err:
+        bail(err.args[0], EX_TEMPFAIL)
+    except api.StakesignError as err:
+        bail(err.args[0])
+    print_tsv("   Signature parts:", len(part_txids), f"({prepared.mode})")
+    print_tsv("     Parts' signer:", prepared.signer, "(send the root transaction from here too)")
     print()
+    header = prepared.payload.decode()
+    sys.stdout.write(header)  # for payload preview
+    print_transaction_input(header, b"")
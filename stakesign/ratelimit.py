@@ -0,0 +1,254 @@
+import os
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+import functools
+from email.utils import parsedate_to_datetime
+import requests
+import web3
+
+# Client-side rate limiting for ETH gateway requests, so that many concurrent stakesign processes
+# (e.g. CI jobs fanning out verifications) degrade to slower throughput rather than failing when a
+# public gateway throttles them. Each gateway URI gets a token bucket whose state lives in a small
+# lock file under the user's cache directory, shared by all local processes. The bucket's rate
+# adapts: halved whenever the gateway throttles us (and paused for any Retry-After), then
+# recovering gradually. Throttled requests are retried with jittered exponential backoff; if the
+# gateway remains unavailable, ErrorMessage is raised -- distinct from transaction not found.
+
+DEFAULT_MAX_RATE = 10.0  # requests per second, unless environment STAKESIGN_GATEWAY_RATE is set
+MIN_RATE = 0.2
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 30.0
+RETRY_HTTP_STATUS = (429, 502, 503, 504)
+RATE_LIMIT_RPC_CODES = (-32005, 429)  # JSON-RPC "limit exceeded" errors of common gateways
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+class SettingError(ValueError):
+    "invalid rate limit setting (as opposed to ErrorMessage, the gateway being unavailable)"
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+class Bucket:
+    """
+    token bucket for one gateway URI, shared across processes through a lock file (or within this
+    process only, if no lock file can be used)
+    """
+
+    def __init__(self, uri, max_rate=DEFAULT_MAX_RATE):
+        self.max_rate = max(max_rate, MIN_RATE)
+        self.lock = threading.Lock()
+        self.state = None  # in-process fallback
+        self.path = None
+        try:
+            import fcntl  # noqa: F401 pylint: disable=C0415,W0611
+
+            state_dir = os.path.join(
+                os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "stakesign"
+            )
+            os.makedirs(state_dir, exist_ok=True)
+            self.path = os.path.join(
+                state_dir, "ratelimit-" + hashlib.sha256(uri.encode()).hexdigest()[:16]
+            )
+            with open(self.path, "a", encoding="utf-8"):
+                pass
+        except (ImportError, OSError):
+            self.path = None
+
+    def update(self, fn):
+        "atomically apply fn(state, now) -> (state, ans) to the shared state; return ans"
+        with self.lock:
+            if not self.path:
+                self.state, ans = fn(self.state, time.time())
+                return ans
+            import fcntl  # pylint: disable=C0415
+
+            with open(self.path, "r+", encoding="utf-8") as statefile:
+                fcntl.flock(statefile, fcntl.LOCK_EX)
+                try:
+                    state = json.loads(statefile.read() or "null")
+                    assert state is None or isinstance(state, dict)
+                except (ValueError, AssertionError):
+                    state = None
+                state, ans = fn(state, time.time())
+                statefile.seek(0)
+                statefile.truncate()
+                statefile.write(json.dumps(state))
+                statefile.flush()
+            return ans
+
+    def refill(self, state, now):
+        state = dict(state or {"tokens": self.max_rate, "rate": self.max_rate, "until": 0.0})
+        state["rate"] = min(max(state.get("rate", self.max_rate), MIN_RATE), self.max_rate)
+        elapsed = max(now - state.get("time", now), 0.0)
+        # burst capacity of one second's worth, but at least one request (else slow rates stall)
+        burst = max(state["rate"], 1.0)
+        state["tokens"] = min(state.get("tokens", 0.0) + elapsed * state["rate"], burst)
+        state["time"] = now
+        return state
+
+    def acquire(self):
+        "wait for a token"
+
+        def take(state, now):
+            state = self.refill(state, now)
+            if now < state["until"]:
+                return state, state["until"] - now
+            if state["tokens"] >= 1.0:
+                state["tokens"] -= 1.0
+                return state, 0.0
+            return state, (1.0 - state["tokens"]) / state["rate"]
+
+        while True:
+            wait = self.update(take)
+            if wait <= 0.0:
+                return
+            time.sleep(wait)
+
+    def succeeded(self):
+        "additive increase of the rate after a successful request"
+
+        def increase(state, now):
+            state = self.refill(state, now)
+            state["rate"] = min(state["rate"] + self.max_rate / 50, self.max_rate)
+            return state, None
+
+        self.update(increase)
+
+    def throttled(self, retry_after=None):
+        "multiplicative decrease of the rate, and pause everyone for any retry_after seconds"
+
+        def decrease(state, now):
+            state = self.refill(state, now)
+            state["rate"] = max(state["rate"] / 2, MIN_RATE)
+            state["tokens"] = min(state["tokens"], 0.0)
+            if retry_after:
+                state["until"] = max(state["until"], now + retry_after)
+            return state, None
+
+        self.update(decrease)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(uri, max_rate=DEFAULT_MAX_RATE):
+    with _buckets_lock:
+        if uri not in _buckets:
+            _buckets[uri] = Bucket(uri, max_rate)
+        return _buckets[uri]
+
+
+def max_rate_setting():
+    "max requests per second from environment STAKESIGN_GATEWAY_RATE, or DEFAULT_MAX_RATE"
+    value = os.environ.get("STAKESIGN_GATEWAY_RATE")
+    if value is None:
+        return DEFAULT_MAX_RATE
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = math.nan
+    if not (math.isfinite(rate) and rate > 0):
+        raise SettingError(
+            f"Environment STAKESIGN_GATEWAY_RATE should be a positive number of requests per second, not {value!r}"
+        )
+    return rate
+
+
+def middleware(make_request, w3, max_rate=DEFAULT_MAX_RATE):
+    "web3 middleware applying the gateway's shared rate limit & retrying throttled requests"
+    uri = getattr(w3.provider, "endpoint_uri", None)
+    if not (isinstance(uri, str) and uri.split(":", 1)[0] in ("http", "https", "ws", "wss")):
+        return make_request  # local node (IPC)
+    bucket = bucket_for(uri, max_rate)
+
+    def request(method, params):
+        return send(bucket, make_request, method, params)
+
+    return request
+
+
+def install(w3):
+    "add the rate-limiting middleware to web3 instance; raises SettingError for a bad setting"
+    max_rate = max_rate_setting()  # (reading the environment now, not at import time)
+    if isinstance(w3.provider, web3.HTTPProvider):
+        # supersede HTTPProvider's default middleware, which retries failures immediately
+        w3.provider.middlewares = ()
+    w3.middleware_onion.add(functools.partial(middleware, max_rate=max_rate), "stakesign_ratelimit")
+    return w3
+
+
+def send(bucket, make_request, method, params):
+    "make_request(method, params) subject to bucket, retrying throttled or timed-out attempts"
+    for attempt in range(MAX_ATTEMPTS):
+        bucket.acquire()
+        retry_after = None
+        try:
+            response = make_request(method, params)
+        except requests.exceptions.HTTPError as err:
+            status = err.response.status_code if err.response is not None else None
+            if status not in RETRY_HTTP_STATUS:
+                raise
+            reason = f"HTTP {status}"
+            retry_after = parse_retry_after(err.response.headers.get("Retry-After"))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+            reason = type(err).__name__
+        else:
+            reason = rate_limit_error(response)
+            if not reason:
+                bucket.succeeded()
+                return response
+        bucket.throttled(retry_after)
+        error_if(
+            attempt + 1 >= MAX_ATTEMPTS,
+            f"ETH gateway unavailable or rate-limiting us ({reason}) after {MAX_ATTEMPTS} attempts; try again later or through another gateway",
+        )
+        time.sleep(backoff(attempt, retry_after))
+    assert False
+
+
+def rate_limit_error(response):
+    "description of JSON-RPC response's rate-limiting error, if it is one"
+    error = response.get("error") if isinstance(response, dict) else None
+    if not isinstance(error, dict):
+        return None
+    message = str(error.get("message", ""))
+    if error.get("code") in RATE_LIMIT_RPC_CODES or any(
+        phrase in message.lower()
+        for phrase in ("rate limit", "too many requests", "limit exceeded")
+    ):
+        return f"JSON-RPC error {error.get('code')}"
+    return None
+
+
+def backoff(attempt, retry_after=None):
+    "seconds to wait before retry: exponential with full jitter, but at least retry_after"
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def parse_retry_after(value):
+    "Retry-After header (seconds, or HTTP date) as seconds from now, or None"
+    if not value:
+        return None
+    try:
+        return min(max(float(value), 0.0), BACKOFF_CAP * 4)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(when - time.time(), 0.0), BACKOFF_CAP * 4)
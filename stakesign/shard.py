@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from .console import print_tsv, bail, print_transaction_input
+from . import manifest
+
+# Partial manifest from `prepare --shard I/N --output PART`: one JSON line
+#   {"stakesignShard":{"shard":I,"of":N,"fileSet":"<sha256>"},"header":{...}}
+# followed by the sha256sum lines for the shard's files. fileSet digests the complete (sorted,
+# deduplicated) file list, so that merge can detect gaps.
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def parse_shard(arg):
+    "parse I/N shard specification (1 <= I <= N)"
+    try:
+        shard, of = (int(part) for part in arg.split("/"))
+        assert 1 <= shard <= of
+    except:
+        error_if(True, "--shard should be I/N with 1 <= I <= N")
+    return shard, of
+
+
+def canonical(files):
+    "canonical (sorted & deduplicated) order of filenames"
+    return sorted(set(files), key=os.fsencode)
+
+
+def member(filename, shard, of):
+    "whether filename belongs to the shard (deterministic by path hash)"
+    digest = hashlib.sha256(os.fsencode(filename)).digest()
+    return int.from_bytes(digest[:8], "big") % of == shard - 1
+
+
+def file_set_digest(files):
+    "digest of the canonical file list"
+    ans = hashlib.sha256()
+    for filename in canonical(files):
+        ans.update(os.fsencode(filename) + b"\0")
+    return ans.hexdigest()
+
+
+def write_part(filename, header, shard, of, file_set, body):
+    shard_info = {"shard": shard, "of": of, "fileSet": file_set}
+    line = json.dumps({"stakesignShard": shard_info, "header": header}, separators=(",", ":"))
+    with open(filename, "wb") as outfile:
+        outfile.write(line.encode() + b"\n")
+        outfile.write(body)
+
+
+def read_part(filename):
+    "read partial manifest; returns shard info, header, and [(filename, digest, line)]"
+    with open(filename, "rb") as infile:
+        first, _, body = infile.read().partition(b"\n")
+    try:
+        first = json.loads(first)
+        shard_info = first["stakesignShard"]
+        header = first["header"]
+        assert isinstance(header, dict) and isinstance(header.get("stakesign"), str)
+        assert isinstance(shard_info["shard"], int) and isinstance(shard_info["of"], int)
+        assert isinstance(shard_info["fileSet"], str)
+    except:
+        error_if(True, "Not a partial manifest from `stakesign prepare --shard`: " + filename)
+    try:
+        entries = manifest.parse(body)
+    except manifest.ErrorMessage as err:
+        error_if(True, f"{err.args[0]} ({filename})")
+    return shard_info, header, entries
+
+
+def merge(parts):
+    """
+    merge partial manifests into the header & body that a single `prepare --sort` run would
+    produce, rejecting overlapping, missing, or inconsistent shards
+    """
+    error_if(not parts, "No partial manifests")
+    shard_infos = {}
+    header = None
+    file_set = None
+    of = None
+    lines = {}
+    for part in parts:
+        shard_info, part_header, entries = read_part(part)
+        if header is None:
+            header, file_set, of = part_header, shard_info["fileSet"], shard_info["of"]
+        error_if(
+            part_header != header,
+            "Partial manifests have different headers (set --expire rather than --expire-days when sharding)",
+        )
+        error_if(
+            (shard_info["fileSet"], shard_info["of"]) != (file_set, of),
+            "Partial manifests were prepared from different file lists: " + part,
+        )
+        error_if(shard_info["shard"] in shard_infos, f"Duplicate shard {shard_info['shard']}/{of}")
+        shard_infos[shard_info["shard"]] = part
+        for filename, _, line in entries:
+            error_if(
+                not member(filename, shard_info["shard"], of),
+                f"Partial manifest {part} covers a file outside its shard",
+            )
+            error_if(filename in lines, "Partial manifests overlap")
+            lines[filename] = line
+    missing = [f"{shard}/{of}" for shard in range(1, of + 1) if shard not in shard_infos]
+    error_if(missing, "Missing shard(s): " + " ".join(missing))
+    error_if(
+        file_set_digest(lines.keys()) != file_set,
+        "Merged files don't match the sharded file list (gaps in partial manifests)",
+    )
+    body = b"".join(lines[filename] for filename in canonical(lines.keys()))
+    return json.dumps(header, separators=(",", ":")) + "\n", body
+
+
+def cli_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "merge",
+        help="merge partial manifests from `prepare --shard` for signature",
+        description="Combine the partial manifests from `stakesign prepare --shard I/N --output PART` run for each I, yielding the same data as a single `stakesign prepare --sort` run.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("PART", nargs="+", help="partial manifest files")
+    return parser
+
+
+def cli(args):
+    try:
+        header, body = merge(args.PART)
+    except ErrorMessage as err:
+        bail(err.args[0])
+    print_tsv("Merged shards:", len(args.PART))
+    print()
+    sys.stdout.flush()
+    sys.stdout.buffer.write(header.encode())  # for payload preview
+    sys.stdout.buffer.write(body)
+    print_transaction_input(header, body)
@@ -0,0 +1,209 @@
+import os
+import sys
+import heapq
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import manifest
+
+# Strict verification of a whole directory tree against a signature: besides files that are
+# missing or modified, reports any unexpected (unsigned) files found in the tree. The signed
+# filenames are sorted by their bytes -- in runs spilled to temporary files, merged lazily, if
+# there are many -- and merge-joined against a walk of the tree in the same order, so memory use
+# doesn't grow with the number of entries (only with the largest single directory). The walk
+# orders each directory's subdirectories as if named "NAME/", so that it yields paths in plain
+# bytewise order, as the sorted manifest.
+
+RUN_ENTRIES = 100000  # signature entries sorted in memory at a time, before spilling to disk
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+def normalize(filename):
+    "signed filename as a relative path within the tree (no ./, //, or trailing /)"
+    path = os.path.normpath(filename)
+    error_if(
+        os.path.isabs(path) or path == os.pardir or path.startswith(os.pardir + os.sep),
+        f"--tree: signature lists a file outside the tree: {manifest.printable(filename)}",
+    )
+    return path
+
+
+def sorted_entries(body, tmpdir, run_entries=RUN_ENTRIES):
+    "generate (path, hex digest) for each entry of signature body, sorted by path bytes"
+    runs = []
+    run = []
+    for filename, digest, _ in manifest.entries(body):
+        run.append((os.fsencode(normalize(filename)), digest))
+        if len(run) >= run_entries:
+            runs.append(spill(sorted(run), tmpdir))
+            run = []
+    run.sort()
+    merged = heapq.merge(*(read_run(path) for path in runs), run) if runs else run
+    return ((os.fsdecode(key), digest) for key, digest in merged)
+
+
+def spill(run, tmpdir):
+    "write sorted run of (path bytes, digest) to a temporary file of manifest lines; return path"
+    fd, path = tempfile.mkstemp(dir=tmpdir, suffix=".sha256sum")
+    with os.fdopen(fd, "wb") as outfile:
+        for key, digest in run:
+            outfile.write(manifest.format_line(digest, os.fsdecode(key)))
+    return path
+
+
+def read_run(path):
+    "generate (path bytes, digest) from spilled run, lazily"
+    with open(path, "rb") as infile:
+        for line in infile:
+            for filename, digest, _ in manifest.entries(line):
+                yield os.fsencode(filename), digest
+
+
+def walk(top):
+    """
+    generate path (relative to top) of each non-directory in the tree, in bytewise order; raises
+    OSError if a directory can't be listed
+    """
+
+    def listing(rel):
+        with os.scandir(os.path.join(top, rel)) as it:
+            children = [
+                (
+                    os.fsencode(entry.name)
+                    + (b"/" if entry.is_dir(follow_symlinks=False) else b""),
+                    os.path.join(rel, entry.name),
+                )
+                for entry in it
+            ]
+        return iter(sorted(children))
+
+    stack = [listing("")]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+        elif child[0].endswith(b"/"):
+            stack.append(listing(child[1]))
+        else:
+            yield child[1]
+
+
+def join(signed, local):
+    """
+    merge-join sorted (path, digest) of signed files with sorted local paths; generate
+    (path, digest or None if unsigned, whether the file is present)
+    """
+    signed = iter(signed)
+    local = iter(local)
+    sig = next(signed, None)
+    loc = next(local, None)
+    while sig is not None or loc is not None:
+        sig_key = os.fsencode(sig[0]) if sig is not None else None
+        loc_key = os.fsencode(loc) if loc is not None else None
+        if loc_key is None or (sig_key is not None and sig_key < loc_key):
+            yield sig[0], sig[1], False
+            sig = next(signed, None)
+        elif sig_key is None or loc_key < sig_key:
+            yield loc, None, True
+            loc = next(local, None)
+        else:
+            yield sig[0], sig[1], True
+            sig = next(signed, None)
+            if sig is None or sig[0] != loc:  # (a path listed repeatedly is checked each time)
+                loc = next(local, None)
+
+
+def statuses(body, top, hash_file, tmpdir, jobs=1):
+    """
+    generate (path, status) for the tree at top vs. signature body: OK, FAILED, MISSING, or
+    UNEXPECTED (not in the signature). Hashes files with hash_file(path) -> hex digest (raising
+    OSError if unreadable), up to jobs concurrently, within a bounded window of entries read ahead.
+    """
+
+    def hash_or_error(path):
+        try:
+            return hash_file(path)
+        except OSError as err:
+            return err
+
+    def status(path, digest, present, future):
+        if digest is None:
+            return path, "UNEXPECTED"
+        if not present:
+            return path, "MISSING"
+        local_digest = future.result()
+        if isinstance(local_digest, OSError):
+            return path, "MISSING"
+        return path, ("OK" if local_digest == digest else "FAILED")
+
+    jobs = max(jobs, 1)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        # one pass over the join: each entry waits in the window (of any kind, so its size is
+        # bounded) until reported in order, meanwhile hashing if it's a signed file present
+        window = deque()
+        for path, digest, present in join(sorted_entries(body, tmpdir), walk(top)):
+            future = None
+            if digest is not None and present:
+                future = pool.submit(hash_or_error, os.path.join(top, path))
+            window.append((path, digest, present, future))
+            if len(window) >= 4 * jobs:
+                yield status(*window.popleft())
+        while window:
+            yield status(*window.popleft())
+
+
+def check(
+    body, top, hash_file, tool, jobs=1, ignore_missing=False, report=None, quiet=False
+):  # pylint: disable=R0913
+    """
+    check the tree at top against signature body (see statuses); report as manifest.check, plus
+    status UNEXPECTED, & return success
+    """
+    counts = {"OK": 0, "FAILED": 0, "MISSING": 0, "UNEXPECTED": 0}
+    suffixes = {
+        "OK": ": OK",
+        "FAILED": ": FAILED",
+        "MISSING": ": FAILED open or read",
+        "UNEXPECTED": ": UNEXPECTED (not in signature)",
+    }
+    with tempfile.TemporaryDirectory(prefix="stakesign-tree-") as tmpdir:
+        try:
+            for path, status in statuses(body, top, hash_file, tmpdir, jobs):
+                counts[status] += 1
+                if report:
+                    report(path, status)
+                if not (quiet or (status == "MISSING" and ignore_missing)):
+                    print(manifest.printable(path) + suffixes[status])
+                    sys.stdout.flush()
+        except OSError as err:
+            error_if(True, f"--tree: {err.filename}: {err.strerror}")
+    if not quiet:
+        if counts["FAILED"]:
+            print(
+                f"{tool}: WARNING: {counts['FAILED']} computed checksum(s) did NOT match",
+                file=sys.stderr,
+            )
+        if counts["MISSING"] and not ignore_missing:
+            print(
+                f"{tool}: WARNING: {counts['MISSING']} listed file(s) could not be read",
+                file=sys.stderr,
+            )
+        if counts["UNEXPECTED"]:
+            print(
+                f"{tool}: WARNING: {counts['UNEXPECTED']} file(s) in the tree aren't in the signature",
+                file=sys.stderr,
+            )
+    return (
+        not counts["FAILED"]
+        and not counts["UNEXPECTED"]
+        and (ignore_missing or not counts["MISSING"])
+        and counts["OK"] > 0
+    )
@@ -1,140 +1,13 @@
-import json
-import os
+import hashlib
 import sys
 import argparse
-import subprocess
 import shutil
-import tempfile
 import math
 from datetime import datetime, timedelta
-import dateutil
-import dateutil.tz
-import dateutil.parser
 import web3
-from web3.datastructures import AttributeDict
-
-
-DEFAULT_STAKE_FLOOR_ETH = 0.1
-
-
-def get_sig(w3, txid):
-    "Query blockchain for signature transaction details"
-    tx = w3.eth.getTransaction(txid)
-    txr = w3.eth.getTransactionReceipt(txid)
-    block_num = tx.blockNumber
-    if not block_num:
-        raise web3.exceptions.TransactionNotFound("transaction pending (no block number yet)")
-    blk = w3.eth.getBlock(block_num)
-
-    signer = txr["from"]
-    assert tx["from"] == signer
-
-    return AttributeDict(
-        {
-            "id": txid,
-            "timestamp": datetime.utcfromtimestamp(blk.timestamp),
-            "block": tx.blockNumber,
-            "signer": signer,
-            "input": tx.input,
-        }
-    )
-
-
-def decode_sig_input(w3, sig):
-    "Decode signature input data to header dict & body bytes"
-    assert isinstance(sig.input, str) and sig.input.startswith("0x")
-    buf = w3.toBytes(hexstr=sig.input)
-    pos = buf.find(b"\n")
-    pos = pos if pos >= 0 else len(pos)
-    try:
-        hdr = json.loads(buf[:pos])
-        assert isinstance(hdr, dict)
-        assert "stakesign" in hdr and isinstance(hdr["stakesign"], str)
-    except:
-        raise ValueError(
-            "Transaction input isn't consistent with stakesign format; check transaction ID"
-        ) from None
-    bod = buf[(pos + 1) :]
-    return (hdr, bod)
-
-
-def check_sig_expire(header, utcnow):
-    assert isinstance(utcnow, datetime)
-    expire = None
-    if "expire" in header:
-        try:
-            assert isinstance(header["expire"], str)
-            expire = (
-                dateutil.parser.isoparse(header["expire"])
-                .astimezone(dateutil.tz.tzutc())
-                .replace(tzinfo=None)
-            )
-        except:
-            raise ValueError(
-                "Transaction header.expire has invalid value (expected ISO 8601)"
-            ) from None
-    return AttributeDict(
-        {
-            "unexpired": expire and expire > utcnow,
-            "expire_utc": expire,
-            "now_utc": utcnow,
-        }
-    )
-
-
-def check_sig_stake(w3, sig, header, stake_floor_wei, ignore_ad=False):
-    "Check whether the signing address has sufficient current ETH balance"
-    assert isinstance(header, dict)
-    assert isinstance(stake_floor_wei, int)
-
-    signer_wei = w3.eth.getBalance(sig.signer)
-    assert isinstance(signer_wei, int)
-
-    required_wei = stake_floor_wei
-    required_wei_source = "--stake"
-    if not ignore_ad and "stakeAd" in header:
-        stake_ad = header["stakeAd"]
-        if not isinstance(stake_ad, dict):
-            raise ValueError("Transaction header.stakeAd has invalid value")
-        if "ETH" in stake_ad:
-            stake_ad = stake_ad["ETH"]
-            if not (isinstance(stake_ad, float) and math.isfinite(stake_ad)):
-                raise ValueError("Transaction header.stakeAd has invalid ETH value")
-            stake_ad = w3.toWei(stake_ad, "ether")
-            if stake_ad > required_wei:
-                required_wei = stake_ad
-                required_wei_source = "stakeAd"
-        else:
-            print(color("[WARN] Transaction header.stakeAd doesn't specify ETH value", ANSI.BHYEL))
-
-    return AttributeDict(
-        {
-            "enough": signer_wei >= required_wei,
-            "signer_wei": signer_wei,
-            "required_wei": required_wei,
-            "required_wei_source": required_wei_source,
-        }
-    )
-
-
-def verify_sha256sum(header, body, exe, ignore_missing=False, no_strict=False, cwd=None):
-    "run given sha256sum executable to verify signature body"
-    assert header["stakesign"] == "sha256sum"
-    assert isinstance(body, bytes)
-
-    cmd = [exe, "--check"]
-    if not no_strict:
-        cmd.append("--strict")
-    if ignore_missing:
-        cmd.append("--ignore-missing")
-
-    with tempfile.NamedTemporaryFile() as tmp:
-        tmp.write(body)
-        tmp.flush()
-        cmd.append(tmp.name)
-        res = subprocess.run(cmd, check=False, cwd=cwd)
-
-    return res.returncode == 0
+from .console import EX_TEMPFAIL, print_tsv, bail, color, yellow, ANSI
+from .eth import DEFAULT_STAKE_FLOOR_ETH, gateway, decode_sig_input
+from . import manifest, iosched
 
 
 def cli_subparser(subparsers):
@@ -179,18 +52,97 @@ def cli_subparser(subparsers):
         metavar="HEAD",
         help="expect signature of git commits/tags & specify the local revision to verify (default HEAD)",
     )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="with --git: also verify the checked-out submodules against the signed submodule commits",
+    )
     parser.add_argument(
         "--docker",
         dest="docker_handle",
         metavar="TAG",
         help="expect signature of docker image(s) and specify the local image tag/digest/ID to verify",
     )
+    parser.add_argument(
+        "--docker-archive",
+        metavar="PATH",
+        help="with --docker: read images from a `docker save` tarball or OCI image layout (directory or tar) instead of dockerd",
+    )
+    parser.add_argument(
+        "--verify-layers",
+        action="store_true",
+        help="with --docker-archive: also rehash the image layers to check them against the image config/manifest",
+    )
     parser.add_argument(
         "--file", dest="files_only", action="store_true", help="expect signature of file(s)"
     )
     parser.add_argument(
         "--chdir", "-C", metavar="DIR", type=str, help="change working directory to DIR"
     )
+    parser.add_argument(
+        "--archive",
+        metavar="FILE",
+        help="check signed files against the members of a tar[.gz|.bz2|.xz|.zst] or zip archive, without extracting",
+    )
+    parser.add_argument(
+        "--url",
+        metavar="PATH=URL",
+        action="append",
+        help="check signed file PATH by streaming it from http(s) URL instead of reading local file (repeatable)",
+    )
+    parser.add_argument(
+        "--url-list",
+        metavar="FILE",
+        help="file of tab-separated PATH & URL lines, as for --url",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=4,
+        help="concurrent downloads for --url, submodules checked for --recursive, or parts fetched for chunked signatures",
+    )
+    parser.add_argument(
+        "--io-jobs",
+        metavar="N",
+        type=int,
+        help="hash up to N local files concurrently in-process (instead of running sha256sum), with large sequential reads; suits network filesystems",
+    )
+    parser.add_argument(
+        "--mount-jobs",
+        metavar="N",
+        type=int,
+        default=iosched.DEFAULT_MOUNT_JOBS,
+        help="with --io-jobs, at most N concurrent readers on any one network filesystem mount (NFS, Lustre, ...)",
+    )
+    parser.add_argument(
+        "--install",
+        metavar="DEST",
+        help="copy signed files into DEST, hashing them in flight; each file lands (atomically) only once verified",
+    )
+    parser.add_argument(
+        "--tree",
+        metavar="DIR",
+        help="strictly verify the whole directory tree DIR against the signed files, also failing on any unexpected (unsigned) files it contains",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="after verifying files, keep watching them (Linux inotify), rehashing any that change & periodically rechecking the stake, until interrupted",
+    )
+    parser.add_argument(
+        "--stake-interval",
+        metavar="SECONDS",
+        type=float,
+        default=300.0,
+        help="with --watch, how often to recheck the signer's stake",
+    )
+    parser.add_argument(
+        "--bundle",
+        metavar="FILE",
+        help="verify offline using transaction & stake proofs saved by `stakesign bundle`, instead of querying ETH gateway",
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -200,24 +152,39 @@ def cli_subparser(subparsers):
 
 
 def cli(args):  # pylint: disable=R0912,R0914,R0915
-    provider_msg = "(from environment WEB3_PROVIDER_URI)"
-    if "WEB3_PROVIDER_URI" not in os.environ:
-        os.environ["WEB3_PROVIDER_URI"] = "https://cloudflare-eth.com"
-        provider_msg = "(to override, set environment WEB3_PROVIDER_URI)"
-
-    print("\t".join(("Trusting ETH gateway:", os.environ["WEB3_PROVIDER_URI"], provider_msg)))
-    from web3.auto import w3  # pylint: disable=C0415
+    from . import api  # pylint: disable=C0415
 
     # get transaction info
     if not args.signature.startswith("0x"):
         bail("Transaction ID should start with 0x")
-    try:
-        sig = get_sig(w3, args.signature)
-    except web3.exceptions.TransactionNotFound as err:
-        bail(
-            "Transaction not found on Ethereum network; check transaction ID, or try later or through another gateway: "
-            + str(err)
-        )
+    stake = None
+    if args.bundle:
+        from . import bundle  # pylint: disable=C0415
+
+        w3 = web3.Web3  # for unit conversions only; no network access
+        print_tsv("     Trusting bundle:", args.bundle)
+        try:
+            sig, stake = bundle.load(args.bundle)
+        except bundle.ErrorMessage as err:
+            bail(err.args[0])
+        if sig.id.lower() != args.signature.lower():
+            bail("Bundle pertains to a different transaction")
+        try:
+            header, body = decode_sig_input(w3, sig)
+        except ValueError as err:
+            bail(str(err))
+        if header["stakesign"] == "chunked":
+            bail("Bundles don't cover the parts of chunked signatures")
+        parts = []
+    else:
+        w3 = gateway()
+        try:
+            fetched = api.fetch_signature(args.signature, w3=w3, jobs=args.jobs)
+        except api.GatewayUnavailable as err:
+            bail(err.args[0], EX_TEMPFAIL)
+        except api.StakesignError as err:
+            bail(err.args[0])
+        sig, header, body, parts = (fetched[key] for key in ("sig", "header", "body", "parts"))
 
     utcnow = datetime.utcnow().replace(tzinfo=None)
     sig_age = utcnow - sig.timestamp
@@ -228,115 +195,124 @@ def cli(args):  # pylint: disable=R0912,R0914,R0915
         f"{sig.timestamp}Z",
         yellow(f"({sig_age} ago)", sig_age < timedelta(days=3)),
     )
+    if parts:
+        blocks = [part.block for part in parts]
+        print_tsv("     Signature parts:", len(parts), f"(blocks {min(blocks)}…{max(blocks)})")
 
-    # decode signature, check expiration date
-    header, body = decode_sig_input(w3, sig)
-    exinfo = check_sig_expire(header, utcnow)
-    if exinfo.expire_utc is not None:
-        print_tsv(
-            "Signature expiration:",
-            f"{exinfo.expire_utc}Z",
-            f"{color('🗹', ANSI.BHGRN) if exinfo.unexpired else color('✗', ANSI.BHRED)}",
+    # check expiration date & stake
+    try:
+        checked = api.check_signature(
+            w3,
+            sig,
+            header,
+            stake_floor_eth=args.stake_floor_eth,
+            ignore_ad=args.ignore_ad,
+            expired_ok=args.expired_ok,
+            utcnow=utcnow,
+            signer_wei=(stake.signer_wei if stake else None),
         )
-        if not (args.expired_ok or exinfo.unexpired):
-            bail("Signature's stated expiration date has passed")
-
-    # check stake
-    vs = check_sig_stake(
-        w3,
-        sig,
-        header,
-        w3.toWei(args.stake_floor_eth, "ether"),
-        ignore_ad=args.ignore_ad,
-    )
-    print_tsv(
-        "Signer's balance now:",
-        f"{w3.fromWei(vs.signer_wei, 'ether')}",
-        f"{'≥' if vs.enough else '<'} {w3.fromWei(vs.required_wei, 'ether')} ETH from {vs.required_wei_source}",
-        f"{color('🗹', ANSI.BHGRN) if vs.enough else color('✗', ANSI.BHRED)}",
-    )
-    if not vs.enough:
-        msg = "Signer's address holds insufficient ETH balance, possibly indicating revocation or compromise!"
-        if vs.required_wei_source == "--stake":
-            msg += f"\n        If you're certain this address is trustworthy, rerun with --stake {w3.fromWei(vs.signer_wei, 'ether')}"
+    except api.GatewayUnavailable as err:
+        bail(err.args[0], EX_TEMPFAIL)
+    except (api.InvalidSignature, api.GatewayError) as err:
+        bail(err.args[0])
+    except api.StakesignError as err:
+        print_sig_checks(w3, err.result, stake, utcnow)
+        msg = err.args[0]
+        if (
+            isinstance(err, api.InsufficientStake)
+            and err.result.stake.required_wei_source == "--stake"
+        ):
+            msg += f"\n        If you're certain this address is trustworthy, rerun with --stake {w3.fromWei(err.result.stake.signer_wei, 'ether')}"
         bail(msg)
+    print_sig_checks(w3, checked, stake, utcnow)
 
     # verify, per mode
-    warnings = []
     mode = header["stakesign"]
-    if mode == "sha256sum":
-        if args.git_revision:
-            bail("Signature applies to files, not git")
-        if args.docker_handle:
-            bail("Signature applies to files, not docker")
-        sha256sum_exe = shutil.which("sha256sum")
-        if not sha256sum_exe:
-            bail(
-                "`sha256sum` utility unavailable; ensure coreutils is installed and PATH is configured"
-            )
-        print_tsv("  Trusting local exe:", sha256sum_exe)
-        print()
-        if not verify_sha256sum(
-            header,
-            body,
-            sha256sum_exe,
-            ignore_missing=args.ignore_missing,
-            no_strict=args.no_strict,
-            cwd=args.chdir,
-        ):
-            bail("sha256sum verification failed!")
-    elif mode == "git":
-        if args.files_only:
-            bail("Signature applies to git, not files")
-        if args.docker_handle:
-            bail("Signature applies to git, not docker")
-        from .git import repository, verify, ErrorMessage  # pylint: disable=C0415
-
-        try:
-            repo_dir, repo = repository(args.chdir)
-        except:
-            bail(
-                "Signature pertains to git commit, but current working directory isn't a git repository"
-            )
-        revision = args.git_revision if args.git_revision else "HEAD"
-        print_tsv("Local git repository:", repo_dir)
-        print_tsv("  Local git revision:", revision)
-        try:
-            msg, warnings = verify(repo, revision, body, ignore_missing=args.ignore_missing)
-        except ErrorMessage as err:
-            bail(err.args[0])
+    expect = None
+    if args.files_only:
+        expect = "files"
+    elif args.git_revision:
+        expect = "git"
+    elif args.docker_handle:
+        expect = "docker"
+    remote = args.url or args.url_list
+    if args.watch and (mode not in ("sha256sum", "b3sum") or args.bundle or remote or args.archive):
+        bail("--watch applies to local files, verified online (not --bundle, --archive, or --url)")
+    options = {
+        "expect": expect,
+        "cwd": args.chdir,
+        "ignore_missing": args.ignore_missing,
+        "git_revision": args.git_revision,
+        "recursive": args.recursive,
+        "docker_handle": args.docker_handle,
+        "docker_archive": args.docker_archive,
+        "verify_layers": args.verify_layers,
+        "archive": args.archive,
+        "install": args.install,
+        "jobs": args.jobs,
+        "no_strict": args.no_strict,
+        "quiet": False,
+        "io_jobs": args.io_jobs,
+        "mount_jobs": args.mount_jobs,
+        "tree": args.tree,
+    }
+    try:
+        if remote:
+            from .remote import parse_urls, ErrorMessage  # pylint: disable=C0415
+
+            try:
+                options["urls"] = parse_urls(args.url, args.url_list)
+            except ErrorMessage as err:
+                bail(err.args[0])
+        api.check_verify_options(header, **options)  # UsageError before printing anything further
+        if mode in ("sha256sum", "b3sum") and expect in (None, "files"):
+            print_files_trust(args, mode, options)
+        elif mode == "docker" and expect in (None, "docker"):
+            if args.docker_archive:
+                print_tsv("    Reading images from:", args.docker_archive)
+            else:
+                from .docker import DEFAULT_HOST  # pylint: disable=C0415
+
+                print_tsv("    Trusting dockerd:", DEFAULT_HOST)
+        watcher = None
+        if args.watch:
+            from . import watch, install  # pylint: disable=C0415
+
+            try:  # start watching before the initial verification, to miss nothing in between
+                if args.install:  # ...including the installation of the files
+                    install.make_dirs(body, args.install)
+                watcher = watch.Watcher(
+                    body, watch_hash_file(mode), cwd=(args.install or args.tree or args.chdir)
+                )
+            except (watch.ErrorMessage, manifest.ErrorMessage, install.ErrorMessage) as err:
+                bail(err.args[0])
+            except OSError as err:
+                bail(f"{err.filename}: {err.strerror}")
+        result = api.verify_objects(header, body, **options)
+    except api.StakesignError as err:
+        bail(err.args[0])
+
+    if mode == "git":
+        print_tsv("Local git repository:", result.repo_dir)
+        print_tsv("  Local git revision:", result.revision)
+    elif mode == "docker" and args.verify_layers:
+        print_tsv("    Verified image layers:", args.docker_archive)
+    if result.io:
         print()
-        print(msg)
+        iosched.print_throughput(result.io)
+    if mode in ("git", "docker"):
         print()
-    elif mode == "docker":
-        if args.files_only:
-            bail("Signature applies to docker, not files")
-        if args.git_revision:
-            bail("Signature applies to docker, not git")
-        from .docker import DEFAULT_HOST, verify, ErrorMessage  # pylint: disable=C0415
-
-        print_tsv("    Trusting dockerd:", DEFAULT_HOST)
-        try:
-            verifications, warnings = verify(
-                DEFAULT_HOST, body, args.docker_handle, args.ignore_missing
-            )
-        except ErrorMessage as err:
-            bail(err.args[0])
-        print()
-        for msg in verifications:
+        for msg in result.verified:
             print(msg)
         print()
-    else:
-        bail(
-            "Signing mode not one of {sha256sum, git, docker}; a newer version of this utility might support the necessary mode."
-        )
 
-    for warnmsg in warnings:
+    warnings = bool(result.warnings)
+    for warnmsg in result.warnings:
         print(yellow("[WARN] " + warnmsg))
     if math.fabs(args.stake_floor_eth - DEFAULT_STAKE_FLOOR_ETH) < (DEFAULT_STAKE_FLOOR_ETH / 1000):
         print(
             yellow(
-                f"[WARN] Ensure the signer's current {w3.fromWei(vs.signer_wei, 'ether')} ETH stake evinces their ongoing interest in securing it.\n"
+                f"[WARN] Ensure the signer's current {w3.fromWei(checked.stake.signer_wei, 'ether')} ETH stake evinces their ongoing interest in securing it.\n"
                 + f"       (Set --stake above the default {DEFAULT_STAKE_FLOOR_ETH} ETH minimum to clear this warning.)",
             )
         )
@@ -350,35 +326,133 @@ def cli(args):  # pylint: disable=R0912,R0914,R0915
         print()
         print(w3.toBytes(hexstr=sig.input).decode("utf-8").rstrip("\n"))
 
+    if watcher:
+        watcher.seed(result.files)
+        watch_files(args, w3, sig, header, watcher)
 
-def print_tsv(*args, **kwargs):
-    print("\t".join(str(arg) for arg in args), **kwargs)
 
+def watch_hash_file(mode):
+    from . import api, b3sum  # pylint: disable=C0415
 
-def bail(msg):
-    msg = "[ERROR] " + msg
-    if sys.stderr.isatty() and "NO_COLOR" not in os.environ:
-        print(ANSI.BHRED + msg + ANSI.RESET, file=sys.stderr)
-    else:
-        print(msg, file=sys.stderr)
-    sys.exit(1)
+    if mode == "b3sum":
+        return b3sum.hash_file
+    return lambda filename: api.hash_file(filename, hashlib.sha256)
 
 
-def color(msg, col):
-    if sys.stdout.isatty() and "NO_COLOR" not in os.environ:
-        return col + msg + ANSI.RESET
-    return msg
+def watch_files(args, w3, sig, header, watcher):
+    "follow changes to the verified files & recheck stake until interrupted; exit status 1 if bad"
+    import signal  # pylint: disable=C0415
+    from . import api, watch  # pylint: disable=C0415
 
+    stake_violation = None
+
+    def recheck():
+        nonlocal stake_violation
+        try:
+            api.check_signature(
+                w3,
+                sig,
+                header,
+                stake_floor_eth=args.stake_floor_eth,
+                ignore_ad=args.ignore_ad,
+                expired_ok=args.expired_ok,
+            )
+            if stake_violation:
+                watch.print_report("(signature)", "OK")
+            stake_violation = None
+        except api.GatewayError as err:
+            print(yellow(f"[WARN] Stake recheck failed, will retry: {err.args[0]}"))
+        except api.StakesignError as err:
+            stake_violation = err.args[0]
+            watch.print_report("(signature) " + stake_violation, "FAILED")
+        except Exception as err:  # pylint: disable=W0703
+            print(yellow(f"[WARN] Stake recheck failed, will retry: {err}"))
+
+    print()
+    print_tsv(
+        "Watching for changes:",
+        f"{len(watcher.digests)} files",
+        f"(rechecking stake every {args.stake_interval:g}s; interrupt to stop)",
+    )
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop cleanly as on ^C
+    try:
+        watcher.run(watch.print_report, recheck, args.stake_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    if stake_violation or any(
+        status == "FAILED" or (status == "MISSING" and not args.ignore_missing)
+        for status in watcher.status.values()
+    ):
+        sys.exit(1)
+
+
+def print_sig_checks(w3, checked, stake, utcnow):
+    "print signature expiration & stake check results (so far as determined)"
+    exinfo = checked.expire
+    if exinfo.expire_utc is not None:
+        print_tsv(
+            "Signature expiration:",
+            f"{exinfo.expire_utc}Z",
+            f"{color('🗹', ANSI.BHGRN) if exinfo.unexpired else color('✗', ANSI.BHRED)}",
+        )
+    vs = checked.stake
+    if not vs:
+        return
+    for warning in vs.warnings:
+        print(color("[WARN] " + warning, ANSI.BHYEL))
+    if stake:
+        from . import bundle  # pylint: disable=C0415
+
+        bundle.print_stake_block(stake, utcnow)
+    print_tsv(
+        "Signer's balance now:" if not stake else "    Signer's balance:",
+        f"{w3.fromWei(vs.signer_wei, 'ether')}",
+        f"{'≥' if vs.enough else '<'} {w3.fromWei(vs.required_wei, 'ether')} ETH from {vs.required_wei_source}",
+        f"{color('🗹', ANSI.BHGRN) if vs.enough else color('✗', ANSI.BHRED)}",
+    )
 
-def yellow(msg, only_if=True):
-    return color(msg, ANSI.BHYEL) if only_if else msg
 
+def print_files_trust(args, mode, options):
+    "print what file verification will trust/read, & select sha256sum exe as applicable"
+    from . import b3sum  # pylint: disable=C0415
 
-class ANSI:
-    # https://gist.github.com/RabaDabaDoba/145049536f815903c79944599c6f952a
-    # https://espterm.github.io/docs/VT100%20escape%20codes.html
-    RESET = "\x1b[0m"
-    BHRED = "\x1b[1;91m"
-    BHYEL = "\x1b[1;93m"
-    BHGRN = "\x1b[1;92m"
-    BOLD = "\x1b[1m"
+    if mode == "b3sum":
+        try:
+            print_tsv("     Trusting blake3:", "v" + b3sum.blake3_version())
+        except b3sum.ErrorMessage as err:
+            bail(err.args[0])
+    if options.get("urls"):
+        print_tsv("   Streaming from URLs:", len(options["urls"]), f"(up to {args.jobs} at a time)")
+    elif args.archive:
+        print_tsv("    Checking archive:", args.archive)
+    if args.install and not args.archive:
+        print_tsv("     Installing into:", args.install)
+    if args.tree:
+        print_tsv(" Checking whole tree:", args.tree, "(strict: no unsigned files)")
+    if args.io_jobs:
+        print_tsv(
+            "  Hashing in-process:",
+            f"up to {args.io_jobs} files at a time",
+            f"(≤ {args.mount_jobs} per network mount)",
+        )
+        print()
+    elif mode == "sha256sum" and not (
+        options.get("urls") or args.archive or args.install or args.tree
+    ):
+        options["sha256sum_exe"] = trusted_sha256sum()
+    else:
+        print()
+
+
+def trusted_sha256sum():
+    sha256sum_exe = shutil.which("sha256sum")
+    if not sha256sum_exe:
+        bail(
+            "`sha256sum` utility unavailable; ensure coreutils is installed and PATH is configured"
+        )
+    print_tsv("  Trusting local exe:", sha256sum_exe)
+    print()
+    return sha256sum_exe
@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from datetime import datetime
+from .console import print_tsv, color, ANSI
+from . import manifest
+
+# verify --watch: after the initial verification, follow inotify events on the directories holding
+# the signed files, rehashing only files that are modified, moved, or replaced; and periodically
+# recheck the signer's stake. Watching the directories (not the files themselves) also catches
+# files replaced by rename, as package managers & deploy tools do.
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+# wait for a file to be quiet this long before rehashing it (e.g. while it's being written)
+SETTLE_SECONDS = 1.0
+
+
+class ErrorMessage(Exception):
+    pass
+
+
+def error_if(cond, msg):
+    if cond:
+        raise ErrorMessage(msg) from None
+
+
+class Inotify:
+    "minimal Linux inotify binding via ctypes"
+
+    def __init__(self):
+        error_if(not sys.platform.startswith("linux"), "--watch requires Linux inotify")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        error_if(self.fd < 0, "inotify_init1 failed: " + os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        "list of available events as (wd, mask, name)"
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        ans = []
+        pos = 0
+        while pos < len(buf):
+            wd, mask, _, namelen = EVENT_HEADER.unpack_from(buf, pos)
+            pos += EVENT_HEADER.size
+            name = buf[pos : pos + namelen].rstrip(b"\0")
+            pos += namelen
+            ans.append((wd, mask, os.fsdecode(name)))
+        return ans
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:  # pylint: disable=R0902
+    """
+    Watch the files signed in body (relative to cwd), hashing changed ones with hash_file(path) and
+    comparing to the signed digests. Construct before the initial verification, so that no change
+    in between goes unnoticed; then seed() the statuses with its results.
+    """
+
+    def __init__(self, body, hash_file, cwd=None):
+        self.hash_file = hash_file
+        self.cwd = cwd or "."
+        self.digests = {}
+        for filename, digest, _ in manifest.parse(body):
+            self.digests[os.path.normpath(filename)] = digest
+        self.status = {filename: "OK" for filename in self.digests}
+        self.signed_dirs = {os.path.dirname(filename) for filename in self.digests}
+        self.dirty = {}  # filename -> time of last event
+        self.dirs = {}  # wd -> directory
+        self.inotify = Inotify()
+        for directory in sorted(self.signed_dirs):  # (parents before their subdirectories)
+            # a missing directory is noticed when (re)created, only if its parent is watched
+            error_if(
+                not self.watch_dir(directory)
+                and not (directory and os.path.dirname(directory) in self.dirs.values()),
+                f"Can't watch {os.path.normpath(os.path.join(self.cwd, directory))}: no such directory",
+            )
+
+    def seed(self, files):
+        """
+        set files' initial statuses from the initial verification's [(filename, status)]; any it
+        didn't report (as when running sha256sum, which skips files missing under --ignore-missing)
+        are OK if present, else MISSING
+        """
+        reported = {os.path.normpath(filename): status for filename, status in files}
+        for filename in self.digests:
+            status = reported.get(filename)
+            if status is None:
+                status = "OK" if os.path.isfile(os.path.join(self.cwd, filename)) else "MISSING"
+            self.status[filename] = status
+
+    def watch_dir(self, directory):
+        try:
+            wd = self.inotify.add_watch(os.path.join(self.cwd, directory or "."), WATCH_MASK)
+        except OSError as err:
+            error_if(
+                err.errno not in (errno.ENOENT, errno.ENOTDIR),
+                f"Can't watch {directory or '.'}: {err.strerror}",
+            )
+            return False
+        self.dirs[wd] = directory
+        return True
+
+    def run(self, report, recheck, recheck_interval):
+        """
+        Process events until interrupted: report(filename, status) each rehashed file's status (OK,
+        FAILED, or MISSING), and call recheck() every recheck_interval seconds
+        """
+        next_recheck = time.monotonic() + recheck_interval
+        while True:
+            now = time.monotonic()
+            timeout = next_recheck - now
+            if self.dirty:
+                timeout = min(timeout, min(self.dirty.values()) + SETTLE_SECONDS - now)
+            readable, _, _ = select.select([self.inotify.fd], [], [], max(timeout, 0))
+            if readable:
+                self.handle_events(self.inotify.read())
+            now = time.monotonic()
+            settled = [fn for fn, t in self.dirty.items() if now - t >= SETTLE_SECONDS]
+            for filename in sorted(settled):
+                del self.dirty[filename]
+                self.check(filename, report)
+            if now >= next_recheck:
+                recheck()
+                next_recheck = now + recheck_interval
+
+    def handle_events(self, events):
+        now = time.monotonic()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:  # events lost; rehash everything
+                self.dirty.update((filename, now) for filename in self.digests)
+                continue
+            if wd not in self.dirs:
+                continue
+            directory = self.dirs[wd]
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # directory itself went away: check all of its files (now missing, presumably)
+                del self.dirs[wd]
+                self.dirty.update(
+                    (filename, now)
+                    for filename in self.digests
+                    if os.path.dirname(filename) == directory
+                )
+                continue
+            filename = os.path.normpath(os.path.join(directory, name))
+            if filename in self.digests:
+                self.dirty[filename] = now
+            elif filename in self.signed_dirs:
+                # a watched directory was (re)created: resume watching it and check its files
+                if self.watch_dir(filename):
+                    self.dirty.update(
+                        (fn, now) for fn in self.digests if os.path.dirname(fn) == filename
+                    )
+
+    def check(self, filename, report):
+        try:
+            ok = self.hash_file(os.path.join(self.cwd, filename)) == self.digests[filename]
+            status = "OK" if ok else "FAILED"
+        except OSError:
+            status = "MISSING"
+        if status != self.status[filename] or status != "OK":
+            report(filename, status)
+        self.status[filename] = status
+
+    def close(self):
+        self.inotify.close()
+
+
+def print_report(filename, status):
+    print_tsv(
+        f"{datetime.utcnow().replace(microsecond=0)}Z",
+        color(status, ANSI.BHGRN if status == "OK" else ANSI.BHRED),
+        manifest.printable(filename),
+    )
+    sys.stdout.flush()
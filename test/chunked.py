@@ -0,0 +1,73 @@
+# Offline checks of chunked signature splitting & reassembly, with stubbed part transactions
+# (run by cli.t)
+import json
+import hashlib
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from stakesign import chunked, manifest
+
+body = b"".join(
+    manifest.format_line(hashlib.sha256(str(i).encode()).hexdigest(), f"file{i}")
+    for i in range(100)
+)
+
+parts = chunked.split(body, 1000)
+assert len(parts) > 1 and b"".join(parts) == body
+assert all(len(part) <= 1000 and part.endswith(b"\n") for part in parts)
+try:
+    chunked.split(body, 10)
+    assert False
+except chunked.ErrorMessage as err:
+    assert "exceeds" in err.args[0]
+
+
+def part_sigs(bodies, part_signer="0xA", block=1, part_mode="sha256sum"):
+    return {
+        f"0x{i:064x}": AttributeDict(
+            {
+                "input": Web3.toHex(chunked.part_header(part_mode).encode() + part),
+                "signer": part_signer,
+                "block": block,
+            }
+        )
+        for i, part in enumerate(bodies)
+    }
+
+
+sigs = part_sigs(parts)
+header_line, mode, signer = chunked.prepare_root(
+    list(sigs), sigs.__getitem__, {"stakesign": "sha256sum", "stakeAd": {"ETH": 1}}
+)
+assert (mode, signer) == ("sha256sum", "0xA")
+root_header = json.loads(header_line)
+assert chunked.check_root(root_header) == ("sha256sum", list(sigs))
+root = AttributeDict({"signer": "0xA", "block": 2})
+
+mode_header, assembled, assembled_parts = chunked.assemble(root, root_header, sigs.__getitem__)
+assert bytes(assembled) == body and len(assembled_parts) == len(parts)
+assert mode_header == {"stakesign": "sha256sum", "stakeAd": {"ETH": 1}}
+
+
+def rejects(msg, root_sig, header, get_sig, **kwargs):
+    try:
+        chunked.assemble(root_sig, header, get_sig, **kwargs)
+    except chunked.ErrorMessage as err:
+        assert msg in err.args[0], err.args[0]
+        return
+    assert False, msg
+
+
+rejects("different signer", AttributeDict({"signer": "0xB", "block": 2}), root_header, sigs.get)
+rejects("mined after", AttributeDict({"signer": "0xA", "block": 0}), root_header, sigs.get)
+rejects("digest", root, dict(root_header, sha256="0" * 64), sigs.get)
+rejects("refusing to assemble", root, root_header, sigs.get, max_bytes=len(body) - 1)
+b3_sigs = part_sigs(parts, part_mode="b3sum")
+rejects("isn't of mode", root, dict(root_header, parts=list(b3_sigs)), b3_sigs.get)
+for bad in ({"parts": []}, {"parts": [list(sigs)[0]] * 2}, {"mode": "bogus"}):
+    try:
+        chunked.check_root(dict(root_header, **bad))
+        assert False, bad
+    except chunked.ErrorMessage:
+        pass
+
+print("chunked signature checks OK")
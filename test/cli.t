@@ -13,7 +13,7 @@ stakesign="python3 -m stakesign"
 export TMPDIR=$(mktemp -d -t stakesign-test-XXXXXX)
 cd "$TMPDIR"
 
-plan tests 35
+plan tests 78
 
 ###################################################################################################
 # stakesign verify
@@ -23,21 +23,74 @@ cp "${REPO}/LICENSE" .
 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf
 is "$?" 0 "verify LICENSE"
 
+$stakesign bundle 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf -o LICENSE.bundle.json
+is "$?" 0 "export bundle"
+WEB3_PROVIDER_URI=http://localhost:1/ $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --bundle LICENSE.bundle.json
+is "$?" 0 "verify LICENSE offline from bundle"
+$stakesign verify 0x248d9fac23ab037111c4bffdf25dd09f9dbdf1c34c6114365f0bdbe50294c483 --bundle LICENSE.bundle.json
+is "$?" 1 "reject bundle for different transaction"
+
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --install installed && cmp LICENSE installed/LICENSE
+is "$?" 0 "verify --install LICENSE"
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --tree installed
+is "$?" 0 "verify --tree"
+echo 42 > installed/unsigned
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --tree installed | tee stdout.log
+is "$?" 1 "verify --tree rejects unexpected file"
+grep --silent "unsigned: UNEXPECTED" stdout.log
+is "$?" 0 "verify --tree reports unexpected file"
+mkdir archived && tar czf archived/LICENSE.tar.gz LICENSE
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --archive archived/LICENSE.tar.gz
+is "$?" 0 "verify --archive LICENSE.tar.gz"
+head -c 400 archived/LICENSE.tar.gz > archived/truncated.tar.gz
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --archive archived/truncated.tar.gz 2> >(tee stderr.log >&2)
+is "$?" 1 "verify --archive rejects truncated archive"
+grep --silent "Failed reading archive" stderr.log
+is "$?" 0 "verify --archive truncated archive reason"
+mkdir served && cp LICENSE served/
+python3 -m http.server 18545 --bind 127.0.0.1 --directory served >/dev/null 2>&1 &
+HTTP_PID=$!
+sleep 1
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --url LICENSE=http://127.0.0.1:18545/LICENSE --install fetched && cmp LICENSE fetched/LICENSE
+is "$?" 0 "verify --url LICENSE from HTTP server"
+kill $HTTP_PID
+
 WEB3_PROVIDER_URI=https://main-rpc.linkpool.io/ $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf | tee stdout.log
 is "$?" 0 "WEB3_PROVIDER_URI override succeeded"
 grep --silent linkpool stdout.log
 is "$?" 0 "WEB3_PROVIDER_URI override effective"
+grep --silent "(HTTPS, .*ms RTT)" stdout.log
+is "$?" 0 "gateway transport & round-trip time displayed"
+WEB3_PROVIDER_URI=file:///nonexistent.ipc $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf 2> >(tee stderr.log >&2)
+is "$?" 1 "unreachable WEB3_PROVIDER_URI IPC socket"
+grep --silent "ETH gateway file:///nonexistent.ipc unreachable" stderr.log
+is "$?" 0 "unreachable WEB3_PROVIDER_URI IPC socket reason"
 
 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --stake 99 2> >(tee stderr.log >&2)
 is "$?" 1 "reject higher stake"
 grep --silent "insufficient ETH balance" stderr.log
 is "$?" 0 "reject higher stake reason"
 
+(sleep 5; echo 42 >> LICENSE) &
+timeout --preserve-status 15 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --watch | tee stdout.log
+is "$?" 1 "verify --watch exits with error after file changed"
+grep --silent "FAILED.*LICENSE" stdout.log
+is "$?" 0 "verify --watch reports modified LICENSE"
+cp "${REPO}/LICENSE" .
+
+(sleep 5; echo 42 >> installed_watched/LICENSE) &
+timeout --preserve-status 15 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --install installed_watched --watch | tee stdout.log
+is "$?" 1 "verify --install --watch exits with error after installed file changed"
+grep --silent "FAILED.*LICENSE" stdout.log
+is "$?" 0 "verify --install --watch reports modified installed LICENSE"
+
 echo 42 >> LICENSE
 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf 2> >(tee stderr.log >&2)
 is "$?" 1 "reject tampered LICENSE"
 grep --silent "sha256sum verification failed" stderr.log
 is "$?" 0 "reject tampered LICENSE reason"
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --install installed_tampered
+is "$?$(ls installed_tampered)" 1 "reject tampered LICENSE --install"
 
 rm LICENSE
 $stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf | tee stdout.log
@@ -65,6 +118,44 @@ is "$?" "0" "prepare LICENSE with options"
 grep --silent "0x7b227374616b657369676e223a2273686132353673756d222c22657870697265223a22323033382d30312d31392030333a31343a30385a222c227374616b654164223a7b22455448223a39392e307d7d0a3266393161366633336634663264373265643463643663333633663165373263646464373236623464333563326166333533353666323536613534653735613020204c4943454e53450a" stdout.log
 is "$?" "0" "prepare LICENSE with options correctly"
 
+$stakesign prepare --b3sum LICENSE | tee stdout.log
+is "$?" "0" "prepare LICENSE --b3sum"
+grep --silent "0x7b227374616b657369676e223a22623373756d227d0a3130353265366561326534303134343535636636636462316161396161313566633939396236323130313134353837363366343961653936373435646666313720204c4943454e53450a" stdout.log
+is "$?" "0" "prepare LICENSE --b3sum correctly"
+
+$stakesign prepare --io-jobs 2 LICENSE | tee stdout.log
+is "$?" "0" "prepare LICENSE --io-jobs"
+grep --silent "0x7b227374616b657369676e223a2273686132353673756d227d0a3266393161366633336634663264373265643463643663333633663165373263646464373236623464333563326166333533353666323536613534653735613020204c4943454e53450a" stdout.log && grep --silent "Read from mount:" stdout.log
+is "$?" "0" "prepare LICENSE --io-jobs correctly, with per-mount throughput"
+
+sha256sum LICENSE > base.sha256sum
+echo 42 > NEWFILE
+$stakesign prepare --base base.sha256sum --diff LICENSE NEWFILE
+is "$?" "1" "prepare --base FILE requires --base-time"
+$stakesign prepare --base nonexistent.sha256sum --base-time "$(date -u +%Y-%m-%dT%H:%M:%SZ)" LICENSE 2> >(tee stderr.log >&2)
+is "$?" "1" "prepare --base nonexistent file"
+$stakesign prepare --base base.sha256sum --base-time "$(date -u +%Y-%m-%dT%H:%M:%SZ)" --diff LICENSE NEWFILE | tee stdout.log
+is "$?" "0" "prepare incrementally from --base"
+grep --silent "1 added" stdout.log && grep --silent "$(sha256sum NEWFILE)" stdout.log
+is "$?" "0" "prepare incrementally from --base correctly"
+
+$stakesign prepare --chunk-size 100 LICENSE NEWFILE | tee stdout.log
+is "$?" "0" "prepare --chunk-size"
+grep --silent "Part 2/2" stdout.log && grep --silent "0x7b227374616b657369676e223a2270617274222c226d6f6465223a2273686132353673756d227d0a" stdout.log
+is "$?" "0" "prepare --chunk-size into part transactions"
+python3 "${REPO}/test/chunked.py"
+is "$?" "0" "split, check & reassemble chunked signature (offline)"
+python3 "${REPO}/test/payload.py"
+is "$?" "0" "decode payloads: size limit, header-only & malformed lines (offline)"
+
+$stakesign prepare --sort NEWFILE LICENSE base.sha256sum | tee stdout.log
+is "$?" "0" "prepare --sort"
+$stakesign prepare --shard 1/2 -o part1 LICENSE NEWFILE base.sha256sum && $stakesign prepare --shard 2/2 -o part2 base.sha256sum NEWFILE LICENSE
+is "$?" "0" "prepare --shard"
+$stakesign merge part2 part1 | tee merged.log
+grep --silent "$(grep 0x7b stdout.log)" merged.log
+is "$?" "0" "merge shards identically to prepare --sort"
+
 ###################################################################################################
 # git
 ###################################################################################################
@@ -87,12 +178,47 @@ is "$?" "0" "succeed git refs"
 grep --silent "$(git rev-parse HEAD)" stdout.log && grep --silent '"tag":"some-lightweight-tag"' stdout.log && grep --silent '"tag":"some-annotated-tag","tagObject":"' stdout.log
 is "$?" "0" "resolve git refs"
 
+git init super
+git -C super config user.email "aphacker@mit.edu"
+git -C super config user.name "Alyssa P. Hacker"
+git -C super -c protocol.file.allow=always submodule add "$(pwd)" lib
+git -C super commit -m 'stakesign test superproject'
+$stakesign prepare -C super --git --recursive --stake 0.66 HEAD | tee stdout.log
+is "$?" "0" "succeed git --recursive"
+grep --silent "{\"submodule\":\"lib\",\"commit\":\"$(git rev-parse HEAD)\"}" stdout.log
+is "$?" "0" "sign submodule commit"
+# verify --recursive through the API, which the CLI wraps, as no on-chain signature covers this repo
+cat > verify_recursive.py <<'EOF'
+import sys, stakesign
+prepared = stakesign.prepare_payload("git", ["HEAD"], cwd="super", recursive=True)
+try:
+    result = stakesign.verify_objects(prepared.header, prepared.body, cwd=sys.argv[1], recursive=True)
+except stakesign.StakesignError as err:
+    sys.exit(str(err))
+print("\n".join(result.verified))
+EOF
+python3 verify_recursive.py super | tee stdout.log
+is "$?" "0" "verify git --recursive"
+git clone super super_clone  # leaves submodule lib uninitialized (empty)
+python3 verify_recursive.py super_clone 2> >(tee stderr.log >&2)
+is "$?" "1" "verify git --recursive rejects submodule not checked out"
+grep --silent "submodule lib isn't checked out" stderr.log
+is "$?" "0" "verify git --recursive rejects submodule not checked out for correct reason"
+
 git clone https://github.com/mlin/spVCF.git
 git -C spVCF config user.email "aphacker@mit.edu"
 git -C spVCF config user.name "Alyssa P. Hacker"
 git -C spVCF checkout -b wip 5bb4229a162689516
 $stakesign verify -C spVCF 0x248d9fac23ab037111c4bffdf25dd09f9dbdf1c34c6114365f0bdbe50294c483
 is "$?" "0" "verify signed HEAD"
+$stakesign verify -C spVCF 0x248d9fac23ab037111c4bffdf25dd09f9dbdf1c34c6114365f0bdbe50294c483 --recursive 2> >(tee stderr.log >&2)
+is "$?" "1" "verify --recursive rejects signature without submodules"
+grep --silent "Signature doesn't cover any submodules" stderr.log
+is "$?" "0" "verify --recursive rejects signature without submodules for correct reason"
+$stakesign verify 0xd071c0e8fbcbcab8b92f9098c5250d7e1c003f222c94fe0729669bae02ae3acf --recursive 2> >(tee stderr.log >&2)
+is "$?" "1" "verify --recursive rejects file signature"
+grep --silent "recursive applies to git, not sha256sum" stderr.log
+is "$?" "0" "verify --recursive rejects file signature for correct reason"
 git -C spVCF checkout -b wip2 4ad2c2955c4ee2598
 $stakesign verify -C spVCF 0x248d9fac23ab037111c4bffdf25dd09f9dbdf1c34c6114365f0bdbe50294c483 2> >(tee stderr.log >&2)
 is "$?" "1" "reject unsigned HEAD"
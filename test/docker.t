@@ -13,7 +13,7 @@ stakesign="python3 -m stakesign"
 export TMPDIR=$(mktemp -d -t stakesign-docker-test-XXXXXX)
 cd "$TMPDIR"
 
-plan tests 11
+plan tests 16
 
 ###################################################################################################
 # stakesign docker image signing (separate from cli.t because GitHub Actions macOS doesn't docker)
@@ -56,3 +56,17 @@ $stakesign verify 0x406017fc96f8de18256429a5907de528b6fefebd9a4898b5b37a519300b2
 is "$?" 1 "reject tag referring to wrong image"
 grep --silent "refers to a different image" stderr.log
 is "$?" 0 "reject tag referring to wrong image for correct reason"
+
+docker save -o glnexus.tar quay.io/mlin/glnexus:v1.2.5
+docker rmi -f quay.io/mlin/glnexus:v1.2.5 quay.io/mlin/glnexus:v1.2.6
+$stakesign verify 0x406017fc96f8de18256429a5907de528b6fefebd9a4898b5b37a519300b2e1d7 --stake 1.0 --ignore-missing --docker-archive glnexus.tar --verify-layers
+is "$?" 0 "verify image from docker save tarball"
+$stakesign verify 0x406017fc96f8de18256429a5907de528b6fefebd9a4898b5b37a519300b2e1d7 --stake 1.0 --docker-archive glnexus.tar
+is "$?" 1 "fail with only image 1 in docker save tarball"
+$stakesign verify 0x406017fc96f8de18256429a5907de528b6fefebd9a4898b5b37a519300b2e1d7 --stake 1.0 --ignore-missing --docker-archive nonexistent.tar
+is "$?" 1 "fail with missing docker save tarball"
+
+$stakesign audit 0x406017fc96f8de18256429a5907de528b6fefebd9a4898b5b37a519300b2e1d7 --stake 1.0 --docker-archive glnexus.tar --fail-unsigned | tee stdout.log
+is "$?" 0 "audit docker save tarball"
+grep --silent "^signed" stdout.log
+is "$?" 0 "audit reports signed image"
@@ -0,0 +1,89 @@
+# Offline checks of the signature payload decoder: size limit, header-only payloads, and malformed
+# body lines (run by cli.t)
+from web3 import Web3
+from stakesign import payload
+
+
+def rejects(msg, fn, *args, **kwargs):
+    try:
+        fn(*args, **kwargs)
+    except payload.ErrorMessage as err:
+        assert msg in err.args[0], err.args[0]
+        return
+    assert False, msg
+
+
+def entries(parse, text):
+    return list(parse(text))
+
+
+header_line = b'{"stakesign":"sha256sum"}'
+digest = "ab" * 32
+
+# size limit, checked before decoding
+rejects("exceeds 16 bytes", payload.decode, Web3.toHex(header_line), max_bytes=16)
+rejects("exceeds", payload.decode, "0x" + "00" * (payload.MAX_BYTES + 1))
+header, body = payload.decode(Web3.toHex(header_line), max_bytes=len(header_line))
+assert header == {"stakesign": "sha256sum"}
+
+# header-only payloads have an empty body, with or without the newline
+for data in (header_line, header_line + b"\n"):
+    header, body = payload.decode(Web3.toHex(data))
+    assert header == {"stakesign": "sha256sum"} and bytes(body) == b""
+    assert entries(payload.file_entries, body) == []
+    assert entries(payload.git_entries, body) == []
+
+# malformed transaction input & header
+rejects("isn't consistent", payload.decode, "7b7d")
+rejects("valid hex", payload.decode, "0x7b7")
+for bad in (b"not json\n", b"[]\n", b'{"stakesign":1}\n', b"{}\n"):
+    rejects("isn't consistent", payload.decode, Web3.toHex(bad))
+
+# manifest lines (blank lines skipped; \-escaped filenames unescaped)
+body = f"{digest}  a b\n\n\\{digest}  c\\\\d\\ne\n{digest.upper()} *f\n".encode()
+assert [(entry.filename, entry.digest) for entry in payload.file_entries(body)] == [
+    ("a b", digest),
+    ("c\\d\ne", digest),
+    ("f", digest),
+]
+for bad in (
+    f"{digest}\n",  # no filename
+    f"{digest} x\n",  # one space
+    f"{digest}  \n",  # empty filename
+    "xyz  file\n",  # not hex
+    f"  {digest}\n",  # no digest
+):
+    rejects("Invalid signature syntax", entries, payload.file_entries, bad.encode())
+rejects("Invalid filename escape", entries, payload.file_entries, f"\\{digest}  a\\t\n".encode())
+
+# entries are parsed lazily: those before a malformed line are generated first
+lazy = payload.file_entries(f"{digest}  ok\ngarbage\n".encode())
+assert next(lazy).filename == "ok"
+rejects("Invalid signature syntax", next, lazy)
+
+# git & docker JSON lines
+commit = "cd" * 20
+assert entries(payload.git_entries, f'{{"commit":"{commit}","tag":"v1"}}\n'.encode()) == [
+    payload.GitEntry(commit, "v1", None, None)
+]
+for bad in (
+    "not json",
+    "[]",
+    "{}",
+    '{"commit":1}',
+    f'{{"commit":"{commit}","tag":2}}',
+    f'{{"commit":"{commit}","submodule":"../escape"}}',
+    f'{{"commit":"{commit}","submodule":"/abs"}}',
+):
+    rejects("Invalid signature syntax", entries, payload.git_entries, bad.encode() + b"\n")
+assert entries(
+    payload.docker_entries, b'{"imageId":"sha256:00","akaRepoTags":["x:1"],"akaRepoDigests":[]}'
+) == [payload.DockerEntry("sha256:00", ["x:1"])]
+for bad in (
+    '{"akaRepoTags":[]}',
+    '{"imageId":"i","akaRepoTags":"x:1"}',
+    '{"imageId":"i","akaRepoDigests":[1]}',
+):
+    rejects("Invalid signature syntax", entries, payload.docker_entries, bad.encode())
+
+print("payload decoder checks OK")